@@ -0,0 +1,57 @@
+"""
+Offline check of context compaction: a fact repeated across summaries is kept once, the more
+detailed restatement wins over a shorter earlier one (at the earlier one's place), unrelated
+facts are kept, and the rendered context stays within the token budget.
+
+Exits 1 when any check fails. No network access.
+
+Usage: python benchmarks/compaction_check.py
+"""
+import os
+import sys
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+SHORT_FACT = "The Widget reconciles ledgers overnight for finance teams."
+LONG_FACT = ("The Widget reconciles ledgers overnight for finance teams and flags anomalies "
+             "before the month-end close, with audit-ready exports.")
+WEBSITE_SUMMARY = f"Website Summary:\n- {SHORT_FACT}\n- Plans start at 99 dollars per month."
+DECK_SUMMARY = f"Deck Summary:\n- {LONG_FACT}\n- Founded by accountants in 2015."
+
+
+def run_checks():
+    """Returns a list of (check name, passed, detail)."""
+    from src.context_compactor import compact_context
+    from src.token_utils import count_tokens
+
+    context, stats = compact_context([WEBSITE_SUMMARY, DECK_SUMMARY], token_budget=4000)
+    website_part = context.split("Deck Summary:")[0]
+    repeated = compact_context([WEBSITE_SUMMARY, WEBSITE_SUMMARY.replace("Website", "Blog")], token_budget=4000)[0]
+    budget = 30
+    trimmed = compact_context([WEBSITE_SUMMARY, DECK_SUMMARY] * 5, token_budget=budget)[0]
+    return [
+        ("duplicate counted", stats["duplicates_removed"] == 1, f"{stats['duplicates_removed']} duplicate(s) removed"),
+        ("longer restatement kept", LONG_FACT in context and SHORT_FACT not in context,
+         "the deck's detailed wording replaces the website's shorter one"),
+        ("kept at the earlier place", LONG_FACT in website_part, "the fact stays under the website summary"),
+        ("exact repeat kept once", repeated.count(SHORT_FACT) == 1, f"{repeated.count(SHORT_FACT)} copies"),
+        ("unrelated facts kept", "99 dollars" in context and "Founded by accountants" in context, "pricing and history"),
+        ("budget respected", count_tokens(trimmed) <= budget, f"{count_tokens(trimmed)} of {budget} tokens"),
+    ]
+
+
+def main():
+    results = run_checks()
+    for name, passed, detail in results:
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}: {detail}")
+    failures = [name for name, passed, _ in results if not passed]
+    if failures:
+        print(f"\nFAIL: {len(failures)} compaction check(s) failed.")
+        return 1
+    print("\nOK: compaction checks passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,120 @@
+"""
+Offline check of the site crawler against a fixture site served over http.server: sitemap
+discovery (a page linked from nowhere but a nested sitemap), same-site link following (and
+no off-site links), the max_pages limit, and near-duplicate removal when pages are merged.
+
+Exits 1 when any check fails. No network access.
+
+Usage: python benchmarks/crawler_check.py
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from urllib.parse import urlparse
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from pipeline_benchmark import _serve_directory # noqa: E402
+
+BLOG_POSTS = 12
+NAVIGATION = '<nav><a href="/about.html">About</a> <a href="/products/widget.html">Widget</a></nav>'
+TAGLINE = "Trusted by 500 finance teams." # On every page, so it is site-wide boilerplate
+WIDGET_COPY = (
+    "The Widget reconciles every ledger overnight and flags anomalies before the month-end close. "
+    "Controllers review exceptions in one queue instead of chasing numbers across spreadsheets. "
+    "Audit-ready reports export in a single click, with every adjustment traced back to its source entry. "
+    "Integrations with the major ERPs mean no new data entry, and setup takes an afternoon rather than a quarter. "
+    "Teams that switched closed their books four days faster on average in their first year."
+)
+
+
+def _page(title, body, links=()):
+    anchors = " ".join(f'<a href="{href}">{text}</a>' for href, text in links)
+    return (f"<html><head><title>{title}</title></head><body>{NAVIGATION}<main><h1>{title}</h1>"
+            f"<p>{body}</p><p>{anchors}</p><p>{TAGLINE}</p></main><footer>Footer text</footer></body></html>")
+
+
+def write_fixture_site(directory, base_url):
+    """Writes the fixture pages and sitemaps; sitemap entries need the server's base URL."""
+    files = {
+        "index.html": _page("Home", "Finance automation for growing teams.", [
+            ("/about.html", "About"), ("/products/widget-copy.html", "Widget (copy)"),
+            ("https://other.example.com/partner.html", "Partner"), ("/blog/post-1.html", "Blog"),
+        ]),
+        "about.html": _page("About", "Founded by accountants who were tired of month-end spreadsheets."),
+        "pricing.html": _page("Pricing", "Plans start at 99 dollars per month, billed annually."),
+        "products/widget.html": _page("Widget", WIDGET_COPY),
+        "products/widget-copy.html": _page("Widget", WIDGET_COPY + " Also on mobile."),
+        "sitemap.xml": ('<?xml version="1.0" encoding="UTF-8"?>'
+                        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                        f"<sitemap><loc>{base_url}sitemap-pages.xml</loc></sitemap></sitemapindex>"),
+        "sitemap-pages.xml": ('<?xml version="1.0" encoding="UTF-8"?>'
+                              '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+                              f"<url><loc>{base_url}pricing.html</loc></url></urlset>"),
+    }
+    for number in range(1, BLOG_POSTS + 1):
+        links = [(f"/blog/post-{number + 1}.html", "Next post")] if number < BLOG_POSTS else []
+        files[f"blog/post-{number}.html"] = _page(
+            f"Post {number}", f"Blog post {number} about closing the books {number} days faster.", links
+        )
+    for name, content in files.items():
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+
+def run_checks(base_url):
+    """Returns a list of (check name, passed, detail)."""
+    from src.site_crawler import crawl_site_async, merge_pages
+
+    crawl_options = {"per_host_delay": 0}
+    pages = asyncio.run(crawl_site_async(base_url, max_pages=100, **crawl_options))
+    paths = [urlparse(page["url"]).path for page in pages]
+    limited = asyncio.run(crawl_site_async(base_url, max_pages=5, **crawl_options))
+    merged = merge_pages(pages)
+
+    all_pages = 5 + BLOG_POSTS # index, about, pricing, widget, widget copy and the blog posts
+    return [
+        ("start page first", paths[:1] == ["/"], paths[:1]),
+        ("sitemap discovery", "/pricing.html" in paths, "pricing.html is only listed in a nested sitemap"),
+        ("same-site links followed", "/about.html" in paths and f"/blog/post-{BLOG_POSTS}.html" in paths,
+         f"{len(pages)} of {all_pages} pages crawled"),
+        ("off-site links skipped", all(urlparse(page["url"]).hostname == "127.0.0.1" for page in pages),
+         sorted({urlparse(page["url"]).hostname for page in pages})),
+        ("all pages crawled", len(pages) == all_pages, f"{len(pages)} pages"),
+        ("max_pages respected", len(limited) == 5, f"{len(limited)} pages with max_pages=5"),
+        ("near-duplicate dropped", "/products/widget.html" in merged and "/products/widget-copy.html" not in merged,
+         "only one of the two Widget pages is kept"),
+        ("boilerplate kept once", merged.count(TAGLINE) == 1, f"tagline appears {merged.count(TAGLINE)} time(s)"),
+    ]
+
+
+def main():
+    from src.cache import DiskCache, use_cache
+
+    with tempfile.TemporaryDirectory(prefix="ad-gen-crawl-") as work_dir:
+        site_dir = os.path.join(work_dir, "site")
+        os.makedirs(site_dir)
+        use_cache(DiskCache(os.path.join(work_dir, "cache"))) # No validators from earlier runs
+        server, base_url = _serve_directory(site_dir)
+        try:
+            write_fixture_site(site_dir, base_url)
+            results = run_checks(base_url)
+        finally:
+            server.shutdown()
+
+    for name, passed, detail in results:
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}: {detail}")
+    failures = [name for name, passed, _ in results if not passed]
+    if failures:
+        print(f"\nFAIL: {len(failures)} crawler check(s) failed.")
+        return 1
+    print("\nOK: crawler checks passed.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
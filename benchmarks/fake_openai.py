@@ -0,0 +1,185 @@
+"""
+A local stand-in for the OpenAI chat completions endpoint, for exercising the rate-limit
+scheduler, streaming and the pipeline offline. Replies are deterministic JSON shaped like the
+generation prompts ask for (or plain text for summaries); latency, 429s and 5xx are injected
+on request. Like the real API, prompt prefixes of 1024+ tokens that were seen before are reported
+as cached_tokens (in 128-token steps, estimated at 4 characters per token).
+
+Usage:
+    python benchmarks/fake_openai.py --port 8765 --latency 0.5 --rate-limit-rate 0.2
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake streamlit run streamlit_app.py
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STREAM_CHUNK_CHARS = 12
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+
+
+def _reply_for(prompt):
+    """Builds a response matching what the prompt asks for."""
+    key_match = re.search(r'single key "(\w+)"', prompt)
+    count_match = re.search(r"Generate (\d+) versions", prompt)
+    count = int(count_match.group(1)) if count_match else 3
+    if key_match and key_match.group(1) == "fixes":
+        # Character-limit rewrites: trim or pad each field to fit
+        fields = json.JSONDecoder().raw_decode(prompt[prompt.index("Fields:") + len("Fields:"):].lstrip())[0]
+        return json.dumps({"fixes": [{
+            "id": field["id"],
+            "text": field["text"][:field["max_chars"]].ljust(field["min_chars"], "."),
+        } for field in fields]})
+    if key_match:
+        ads = [{
+            "version": i + 1,
+            "ad_name": f"Fake Ad {i + 1}",
+            "headline": f"Headline {i + 1}",
+            "subject_line": f"Subject {i + 1}",
+            "body": f"Body of version {i + 1}. Book here: [LEAD_OBJECTIVE_LINK]",
+            "cta": "Book Now",
+            "introductory_text": f"Introductory text {i + 1}",
+            "primary_text": f"Primary text {i + 1}",
+            "image_copy": "Image copy",
+            "link_description": "Link description",
+            "cta_button": "Learn More",
+        } for i in range(count)]
+        return json.dumps({key_match.group(1): ads})
+    if '"headlines"' in prompt:
+        headline_count = int(re.search(r"exactly (\d+) (?:short )?headlines", prompt).group(1))
+        description_count = int(re.search(r"exactly (\d+) (?:descriptions|long headlines)", prompt).group(1))
+        return json.dumps({
+            "headlines": [f"Headline {i + 1}" for i in range(headline_count)],
+            "descriptions": [f"Description {i + 1} with a little more detail." for i in range(description_count)],
+        })
+    return "Fake summary: the company sells widgets to finance teams and values speed and accuracy. " * 3
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        options = self.server.options
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+        time.sleep(options["latency"] * random.uniform(0.5, 1.5) if options["latency"] else 0)
+
+        roll = random.random()
+        if roll < options["rate_limit_rate"]:
+            with self.server.stats_lock:
+                self.server.stats["rate_limited"] += 1
+            self._send_json(429, {"error": {"message": "Rate limit reached (fake).", "type": "requests"}},
+                            {"Retry-After": str(options["retry_after"])})
+            return
+        if roll < options["rate_limit_rate"] + options["server_error_rate"]:
+            with self.server.stats_lock:
+                self.server.stats["server_errors"] += 1
+            self._send_json(500, {"error": {"message": "Internal error (fake).", "type": "server_error"}})
+            return
+
+        prompt = "\n".join(message["content"] for message in request["messages"])
+        content = _reply_for(prompt)
+        prompt_tokens = len(prompt) // 4
+        # Everything but the last message is the cacheable prefix
+        prefix = "\n".join(message["content"] for message in request["messages"][:-1])
+        prefix_tokens = len(prefix) // 4
+        cached_tokens = 0
+        with self.server.stats_lock:
+            if prefix_tokens >= CACHE_MIN_TOKENS:
+                if prefix in self.server.seen_prefixes:
+                    cached_tokens = prefix_tokens - prefix_tokens % CACHE_STEP_TOKENS
+                self.server.seen_prefixes.add(prefix)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": prompt_tokens + len(content) // 4,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        }
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                "model": request["model"],
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send_chunk(choices, chunk_usage=None):
+            chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": request["model"], "choices": choices}
+            if chunk_usage:
+                chunk["usage"] = chunk_usage
+            self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+
+        for start in range(0, len(content), STREAM_CHUNK_CHARS):
+            send_chunk([{"index": 0, "delta": {"content": content[start:start + STREAM_CHUNK_CHARS]}, "finish_reason": None}])
+            time.sleep(options["stream_chunk_delay"])
+        send_chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_chunk([], usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_fake_openai(port=0, latency=0.0, rate_limit_rate=0.0, server_error_rate=0.0, retry_after=1,
+                      stream_chunk_delay=0.0):
+    """Starts the server on a daemon thread and returns (server, base_url); server.stats counts requests."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.options = {
+        "latency": latency, "rate_limit_rate": rate_limit_rate, "server_error_rate": server_error_rate,
+        "retry_after": retry_after, "stream_chunk_delay": stream_chunk_delay,
+    }
+    server.stats = {"requests": 0, "rate_limited": 0, "server_errors": 0}
+    server.stats_lock = threading.Lock()
+    server.seen_prefixes = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake OpenAI chat completions server.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean seconds before each response")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    args = parser.parse_args(argv)
+
+    server, base_url = start_fake_openai(
+        args.port, args.latency, args.rate_limit_rate, args.server_error_rate, args.retry_after, args.stream_chunk_delay
+    )
+    print(f"Fake OpenAI endpoint at {base_url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Synthetic, deterministic context fixtures for the benchmarks: an HTML landing page, a
+text PDF and a PPTX deck, each available in increasing sizes, plus a corpus of
+boilerplate-heavy HTML pages for the extraction benchmark.
+"""
+import io
+import random
+
+# Fixture sizes: HTML paragraphs, PDF pages and PPTX slides.
+FIXTURE_SIZES = {
+    "small": {"html_paragraphs": 20, "pdf_pages": 5, "pptx_slides": 5},
+    "medium": {"html_paragraphs": 200, "pdf_pages": 50, "pptx_slides": 30},
+    "large": {"html_paragraphs": 1000, "pdf_pages": 200, "pptx_slides": 120},
+}
+
+_WORDS = (
+    "acme widget invoice finance team automation pricing customer onboarding platform "
+    "integration security compliance report dashboard workflow approval analytics growth "
+    "revenue savings hours accuracy audit enterprise midmarket support partner"
+).split()
+
+
+def _sentences(rng, count, words_per_sentence=14):
+    return [
+        " ".join(rng.choice(_WORDS) for _ in range(words_per_sentence)).capitalize() + "."
+        for _ in range(count)
+    ]
+
+
+def make_html(paragraphs, seed=1):
+    """A landing page with navigation/footer boilerplate around `paragraphs` paragraphs of copy."""
+    rng = random.Random(seed)
+    body = "\n".join(f"<p>{' '.join(_sentences(rng, 4))}</p>" for _ in range(paragraphs))
+    return (
+        "<html><head><title>Acme</title><script>var tracking = 1;</script></head><body>"
+        "<nav><a href='/'>Home</a> <a href='/pricing'>Pricing</a></nav>"
+        f"<main><h1>Acme Widgets</h1>{body}</main>"
+        "<footer>Copyright Acme Inc. All rights reserved.</footer></body></html>"
+    ).encode("utf-8")
+
+
+def make_boilerplate_html(paragraphs, seed=1):
+    """
+    A page shaped like a real marketing site: header, mega-menu navigation, a cookie banner,
+    inline SVG icons, a newsletter form and a long footer around `paragraphs` paragraphs of copy.
+    """
+    rng = random.Random(seed)
+    menu = "".join(f"<li><a href='/{word}'>{word.title()}</a></li>" for word in rng.sample(_WORDS, 20))
+    icon = "<svg viewBox='0 0 24 24'><path d='M12 2L2 7l10 5 10-5-10-5z'/><title>icon</title></svg>"
+    sections = "\n".join(
+        f"<section class='feature'><h2>{_sentences(rng, 1, 4)[0]}</h2>{icon}"
+        f"<p>{' '.join(_sentences(rng, 4))}</p></section>"
+        for _ in range(paragraphs)
+    )
+    footer_links = "".join(f"<a href='/{i}'>{' '.join(_sentences(rng, 1, 3))}</a>" for i in range(60))
+    return (
+        "<!DOCTYPE html><html><head><title>Acme</title>"
+        f"<style>{'.c{color:red}' * 200}</style><script>{'var t = 1;' * 300}</script></head><body>"
+        f"<header><a class='logo' href='/'>Acme</a><nav><ul>{menu}</ul></nav></header>"
+        "<div id='cookie-consent' class='cookie-banner'>We use cookies to improve your experience. "
+        "<button>Accept all</button><button>Manage preferences</button></div>"
+        f"<main><h1>Acme Widgets</h1>{sections}</main>"
+        "<div class='newsletter'><form><label>Email</label><input type='email'><button>Subscribe</button></form></div>"
+        f"<footer>{footer_links}<p>Copyright Acme Inc. All rights reserved.</p></footer>"
+        "<noscript><img src='/pixel.gif'></noscript></body></html>"
+    ).encode("utf-8")
+
+
+def make_html_corpus(count=50, seed=4):
+    """`count` boilerplate-heavy pages of varying length, as {file name: bytes}."""
+    rng = random.Random(seed)
+    return {
+        f"page-{index:03d}.html": make_boilerplate_html(rng.randint(5, 120), seed=seed + index)
+        for index in range(count)
+    }
+
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages, seed=2):
+    """A minimal PDF with one Helvetica text line block per page."""
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    font_ref = 3 + 2 * pages
+    for i in range(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_ref} 0 R >> >> /Contents {4 + 2 * i} 0 R >>".encode()
+        )
+        lines = " T* ".join(f"({_pdf_escape(sentence)}) Tj" for sentence in _sentences(rng, 30))
+        stream = f"BT /F1 10 Tf 12 TL 40 760 Td {lines} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref_at = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n".encode()
+    return out
+
+
+def make_pptx(slides, seed=3):
+    """A deck with a title and a bulleted body per slide."""
+    from pptx import Presentation
+
+    rng = random.Random(seed)
+    presentation = Presentation()
+    layout = presentation.slide_layouts[1] # Title and Content
+    for i in range(slides):
+        slide = presentation.slides.add_slide(layout)
+        slide.shapes.title.text = f"Acme slide {i + 1}"
+        body = slide.placeholders[1].text_frame
+        body.text = _sentences(rng, 1)[0]
+        for sentence in _sentences(rng, 5):
+            body.add_paragraph().text = sentence
+    output = io.BytesIO()
+    presentation.save(output)
+    return output.getvalue()
+
+
+def make_fixtures(size):
+    """Returns {"html": bytes, "pdf": bytes, "pptx": bytes} for one of FIXTURE_SIZES."""
+    spec = FIXTURE_SIZES[size]
+    return {
+        "html": make_html(spec["html_paragraphs"]),
+        "pdf": make_pdf(spec["pdf_pages"]),
+        "pptx": make_pptx(spec["pptx_slides"]),
+    }
@@ -0,0 +1,92 @@
+"""
+HTML text extraction throughput over a corpus of saved pages: pages/s and MB/s per engine,
+and how much text each engine hands on to the summarizer.
+
+The corpus is every *.html/*.htm file under --corpus (save pages with e.g.
+`curl -o page.html URL`), or a synthetic boilerplate-heavy corpus when none is given.
+"legacy" is the previous extractor (full html.parser tree, only script/style removed),
+kept here as the reference point.
+
+Usage:
+    python benchmarks/html_extraction_benchmark.py
+    python benchmarks/html_extraction_benchmark.py --corpus saved_pages/ --runs 5
+"""
+import argparse
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fixtures import make_html_corpus # noqa: E402
+from src.text_extractor import extract_text_from_html, _lxml_available # noqa: E402
+
+DEFAULT_RUNS = 3
+
+
+def legacy_extract_text_from_html(html, separator=""):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    for script_or_style in soup(["script", "style"]):
+        script_or_style.decompose()
+    text = soup.get_text(separator)
+    lines = (line.strip() for line in text.splitlines())
+    chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
+    return '\n'.join(chunk for chunk in chunks if chunk)
+
+
+def load_corpus(directory):
+    corpus = {}
+    for root, _, files in os.walk(directory):
+        for file_name in sorted(files):
+            if file_name.lower().endswith((".html", ".htm")):
+                with open(os.path.join(root, file_name), "rb") as f:
+                    corpus[os.path.relpath(os.path.join(root, file_name), directory)] = f.read()
+    return corpus
+
+
+def measure(extract, pages, runs):
+    """Best-of-runs seconds for one pass over the corpus, and the characters extracted."""
+    best = None
+    output_chars = 0
+    for _ in range(runs):
+        started = time.perf_counter()
+        output_chars = sum(len(extract(html)) for html in pages)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output_chars
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTML extraction throughput benchmark.")
+    parser.add_argument("--corpus", help="Directory of saved .html pages (default: synthetic corpus)")
+    parser.add_argument("--pages", type=int, default=50, help="Synthetic corpus size")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Passes per engine; the best is reported")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus) if args.corpus else make_html_corpus(args.pages)
+    if not corpus:
+        parser.error(f"no .html files under {args.corpus}")
+    pages = list(corpus.values())
+    input_mb = sum(len(html) for html in pages) / 1e6
+    print(f"Corpus: {len(pages)} pages, {input_mb:.2f} MB ({args.corpus or 'synthetic'})")
+
+    engines = {"legacy": legacy_extract_text_from_html, "bs4": lambda html: extract_text_from_html(html, engine="bs4")}
+    if _lxml_available():
+        engines["lxml"] = lambda html: extract_text_from_html(html, engine="lxml")
+    else:
+        print("lxml is not installed; skipping the lxml engine.")
+
+    results = {name: measure(extract, pages, args.runs) for name, extract in engines.items()}
+    legacy_seconds, legacy_chars = results["legacy"]
+    print(f"\n  {'engine':<8} {'pages/s':>9} {'MB/s':>8} {'speedup':>8} {'chars out':>11} {'vs legacy':>10}")
+    for name, (seconds, output_chars) in results.items():
+        print(f"  {name:<8} {len(pages) / seconds:>9.1f} {input_mb / seconds:>8.2f} {legacy_seconds / seconds:>7.1f}x "
+              f"{output_chars:>11,} {output_chars / legacy_chars:>9.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
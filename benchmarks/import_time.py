@@ -0,0 +1,91 @@
+"""
+Measures how long the Streamlit app's own imports take on a cold interpreter and fails
+when they exceed a budget or eagerly load a heavy dependency.
+
+Usage: python benchmarks/import_time.py [--budget-ms 300] [--runs 5]
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+APP_SCRIPT = os.path.join(REPO_ROOT, "streamlit_app.py")
+
+# Only needed once a run extracts, fetches, generates or exports
+HEAVY_MODULES = ("requests", "bs4", "lxml", "PyPDF2", "pptx", "pandas", "openpyxl", "openai", "pyarrow", "tiktoken")
+
+DEFAULT_BUDGET_MS = 300
+DEFAULT_RUNS = 5
+
+_PROBE = """
+import json, sys, time
+import streamlit  # Paid by every Streamlit app; not part of the budget
+start = time.perf_counter()
+for name in {modules!r}:
+    __import__(name)
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({{"elapsed_ms": elapsed_ms, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def app_modules(script=APP_SCRIPT):
+    """The src modules the app script imports at module level, i.e. on every run, in order."""
+    with open(script, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), script)
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom):
+            names = [node.module or ""]
+        elif isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        else:
+            continue
+        modules.extend(name for name in names if name.split(".")[0] == "src" and name not in modules)
+    return tuple(modules)
+
+
+def measure_once(modules):
+    """Imports the app modules in a fresh interpreter; returns (elapsed_ms, heavy modules loaded)."""
+    probe = _PROBE.format(modules=modules, heavy=HEAVY_MODULES)
+    output = subprocess.run(
+        [sys.executable, "-c", probe], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+    return result["elapsed_ms"], result["loaded"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the app's import time against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Maximum median import time of the app modules")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS)
+    args = parser.parse_args(argv)
+
+    modules = app_modules()
+    timings = []
+    eager = set()
+    for _ in range(max(1, args.runs)):
+        elapsed_ms, loaded = measure_once(modules)
+        timings.append(elapsed_ms)
+        eager.update(loaded)
+
+    median_ms = statistics.median(timings)
+    print(f"app imports ({len(modules)} src modules): median {median_ms:.1f} ms, max {max(timings):.1f} ms over {len(timings)} runs "
+          f"(budget {args.budget_ms:.0f} ms)")
+    failed = False
+    if median_ms > args.budget_ms:
+        print("FAIL: import time is over budget")
+        failed = True
+    if eager:
+        print(f"FAIL: heavy modules imported eagerly: {', '.join(sorted(eager))}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Offline end-to-end benchmark: runs the full pipeline (fetch and parse the HTML page, parse
+the PDF and PPTX uploads, summarize, generate, write the workbook) against the local fake
+OpenAI endpoint and a local HTML server, for synthetic fixtures of increasing size.
+
+Reports throughput and p50/p95 latency per stage from each run's trace, and exits 1 when a
+stage's p95 regresses past the stored baseline. No network access or API spend.
+
+Usage:
+    python benchmarks/pipeline_benchmark.py                     # compare against baseline.json
+    python benchmarks/pipeline_benchmark.py --update-baseline   # record a new baseline
+    python benchmarks/pipeline_benchmark.py --sizes large --latency 0.5 --rate-limit-rate 0.1
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from fake_openai import start_fake_openai # noqa: E402
+from fixtures import FIXTURE_SIZES, make_fixtures # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_SIZES = "small,medium"
+DEFAULT_RUNS = 3
+# A stage regresses when its p95 exceeds the baseline by this share and by at least MIN_REGRESSION_SECONDS.
+DEFAULT_TOLERANCE = 0.25
+MIN_REGRESSION_SECONDS = 0.05
+
+RUN_STAGE = "run" # Whole-pipeline wall time, reported alongside the traced stages
+
+
+def percentile(values, share):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(share * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _serve_directory(directory):
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/"
+
+
+def run_size(size, runs, stream, work_dir):
+    """Runs the pipeline `runs` times on cold caches; returns ({stage: [seconds]}, run summaries)."""
+    from src.cache import DiskCache, use_cache
+    from src.openai_handler import get_openai_client
+    from src.pipeline import LocalFile, prepare_job, run_pipeline
+
+    fixture_dir = os.path.join(work_dir, size)
+    os.makedirs(fixture_dir, exist_ok=True)
+    fixtures = make_fixtures(size)
+    with open(os.path.join(fixture_dir, "index.html"), "wb") as f:
+        f.write(fixtures["html"])
+    for ext in ("pdf", "pptx"):
+        with open(os.path.join(fixture_dir, f"context.{ext}"), "wb") as f:
+            f.write(fixtures[ext])
+    input_bytes = sum(len(data) for data in fixtures.values())
+
+    site_server, site_url = _serve_directory(fixture_dir)
+    client = get_openai_client()
+    durations = {}
+    run_summaries = []
+    try:
+        for run_index in range(runs):
+            use_cache(DiskCache(os.path.join(work_dir, "cache", f"{size}-{run_index}"))) # Cold cache every run
+            job, error = prepare_job(
+                site_url, "Demo Booking", "https://example.com/learn", "https://example.com/download",
+                "https://example.com/demo", content_count=10,
+                additional_context_files=LocalFile(os.path.join(fixture_dir, "context.pdf")),
+                downloadable_material_files=LocalFile(os.path.join(fixture_dir, "context.pptx")),
+                stream_generations=stream,
+            )
+            if error:
+                raise RuntimeError(error)
+            result = run_pipeline(client, job)
+            if result["error"]:
+                raise RuntimeError(f"{size} run {run_index + 1} failed: {result['error']}")
+            trace = result["trace"]
+            for span in trace["spans"]:
+                durations.setdefault(span["stage"], []).append(span["seconds"])
+            durations.setdefault(RUN_STAGE, []).append(trace["wall_seconds"])
+            ads = sum(len(values) if isinstance(values, list) else len(values.get("headlines", []))
+                      for values in result["ad_data"].values())
+            run_summaries.append({"wall_seconds": trace["wall_seconds"], "ads": ads, "input_bytes": input_bytes})
+    finally:
+        site_server.shutdown()
+    return durations, run_summaries
+
+
+def summarize_durations(durations, run_summaries):
+    stages = {
+        stage: {
+            "calls": len(values),
+            "p50": percentile(values, 0.50),
+            "p95": percentile(values, 0.95),
+            "max": max(values),
+        }
+        for stage, values in durations.items()
+    }
+    total_seconds = sum(run["wall_seconds"] for run in run_summaries)
+    throughput = {
+        "runs_per_minute": 60 * len(run_summaries) / total_seconds if total_seconds else 0.0,
+        "ads_per_second": sum(run["ads"] for run in run_summaries) / total_seconds if total_seconds else 0.0,
+        "input_mb_per_second": sum(run["input_bytes"] for run in run_summaries) / 1e6 / total_seconds if total_seconds else 0.0,
+    }
+    return {"stages": stages, "throughput": throughput}
+
+
+def print_report(size, report):
+    throughput = report["throughput"]
+    print(f"\n[{size}] {throughput['runs_per_minute']:.1f} runs/min, {throughput['ads_per_second']:.1f} ads/s, "
+          f"{throughput['input_mb_per_second']:.2f} MB input/s")
+    print(f"  {'stage':<10} {'calls':>6} {'p50 ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for stage, stats in sorted(report["stages"].items()):
+        print(f"  {stage:<10} {stats['calls']:>6} {stats['p50'] * 1000:>10.1f} {stats['p95'] * 1000:>10.1f} {stats['max'] * 1000:>10.1f}")
+
+
+def find_regressions(results, baseline, tolerance):
+    """Stages whose p95 exceeds the baseline's by more than tolerance (and MIN_REGRESSION_SECONDS)."""
+    regressions = []
+    for size, report in results.items():
+        if baseline.get(size, {}).get("settings") != report["settings"]:
+            print(f"Note: baseline for '{size}' was recorded with different settings; not compared.")
+            continue
+        for stage, stats in report["stages"].items():
+            reference = baseline.get(size, {}).get("stages", {}).get(stage)
+            if not reference:
+                continue
+            limit = max(reference["p95"] * (1 + tolerance), reference["p95"] + MIN_REGRESSION_SECONDS)
+            if stats["p95"] > limit:
+                regressions.append(f"{size}/{stage}: p95 {stats['p95'] * 1000:.1f} ms > "
+                                   f"{limit * 1000:.1f} ms (baseline {reference['p95'] * 1000:.1f} ms)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline end-to-end pipeline benchmark.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated: {', '.join(FIXTURE_SIZES)}")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Cold runs per size")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean fake API latency in seconds")
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of API calls answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share of API calls answered with 500")
+    parser.add_argument("--no-stream", action="store_true", help="Use non-streaming generation calls")
+    parser.add_argument("--rpm", type=int, default=100_000,
+                        help="Scheduler request quota; high by default so stages measure the code, not the quota")
+    parser.add_argument("--tpm", type=int, default=100_000_000, help="Scheduler token quota")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--json-out", help="Also write the full results to this file")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown_sizes = [size for size in sizes if size not in FIXTURE_SIZES]
+    if unknown_sizes:
+        parser.error(f"unknown size(s): {', '.join(unknown_sizes)}")
+
+    _, base_url = start_fake_openai(
+        latency=args.latency, rate_limit_rate=args.rate_limit_rate, server_error_rate=args.server_error_rate,
+        retry_after=0, stream_chunk_delay=args.stream_chunk_delay,
+    )
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "fake-key"
+    # Read when src.rate_limiter is first imported (in run_size)
+    os.environ["OPENAI_RPM_LIMIT"] = str(args.rpm)
+    os.environ["OPENAI_TPM_LIMIT"] = str(args.tpm)
+
+    # Stage latencies depend on these, so a baseline only applies to runs with the same settings
+    settings = {
+        "latency": args.latency, "stream_chunk_delay": args.stream_chunk_delay,
+        "rate_limit_rate": args.rate_limit_rate, "server_error_rate": args.server_error_rate,
+        "stream": not args.no_stream,
+    }
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="ad-gen-bench-") as work_dir:
+        for size in sizes:
+            started = time.perf_counter()
+            durations, run_summaries = run_size(size, args.runs, not args.no_stream, work_dir)
+            results[size] = summarize_durations(durations, run_summaries)
+            results[size]["settings"] = settings
+            print_report(size, results[size])
+            print(f"  ({time.perf_counter() - started:.1f}s for {args.runs} runs)")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\nBaseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to record one.")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = find_regressions(results, baseline, args.tolerance)
+    if regressions:
+        print("\nFAIL: stages regressed past the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print(f"\nOK: no stage regressed by more than {args.tolerance:.0%} against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+import math
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.openai_handler import (
+    generate_content_with_ai, PROMPT_CACHE_MIN_TOKENS,
+    create_email_prompt, create_linkedin_facebook_prompt, create_shard_prompt,
+    create_google_search_prompt, create_google_display_prompt
+)
+from src.instrumentation import stage, STAGE_GENERATE
+from src.token_utils import count_tokens
+from src.utils import worker_thread_initializer
+
+# Default number of generation calls allowed in flight at once.
+DEFAULT_MAX_CONCURRENT_GENERATIONS = 4
+# Email + LinkedIn(3) + Facebook(3) + Google Search + Google Display
+GENERATION_TASK_COUNT = 1 + 3 + 3 + 1 + 1
+# Longest the other calls wait for the first one's first streamed ad (its prompt, and so the
+# shared prefix, has been processed by then). Kept short so one call never holds up the run.
+PREFIX_WARM_UP_TIMEOUT = 2
+# Email/LinkedIn/Facebook requests for more versions than this are split into parallel shards
+# of at most this many versions; a shard that fails (or returns no ads) is retried on its own.
+GENERATION_SHARD_SIZE = 5
+SHARD_ATTEMPTS = 2
+
+LINKEDIN_CTA_OPTIONS = {
+    "Brand Awareness": ["Learn More", ""],
+    "Demand Gen": ["Download"],
+    "Demand Capture": ["Register", "Request Demo"],
+}
+
+FACEBOOK_CTA_OPTIONS = {
+    "Brand Awareness": ["Learn More", ""],
+    "Demand Gen": ["Download"],
+    "Demand Capture": ["Book Now"],
+}
+
+
+def objective_response_key(platform, objective):
+    """JSON key the model is asked to use for a LinkedIn/Facebook objective."""
+    return f'{platform.lower()}_{objective.lower().replace(" ", "_")}'
+
+
+def _shard_prompts(build_prompt, content_count):
+    """
+    Splits content_count versions into near-equal shards of at most GENERATION_SHARD_SIZE.
+    Returns None when one call is enough, else a list of {"prompt", "count"} per shard.
+    """
+    shard_count = math.ceil(content_count / GENERATION_SHARD_SIZE)
+    if shard_count < 2:
+        return None
+    counts = [content_count // shard_count + (1 if i < content_count % shard_count else 0) for i in range(shard_count)]
+    return [
+        {"prompt": create_shard_prompt(build_prompt(count), number, shard_count), "count": count}
+        for number, count in enumerate(counts, 1)
+    ]
+
+
+# Google channel -> prompt builder(headline_count, description_count); the defaults are a full set.
+GOOGLE_PROMPTS = {
+    "google_search": create_google_search_prompt,
+    "google_display": create_google_display_prompt,
+}
+
+
+def build_generation_tasks(context_summary, content_count, learn_more_link, downloadable_material_link, active_lead_link):
+    """
+    Returns the ordered list of generation tasks for one client.
+    Each task is a dict with an 'id', the 'channel' it feeds in ad_data_for_excel,
+    a progress 'label', the shared 'context', its channel 'prompt' and the details needed
+    to assemble the result. Tasks asking for more than GENERATION_SHARD_SIZE versions also
+    have 'shards' (see _shard_prompts), which run_generation_tasks runs in place of 'prompt'.
+    """
+    objective_links = {
+        "Brand Awareness": learn_more_link,
+        "Demand Gen": downloadable_material_link,
+        "Demand Capture": active_lead_link,
+    }
+
+    tasks = [{
+        "id": "email",
+        "channel": "email",
+        "label": "Email",
+        "context": context_summary,
+        "prompt": create_email_prompt(active_lead_link, content_count),
+        "shards": _shard_prompts(lambda count: create_email_prompt(active_lead_link, count), content_count),
+        "response_key": "emails",
+    }]
+
+    for platform, cta_options in (("LinkedIn", LINKEDIN_CTA_OPTIONS), ("Facebook", FACEBOOK_CTA_OPTIONS)):
+        for obj, link in objective_links.items():
+            response_key = objective_response_key(platform, obj)
+            tasks.append({
+                "id": response_key,
+                "channel": platform.lower(),
+                "label": f"{platform} {obj}",
+                "context": context_summary,
+                "prompt": create_linkedin_facebook_prompt(platform, obj, content_count, link, cta_options[obj]),
+                "shards": _shard_prompts(
+                    lambda count, platform=platform, obj=obj, link=link, cta_options=cta_options:
+                        create_linkedin_facebook_prompt(platform, obj, count, link, cta_options[obj]),
+                    content_count
+                ),
+                "response_key": response_key,
+                "objective": obj,
+                "destination_link": link,
+            })
+
+    tasks.append({
+        "id": "google_search",
+        "channel": "google_search",
+        "label": "Google Search",
+        "context": context_summary,
+        "prompt": GOOGLE_PROMPTS["google_search"](),
+    })
+    tasks.append({
+        "id": "google_display",
+        "channel": "google_display",
+        "label": "Google Display",
+        "context": context_summary,
+        "prompt": GOOGLE_PROMPTS["google_display"](),
+    })
+    return tasks
+
+
+def shares_cacheable_prefix(tasks):
+    """True when the shared prompt prefix is long enough for the provider to cache it."""
+    return len(tasks) > 1 and count_tokens(tasks[0]["context"]) >= PROMPT_CACHE_MIN_TOKENS
+
+
+def _task_calls(task):
+    """(shard index or None, prompt) for each call a task needs."""
+    if not task.get("shards"):
+        return [(None, task["prompt"])]
+    return [(index, shard["prompt"]) for index, shard in enumerate(task["shards"])]
+
+
+def count_generation_calls(tasks):
+    """The number of API calls run_generation_tasks makes for tasks (one per shard), retries aside."""
+    return sum(len(_task_calls(task)) for task in tasks)
+
+
+def merge_shard_contents(task, shard_contents):
+    """
+    Concatenates the ads of a task's shards (in shard order) and renumbers 'version' from 1,
+    so shards that failed leave no gaps. Returns None when every shard failed.
+    """
+    if not any(shard_contents):
+        return None
+    ads = [ad for content in shard_contents if content for ad in content[task["response_key"]]]
+    return {task["response_key"]: [
+        dict(ad, version=version) if isinstance(ad, dict) else ad for version, ad in enumerate(ads, 1)
+    ]}
+
+
+def run_generation_tasks(client, tasks, max_workers=DEFAULT_MAX_CONCURRENT_GENERATIONS, on_task_done=None, on_item=None,
+                         on_usage=None, warm_up_prefix=False):
+    """
+    Runs the generation calls concurrently on a thread pool. Sharded tasks run one call per
+    shard; a shard that fails or returns no ads is retried (SHARD_ATTEMPTS in all) without
+    touching the others, and the shards are merged and renumbered when the last one is done.
+    on_task_done(task, content) is called from the calling thread as each task finishes,
+    so it is safe to update Streamlit elements from it.
+    With on_item the calls are streamed and on_item(task, array key, element) is called, also
+    from the calling thread, for every ad as soon as it is complete, before its task finishes.
+    A shard attempt that can still be retried passes on its ads only once it succeeds, so a
+    retry never repeats them.
+    on_usage(task, usage_counts) reports each call's token usage the same way.
+    With warm_up_prefix and streaming, the other calls wait until the first has started
+    answering (at most PREFIX_WARM_UP_TIMEOUT seconds), so they hit the provider's cache for the
+    shared context prefix instead of all missing it. Without streaming there is no early signal
+    to wait for, so all calls start at once.
+    Returns a dict mapping task id to the parsed JSON content (or None on failure).
+    """
+    # Workers only post events; callbacks run here in the order the events arrived
+    events = queue.Queue()
+    prefix_ready = threading.Event()
+    calls = [(task, shard_index, prompt) for task in tasks for shard_index, prompt in _task_calls(task)]
+    if not warm_up_prefix or on_item is None or len(calls) < 2:
+        prefix_ready.set()
+
+    def run_call(task, shard_index, prompt, warms_prefix):
+        if not warms_prefix:
+            prefix_ready.wait(PREFIX_WARM_UP_TIMEOUT)
+        first_version = 1 + sum(shard["count"] for shard in task["shards"][:shard_index]) if shard_index else 1
+        attempts = SHARD_ATTEMPTS if shard_index is not None else 1
+        streamed_counts = {}
+        held_items = None # Items of an attempt that may still be retried, posted once it succeeds
+
+        def item_callback(key, item):
+            prefix_ready.set() # The provider has processed the prompt by the time output arrives
+            if shard_index is not None and isinstance(item, dict):
+                # Number streamed ads as they will be numbered once the shards are merged
+                streamed_counts[key] = streamed_counts.get(key, 0) + 1
+                item = dict(item, version=first_version + streamed_counts[key] - 1)
+            if held_items is not None:
+                held_items.append((key, item))
+            else:
+                events.put(("item", task, (key, item)))
+
+        content = None
+        try:
+            for attempt in range(attempts):
+                streamed_counts.clear()
+                # A retried attempt would stream its ads again; only the last attempt streams live
+                held_items = [] if attempt < attempts - 1 else None
+                name = task["id"] if shard_index is None else f"{task['id']}#{shard_index + 1}"
+                try:
+                    with stage(STAGE_GENERATE, name, streamed=bool(on_item), attempt=attempt + 1):
+                        content = generate_content_with_ai(
+                            client, prompt, on_item=item_callback if on_item else None, context_summary=task["context"],
+                            on_usage=lambda usage: events.put(("usage", task, usage)),
+                        )
+                except Exception:
+                    content = None
+                if shard_index is None or (isinstance(content, dict) and content.get(task["response_key"])):
+                    for key, item in held_items or ():
+                        events.put(("item", task, (key, item)))
+                    break
+                content = None
+        finally:
+            if warms_prefix:
+                prefix_ready.set()
+        events.put(("done", task, (shard_index, content)))
+
+    results = {}
+    shard_results = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), initializer=worker_thread_initializer()) as executor:
+        for index, (task, shard_index, prompt) in enumerate(calls):
+            executor.submit(run_call, task, shard_index, prompt, index == 0)
+        while len(results) < len(tasks):
+            kind, task, payload = events.get()
+            if kind == "item":
+                on_item(task, *payload)
+                continue
+            if kind == "usage":
+                if on_usage:
+                    on_usage(task, payload)
+                continue
+            shard_index, content = payload
+            if shard_index is not None:
+                shard_results.setdefault(task["id"], {})[shard_index] = content
+                if len(shard_results[task["id"]]) < len(task["shards"]):
+                    continue
+                done_shards = shard_results[task["id"]]
+                content = merge_shard_contents(task, [done_shards[index] for index in range(len(task["shards"]))])
+            results[task["id"]] = content
+            if on_task_done:
+                on_task_done(task, content)
+    return results
+
+
+def partial_content(items):
+    """Rebuilds a task's JSON content from the (array key, element) pairs streamed before it failed."""
+    content = {}
+    for key, item in items:
+        content.setdefault(key, []).append(item)
+    return content
+
+
+def assemble_ad_data(tasks, results):
+    """
+    Builds ad_data_for_excel from the task results in task order, independent of completion order.
+    Returns (ad_data_for_excel, labels of the tasks that failed or came back in an unexpected format).
+    """
+    ad_data = {}
+    failed = []
+    for task in tasks:
+        content = results.get(task["id"])
+        channel = task["channel"]
+        if channel in ("google_search", "google_display"):
+            if content and 'headlines' in content and 'descriptions' in content:
+                ad_data[channel] = content
+            else:
+                failed.append(task["label"])
+            continue
+
+        if not content or task["response_key"] not in content:
+            failed.append(task["label"])
+            continue
+        ads = content[task["response_key"]]
+        if "objective" in task:
+            for ad in ads:
+                ad['objective_type'] = task["objective"]
+                ad['destination_link'] = task["destination_link"]
+        if ads:
+            ad_data.setdefault(channel, []).extend(ads)
+    return ad_data, failed
+
+
+def regeneration_versions(task, content):
+    """The versions of a task's content that can be regenerated: 1-based row numbers for Google ads."""
+    if task["channel"] in GOOGLE_PROMPTS:
+        return list(range(1, max(len(content.get(key, [])) for key in ("headlines", "descriptions")) + 1))
+    return [ad.get("version") for ad in content.get(task["response_key"], [])]
+
+
+def google_rows_task(task, content, rows):
+    """A copy of a Google task that asks only for the headlines and descriptions of the given rows of content."""
+    headline_count = sum(row <= len(content.get("headlines", [])) for row in rows)
+    description_count = sum(row <= len(content.get("descriptions", [])) for row in rows)
+    return dict(task, prompt=GOOGLE_PROMPTS[task["channel"]](headline_count, description_count))
+
+
+def merge_regenerated_content(task, content, new_content, versions):
+    """
+    Replaces the given versions of a task's content with newly generated ones, in order, and
+    returns the merged content (the inputs are not modified). For Google ads, versions are
+    1-based row numbers, and each list takes replacements only for the rows it has (see
+    google_rows_task). Versions without a replacement (the model returned fewer) keep their
+    old content.
+    """
+    if task["channel"] in GOOGLE_PROMPTS:
+        merged = {key: list(values) for key, values in content.items()}
+        for key in ("headlines", "descriptions"):
+            replacements = iter(new_content.get(key, []))
+            for version in versions:
+                if version > len(merged.get(key, [])):
+                    continue
+                replacement = next(replacements, None)
+                if replacement is not None:
+                    merged[key][version - 1] = replacement
+        return merged
+
+    replacements = dict(zip(versions, new_content.get(task["response_key"], [])))
+    ads = [
+        dict(replacements[ad.get("version")], version=ad.get("version")) if ad.get("version") in replacements else ad
+        for ad in content.get(task["response_key"], [])
+    ]
+    return dict(content, **{task["response_key"]: ads})
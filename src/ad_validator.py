@@ -0,0 +1,108 @@
+import logging
+
+from src.openai_handler import generate_content_with_ai, create_length_fix_prompt
+from src.sheet_schemas import SHEET_SCHEMAS
+
+logger = logging.getLogger(__name__)
+
+# (min, max) characters per field, as the generation prompts ask for them.
+CHARACTER_LIMITS = {
+    "linkedin": {
+        "ad_name": (0, 250),
+        "introductory_text": (300, 400),
+        "headline": (0, 70),
+    },
+    "facebook": {
+        "ad_name": (0, 250),
+        "primary_text": (300, 400),
+        "headline": (0, 27),
+        "link_description": (0, 27),
+    },
+    "google_search": {
+        "headlines": (0, 30),
+        "descriptions": (0, 90),
+    },
+    "google_display": {
+        "headlines": (0, 30),
+        "descriptions": (0, 90),
+    },
+}
+# Over-limit fields sent back in the single batched fix request; the rest are only flagged.
+MAX_FIELDS_PER_FIX_REQUEST = 60
+
+
+def find_limit_violations(ad_data):
+    """
+    Checks every limited field of ad_data (as in ad_data_for_excel) against CHARACTER_LIMITS,
+    a column at a time with vectorized string lengths. Returns a list of
+    {"id", "channel", "row", "field", "text", "length", "min_chars", "max_chars"} dicts, where
+    row is the index of the ad (or of the headline/description for Google ads).
+    """
+    import pandas as pd
+
+    violations = []
+    for channel, limits in CHARACTER_LIMITS.items():
+        data = ad_data.get(channel)
+        if not data:
+            continue
+        if SHEET_SCHEMAS[channel]["kind"] == "paired_lists":
+            columns = {field: pd.Series(data.get(field, []), dtype=object) for field in limits}
+        else:
+            frame = pd.DataFrame(data, dtype=object)
+            columns = {field: frame[field] if field in frame else pd.Series([None] * len(frame), dtype=object)
+                       for field in limits}
+        for field, (min_chars, max_chars) in limits.items():
+            texts = columns[field].fillna("").astype(str)
+            lengths = texts.str.len()
+            for row in lengths.index[(lengths < min_chars) | (lengths > max_chars)]:
+                violations.append({
+                    "id": f"{channel}:{row}:{field}", "channel": channel, "row": int(row), "field": field,
+                    "text": texts[row], "length": int(lengths[row]), "min_chars": min_chars, "max_chars": max_chars,
+                })
+    return violations
+
+
+def _set_field(ad_data, violation, text):
+    if SHEET_SCHEMAS[violation["channel"]]["kind"] == "paired_lists":
+        ad_data[violation["channel"]][violation["field"]][violation["row"]] = text
+    else:
+        ad_data[violation["channel"]][violation["row"]][violation["field"]] = text
+
+
+def fix_limit_violations(client, context_summary, ad_data, violations):
+    """
+    Re-requests only the offending fields, all in one call with the run's context, and writes
+    back each rewrite that now fits its limits (ad_data is updated in place).
+    Returns the number of fields fixed.
+    """
+    batch = violations[:MAX_FIELDS_PER_FIX_REQUEST]
+    if not batch:
+        return 0
+    fields = [{key: violation[key] for key in ("id", "channel", "field", "text", "min_chars", "max_chars")}
+              for violation in batch]
+    content = generate_content_with_ai(client, create_length_fix_prompt(fields), context_summary=context_summary)
+    if not isinstance(content, dict) or not isinstance(content.get("fixes"), list):
+        logger.warning("Character limit fix request returned no usable fixes.")
+        return 0
+
+    by_id = {violation["id"]: violation for violation in batch}
+    fixed = 0
+    for fix in content["fixes"]:
+        violation = by_id.pop(fix.get("id"), None) if isinstance(fix, dict) else None
+        text = fix.get("text") if violation else None
+        if isinstance(text, str) and violation["min_chars"] <= len(text) <= violation["max_chars"]:
+            _set_field(ad_data, violation, text)
+            fixed += 1
+    return fixed
+
+
+def limit_flags(violations):
+    """{channel: {(row, field): note}} for highlighting the violating cells in the workbook."""
+    flags = {}
+    for violation in violations:
+        limit = (f"{violation['min_chars']}-{violation['max_chars']}" if violation["min_chars"]
+                 else f"up to {violation['max_chars']}")
+        flags.setdefault(violation["channel"], {})[(violation["row"], violation["field"])] = (
+            f"{violation['length']} characters; limit {limit}."
+        )
+    return flags
@@ -0,0 +1,325 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src.ad_generator import DEFAULT_MAX_CONCURRENT_GENERATIONS
+from src.cache import make_cache_key, hash_file
+from src.context_compactor import DEFAULT_CONTEXT_TOKEN_BUDGET
+from src.exporters import EXPORTERS, export_ad_data
+from src.instrumentation import prometheus_text
+from src.openai_handler import get_openai_client
+from src.rate_limiter import get_scheduler
+from src.pipeline import (
+    LocalFile, prepare_job, run_pipeline, excel_file_name,
+    DEFAULT_CONTENT_COUNT, LEAD_OBJECTIVE_TYPES
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARALLEL_CLIENTS = 2
+
+
+def load_manifest(path):
+    """
+    Reads a JSONL or CSV manifest with one client per line/row. Recognized fields:
+    name, url, lead_objective_type, learn_more_link, downloadable_material_link,
+    demo_booking_link, sales_meeting_link, content_count, additional_context_file,
+    downloadable_material_file, crawl, crawl_max_pages.
+    The file fields take one path, several separated by ';' or (JSONL) a list of paths.
+    File paths are resolved relative to the manifest.
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = [{k: v for k, v in row.items() if v not in (None, "")} for row in csv.DictReader(f)]
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    for row in rows:
+        for key in ("additional_context_file", "downloadable_material_file"):
+            paths = row.get(key) or []
+            if isinstance(paths, str):
+                paths = [path.strip() for path in paths.split(";") if path.strip()]
+            row[key] = [os.path.join(base_dir, path) for path in paths]
+    return rows
+
+
+def _job_name(row, index, used_names):
+    """A filesystem-safe, unique name for the job's output and checkpoint files."""
+    name = row.get("name") or row.get("url") or f"client-{index + 1}"
+    name = re.sub(r"^https?://", "", name)
+    name = re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("_") or f"client-{index + 1}"
+    unique = name
+    suffix = 2
+    while unique in used_names:
+        unique = f"{name}-{suffix}"
+        suffix += 1
+    used_names.add(unique)
+    return unique
+
+
+def _is_truthy(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "y")
+
+
+def _positive_int(row, key, default):
+    """(value, None) for a positive whole number in row[key] (or default), else (None, error message)."""
+    value = row.get(key, default)
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None, f"{key} must be a whole number, got {value!r}."
+    if number < 1 or number != float(value):
+        return None, f"{key} must be a positive whole number, got {value!r}."
+    return number, None
+
+
+def _prepare_row(row, args):
+    content_count, error = _positive_int(row, "content_count", args.content_count)
+    if error:
+        return None, error
+    crawl_options = None
+    if _is_truthy(row.get("crawl", False)):
+        crawl_options = {}
+        if row.get("crawl_max_pages"):
+            crawl_options["max_pages"], error = _positive_int(row, "crawl_max_pages", None)
+            if error:
+                return None, error
+    lead_objective_type = row.get("lead_objective_type", LEAD_OBJECTIVE_TYPES[0])
+    if lead_objective_type not in LEAD_OBJECTIVE_TYPES:
+        return None, f"Unknown lead_objective_type '{lead_objective_type}', expected one of {LEAD_OBJECTIVE_TYPES}."
+    for key in ("additional_context_file", "downloadable_material_file"):
+        for path in row.get(key, []):
+            if not os.path.isfile(path):
+                return None, f"File not found: {path}"
+    return prepare_job(
+        row.get("url"), lead_objective_type, row.get("learn_more_link"), row.get("downloadable_material_link"),
+        row.get("demo_booking_link", ""), row.get("sales_meeting_link", ""),
+        content_count,
+        [LocalFile(path) for path in row.get("additional_context_file", [])],
+        [LocalFile(path) for path in row.get("downloadable_material_file", [])],
+        crawl_options, args.context_token_budget, args.max_concurrent_generations, profile_dir=args.profile_dir
+    )
+
+
+def _inputs_key(row, args):
+    """
+    Identifies what a client's results depend on: its manifest entry, the contents of its
+    files and the batch-wide defaults that apply to it. A checkpoint is only resumed (or a
+    finished client skipped) when this still matches.
+    """
+    file_hashes = [hash_file(path) for key in ("additional_context_file", "downloadable_material_file")
+                   for path in row.get(key, [])]
+    return make_cache_key(
+        json.dumps(row, sort_keys=True, default=str), *file_hashes, args.content_count, args.context_token_budget
+    )
+
+
+def _load_checkpoint(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _write_json_atomically(path, data, lock):
+    with lock:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+def _trace_path(output_dir, name):
+    return os.path.join(output_dir, "traces", f"{name}.json")
+
+
+def _write_outputs(ad_data, links, excel_bytes, name, output_dir, formats):
+    """Writes ad_data in each format (excel_bytes() builds the workbook); returns {format: [paths]}."""
+    outputs = {}
+    for fmt in formats:
+        if fmt == "xlsx":
+            output_path = os.path.join(output_dir, excel_file_name(name))
+            tmp_path = f"{output_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(excel_bytes())
+            os.replace(tmp_path, output_path)
+            outputs[fmt] = [output_path]
+        else:
+            outputs[fmt] = export_ad_data(ad_data, links, fmt, output_dir, f"{name}_ads_creative")
+    return outputs
+
+
+def _report(outputs, failed_generations):
+    paths = ", ".join(path for paths in outputs.values() for path in paths)
+    if failed_generations:
+        return "partial", f"{paths} (missing: {', '.join(failed_generations)})"
+    return "done", paths
+
+
+def run_batch_job(client, job, name, output_dir, formats=("xlsx",), inputs_key=None):
+    """
+    Runs one client, resuming from and updating its checkpoint, and writes its outputs
+    in each of the requested formats plus its run trace (traces/<name>.json). A checkpoint
+    written for different inputs (see _inputs_key) is discarded. A finished client is skipped
+    when every requested format is on disk; missing formats are written from the ad content
+    kept in its checkpoint, without any API calls.
+    Returns (status, message).
+    """
+    from src.ad_validator import limit_flags
+    from src.excel_generator import create_excel_file
+
+    checkpoint_path = os.path.join(output_dir, "checkpoints", f"{name}.json")
+    checkpoint = _load_checkpoint(checkpoint_path)
+    if checkpoint and checkpoint.get("inputs_key") != inputs_key:
+        logger.info("[%s] inputs changed since the last run; starting over", name)
+        checkpoint = {}
+    checkpoint["inputs_key"] = inputs_key
+    checkpoint_lock = threading.Lock()
+
+    if checkpoint.get("done") and "ad_data" in checkpoint:
+        outputs = {fmt: paths for fmt, paths in checkpoint.get("outputs", {}).items()
+                   if all(os.path.exists(path) for path in paths)}
+        missing_formats = [fmt for fmt in formats if fmt not in outputs]
+        if not missing_formats:
+            paths = [path for fmt in formats for path in outputs[fmt]]
+            return "skipped", f"already completed: {', '.join(paths)}"
+        logger.info("[%s] writing %s from the checkpoint", name, ", ".join(missing_formats))
+        outputs.update(_write_outputs(
+            checkpoint["ad_data"], checkpoint["links"],
+            lambda: create_excel_file(
+                checkpoint["ad_data"], job["company_name"], checkpoint["links"], limit_flags(checkpoint["limit_violations"])
+            ).getvalue(),
+            name, output_dir, missing_formats
+        ))
+        checkpoint["outputs"] = outputs
+        _write_json_atomically(checkpoint_path, checkpoint, checkpoint_lock)
+        _, message = _report({fmt: outputs[fmt] for fmt in formats}, checkpoint["failed_generations"])
+        return "exported", message # No new run, so no new trace
+
+    def log_progress(step_increment=1, message=""):
+        if message:
+            logger.info("[%s] %s", name, message)
+
+    result = run_pipeline(
+        client, job,
+        on_progress=log_progress,
+        on_warning=lambda message: logger.warning("[%s] %s", name, message),
+        checkpoint=checkpoint,
+        save_checkpoint=lambda data: _write_json_atomically(checkpoint_path, data, checkpoint_lock),
+    )
+    _write_json_atomically(_trace_path(output_dir, name), result["trace"], checkpoint_lock)
+    if not result["excel_bytes"]:
+        return "failed", result["error"]
+
+    outputs = _write_outputs(
+        result["ad_data"], result["links"], lambda: result["excel_bytes"], name, output_dir, formats
+    )
+    # The finished content is kept so formats requested later need no API calls
+    checkpoint.update({
+        "done": True,
+        "outputs": outputs,
+        "ad_data": result["ad_data"],
+        "links": result["links"],
+        "limit_violations": result["limit_violations"],
+        "failed_generations": result["failed_generations"],
+    })
+    _write_json_atomically(checkpoint_path, checkpoint, checkpoint_lock)
+    return _report(outputs, result["failed_generations"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate ad content workbooks for many clients from a manifest.")
+    parser.add_argument("manifest", help="JSONL or CSV file with one client per line/row")
+    parser.add_argument("--output-dir", default="batch_output", help="Where XLSX files and checkpoints are written")
+    parser.add_argument("--parallel-clients", type=int, default=DEFAULT_PARALLEL_CLIENTS,
+                        help="Number of clients processed at the same time")
+    parser.add_argument("--max-concurrent-generations", type=int, default=DEFAULT_MAX_CONCURRENT_GENERATIONS,
+                        help="Parallel generation calls per client")
+    parser.add_argument("--content-count", type=int, default=DEFAULT_CONTENT_COUNT,
+                        help="Ad variations per objective when the manifest does not set content_count")
+    parser.add_argument("--context-token-budget", type=int, default=DEFAULT_CONTEXT_TOKEN_BUDGET)
+    parser.add_argument("--formats", default="xlsx",
+                        help=f"Comma-separated output formats: {', '.join(EXPORTERS)}")
+    parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints and outputs")
+    parser.add_argument("--metrics-file", help="Prometheus text file for this batch (default: <output-dir>/metrics.prom)")
+    parser.add_argument("--profile-dir", help="Write cProfile stats for the extraction and Excel stages here")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    formats = [fmt.strip().lower() for fmt in args.formats.split(",") if fmt.strip()]
+    unknown_formats = [fmt for fmt in formats if fmt not in EXPORTERS]
+    if unknown_formats:
+        parser.error(f"unknown format(s): {', '.join(unknown_formats)}")
+    client = get_openai_client()
+    if not client:
+        return 2
+
+    os.makedirs(os.path.join(args.output_dir, "checkpoints"), exist_ok=True)
+    os.makedirs(os.path.join(args.output_dir, "traces"), exist_ok=True)
+    used_names = set()
+    jobs = []
+    failures = 0
+    for index, row in enumerate(load_manifest(args.manifest)):
+        name = _job_name(row, index, used_names)
+        try: # A bad entry fails only its own client
+            job, error = _prepare_row(row, args)
+            inputs_key = None if error else _inputs_key(row, args)
+        except (OSError, TypeError, ValueError) as e:
+            job, error = None, str(e)
+        if error:
+            logger.error("[%s] invalid manifest entry: %s", name, error)
+            failures += 1
+            continue
+        if args.restart:
+            checkpoint_path = os.path.join(args.output_dir, "checkpoints", f"{name}.json")
+            if os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+        jobs.append((name, job, inputs_key))
+
+    traced_names = []
+    with ThreadPoolExecutor(max_workers=max(1, args.parallel_clients)) as executor:
+        future_to_name = {
+            executor.submit(run_batch_job, client, job, name, args.output_dir, formats, inputs_key): name
+            for name, job, inputs_key in jobs
+        }
+        for future in as_completed(future_to_name):
+            name = future_to_name[future]
+            try:
+                status, message = future.result()
+            except Exception as e:
+                status, message = "failed", str(e)
+            if status not in ("skipped", "exported") and os.path.exists(_trace_path(args.output_dir, name)):
+                traced_names.append(name)
+            if status == "failed":
+                failures += 1
+                logger.error("[%s] failed: %s", name, message)
+            else:
+                logger.info("[%s] %s: %s", name, status, message)
+
+    logger.info("Batch finished: %d clients, %d failed", len(jobs), failures)
+    scheduler_metrics = get_scheduler().metrics()
+    traces = []
+    for name in traced_names:
+        with open(_trace_path(args.output_dir, name), encoding="utf-8") as f:
+            traces.append(json.load(f))
+    metrics_file = args.metrics_file or os.path.join(args.output_dir, "metrics.prom")
+    with open(metrics_file, "w", encoding="utf-8") as f:
+        f.write(prometheus_text(traces, scheduler_metrics))
+    logger.info("Wrote metrics for %d runs to %s", len(traces), metrics_file)
+    logger.info(
+        "OpenAI calls: %d requests, %d retries, %d failed, %d throttled (avg wait %.2fs, peak queue depth %d)",
+        scheduler_metrics["requests"], scheduler_metrics["retries"], scheduler_metrics["failures"],
+        scheduler_metrics["throttled"], scheduler_metrics["avg_wait_seconds"], scheduler_metrics["max_queue_depth"]
+    )
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Location and size of the on-disk cache; override with the environment variables.
+DEFAULT_CACHE_DIR = os.environ.get("AD_GEN_CACHE_DIR", ".cache")
+DEFAULT_CACHE_MAX_BYTES = int(os.environ.get("AD_GEN_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+# Time-to-live per kind of entry, in seconds.
+EXTRACTED_FILE_TTL = 30 * 24 * 3600 # File bytes never change under the same hash
+EXTRACTED_URL_TTL = 7 * 24 * 3600 # Keyed by the fetched body, so a changed page gets a new key
+SUMMARY_TTL = 30 * 24 * 3600
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """sha256 of a file's contents, read in chunks so large uploads are never held in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_cache_key(*parts):
+    """Builds a content-addressed key from strings/bytes, e.g. ("summary", model, prompt_version, text)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if not isinstance(part, bytes):
+            part = str(part).encode("utf-8")
+        digest.update(hashlib.sha256(part).digest()) # Hash each part so boundaries can't collide
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    A small persistent key/value cache backed by SQLite.
+    Entries have a TTL and the total size is bounded with least-recently-used eviction.
+    Hit/miss counts are kept per namespace for the lifetime of the process.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "cache.sqlite3")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+
+    def _count(self, namespace, outcome):
+        counts = self._stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def get(self, namespace, key, track=True):
+        """
+        Returns the cached value, or None if missing or expired. track=False keeps the lookup
+        out of the hit/miss counts (for bookkeeping entries such as HTTP validators).
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+                if track:
+                    self._count(namespace, "misses")
+                return None
+            self._conn.execute(
+                "UPDATE entries SET accessed_at = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+            )
+            if track:
+                self._count(namespace, "hits")
+            return row[0]
+
+    def set(self, namespace, key, value, ttl):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, size, now + ttl, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        """Drops expired entries, then least-recently-used ones until under max_bytes."""
+        self._conn.execute("DELETE FROM entries WHERE expires_at < ?", (now,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for namespace, key, size in self._conn.execute(
+            "SELECT namespace, key, size FROM entries ORDER BY accessed_at ASC"
+        ).fetchall():
+            self._conn.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """Returns hit/miss counts per namespace plus totals and the current on-disk footprint."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+            namespaces = {ns: dict(counts) for ns, counts in self._stats.items()}
+        return {
+            "hits": sum(c["hits"] for c in namespaces.values()),
+            "misses": sum(c["misses"] for c in namespaces.values()),
+            "namespaces": namespaces,
+            "entries": entries,
+            "bytes": size,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Returns the process-wide cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DiskCache()
+        return _cache
+
+
+def use_cache(cache):
+    """Replaces the process-wide cache, e.g. with a fresh DiskCache for a cold benchmark run."""
+    global _cache
+    with _cache_lock:
+        _cache = cache
+
+
+def cached_text(namespace, key, ttl, compute):
+    """
+    Returns the cached text for key, or calls compute() and caches its result.
+    Empty results and error strings are not cached so that failures are retried.
+    """
+    from src.instrumentation import count
+
+    cache = get_cache()
+    value = cache.get(namespace, key)
+    if value is not None:
+        count("cache_hits", namespace=namespace)
+        return value
+    count("cache_misses", namespace=namespace)
+    value = compute()
+    if value and not value.startswith("Error"):
+        cache.set(namespace, key, value, ttl)
+    return value
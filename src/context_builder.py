@@ -0,0 +1,230 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from src.text_extractor import (
+    extract_text_from_html, extract_text_from_path, get_file_extractor, process_pool_context,
+    HTML_EXTRACTOR_VERSION, FILE_EXTRACTOR_VERSION
+)
+from src.http_fetch import fetch_url
+from src.site_crawler import crawl_site_text
+from src.openai_handler import (
+    summarize_text_with_ai, summary_input_char_limit,
+    AI_MODEL, SUMMARY_PROMPT_VERSION, DEFAULT_SUMMARY_MODE
+)
+from src.cache import (
+    cached_text, make_cache_key, hash_bytes, hash_file,
+    EXTRACTED_FILE_TTL, EXTRACTED_URL_TTL, SUMMARY_TTL
+)
+from src.instrumentation import stage, profiled, profiling_enabled, STAGE_PARSE, STAGE_SUMMARIZE
+from src.utils import worker_thread_initializer
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on worker processes used for PDF/PPTX parsing.
+MAX_EXTRACTION_PROCESSES = max(1, min(4, os.cpu_count() or 1))
+# Upper bound on sources extracted and summarized at once (each on its own thread).
+MAX_CONCURRENT_SOURCES = 12
+
+# Upload roles: (source id prefix, label prefix, section name for the summarizer, summary title).
+FILE_ROLES = {
+    "additional_context": ("additional context file", "additional context document", "Additional Context Summary"),
+    "downloadable_material": ("downloadable material", "downloadable lead material", "Downloadable Material Summary"),
+}
+
+
+def get_file_extension(file_name):
+    return file_name.split('.')[-1].lower()
+
+
+def build_context_sources(client_url, additional_context_files=(), downloadable_material_files=(), crawl_options=None):
+    """
+    Returns the ordered list of context sources for one client: the website, then each
+    additional context file, then each downloadable material file (files are LocalFiles,
+    see pipeline.spool_uploads). The order here is the order of the resulting summaries.
+    When crawl_options is given (a dict of site_crawler budgets, possibly empty),
+    same-site pages are crawled instead of reading only the landing page.
+    """
+    sources = []
+    if client_url:
+        sources.append({
+            "id": "website",
+            "kind": "url",
+            "url": client_url,
+            "crawl_options": crawl_options,
+            "label": f"URL: {client_url}",
+            "section_name": "website content",
+            "summary_title": "Website Summary",
+        })
+    for role, files in (("additional_context", additional_context_files), ("downloadable_material", downloadable_material_files)):
+        label, section_name, summary_title = FILE_ROLES[role]
+        for index, file in enumerate(files, 1):
+            sources.append({
+                "id": f"{role}_{index}",
+                "kind": "file",
+                "file_name": file.name,
+                "ext": get_file_extension(file.name),
+                "path": file.path,
+                "size": os.path.getsize(file.path),
+                "label": f"{label}: {file.name}",
+                "section_name": section_name,
+                "summary_title": f"{summary_title} ({file.name})" if len(files) > 1 else summary_title,
+            })
+    return sources
+
+
+def _extract_url_text(url):
+    """
+    Fetches the page (conditionally, so unchanged pages come from the validator store)
+    and caches the extracted text by URL and body hash.
+    """
+    import requests
+
+    try:
+        page = fetch_url(url)
+    except requests.exceptions.RequestException as e:
+        return f"Error fetching URL: {e}"
+    def _extract():
+        with stage(STAGE_PARSE, url):
+            return extract_text_from_html(page["content"])
+    return cached_text(
+        "extracted_url", make_cache_key(url, hash_bytes(page["content"]), HTML_EXTRACTOR_VERSION),
+        EXTRACTED_URL_TTL, _extract
+    )
+
+
+_extraction_pool = None
+_extraction_pool_lock = threading.Lock()
+
+
+def get_extraction_pool():
+    """
+    Returns the process-wide pool for PDF/PPTX parsing, shared by all runs and started on
+    first use (workers are started on demand, from a fork server; see process_pool_context).
+    Returns None when worker processes are unavailable.
+    """
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is None:
+            try:
+                _extraction_pool = ProcessPoolExecutor(
+                    max_workers=MAX_EXTRACTION_PROCESSES, mp_context=process_pool_context()
+                )
+            except (OSError, NotImplementedError, ValueError):
+                return None
+            atexit.register(_extraction_pool.shutdown, cancel_futures=True)
+        return _extraction_pool
+
+
+def _reset_extraction_pool(pool):
+    """Drops a broken pool (e.g. a worker was killed) so the next run starts a new one."""
+    global _extraction_pool
+    with _extraction_pool_lock:
+        if _extraction_pool is pool:
+            _extraction_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _extract_source_text(source, process_pool, char_limit):
+    if source["kind"] == "url" and source.get("crawl_options") is not None:
+        # Pages are revalidated individually by the fetch layer; the summary cache covers the merged corpus
+        return crawl_site_text(source["url"], **source["crawl_options"])
+    if source["kind"] == "url":
+        return _extract_url_text(source["url"])
+
+    if get_file_extractor(source["ext"]) is None:
+        return f"Error: unsupported file type '.{source['ext']}'"
+
+    # Text past the summarizer's input limit would be discarded, so extraction stops there
+    def _extract():
+        with stage(STAGE_PARSE, source["file_name"], bytes=source["size"]):
+            if process_pool is not None:
+                try:
+                    # Large documents are split into page/slide batches across the pool's workers
+                    return extract_text_from_path(source["path"], source["ext"], char_limit, executor=process_pool)
+                except BrokenProcessPool:
+                    logger.warning("Extraction worker pool broke; parsing %s on this thread", source["file_name"])
+                    _reset_extraction_pool(process_pool)
+            return extract_text_from_path(source["path"], source["ext"], char_limit)
+    return cached_text(
+        "extracted_file", make_cache_key(source["ext"], char_limit, hash_file(source["path"]), FILE_EXTRACTOR_VERSION),
+        EXTRACTED_FILE_TTL, _extract
+    )
+
+
+def _extract_and_summarize(client, source, process_pool, summary_options):
+    """Runs one source end to end, reusing cached text and summaries. Returns (summary, warning)."""
+    char_limit = summary_input_char_limit(summary_options.get("mode", DEFAULT_SUMMARY_MODE))
+    with profiled("extract", source["id"]):
+        text = _extract_source_text(source, process_pool, char_limit)
+
+    if not text or text.startswith("Error"):
+        return "", f"Could not extract significant content from {source['label']} or error occurred: {text}"
+
+    summary_key = make_cache_key(
+        AI_MODEL, SUMMARY_PROMPT_VERSION, json.dumps(summary_options, sort_keys=True), source["section_name"], text
+    )
+    def _summarize():
+        with stage(STAGE_SUMMARIZE, source["id"], chars=len(text)):
+            return summarize_text_with_ai(client, text, source["section_name"], **summary_options)
+    summary = cached_text("summary", summary_key, SUMMARY_TTL, _summarize)
+    if not summary:
+        return "", None
+    return f"{source['summary_title']}:\n{summary}", None
+
+
+def iter_context_summaries(client, sources, summary_options=None):
+    """
+    Extracts and summarizes all context sources concurrently and yields
+    (source, summary, warning) in source order, each as soon as it and every source before
+    it are done. URL fetches and summarization calls run on threads; PDF/PPTX parsing is
+    CPU-bound and runs in worker processes, dispatched by file type (see FILE_EXTRACTORS), with
+    large PDFs and decks split into page/slide batches across the workers (see FILE_BATCH_SPLITTERS).
+    summary_options are passed on to summarize_text_with_ai (mode, chunk_tokens, concurrency,
+    max_depth). Closing the generator early cancels sources that have not started.
+    """
+    if not sources:
+        return
+
+    # When profiling, files are parsed on the profiled thread instead of in worker processes
+    has_files = any(source["kind"] == "file" for source in sources)
+    process_pool = get_extraction_pool() if has_files and not profiling_enabled() else None
+
+    summary_options = summary_options or {}
+    executor = ThreadPoolExecutor(
+        max_workers=min(len(sources), MAX_CONCURRENT_SOURCES), initializer=worker_thread_initializer()
+    )
+    futures = [
+        executor.submit(_extract_and_summarize, client, source, process_pool, summary_options) for source in sources
+    ]
+    try:
+        for source, future in zip(sources, futures):
+            try:
+                summary, warning = future.result()
+            except Exception as e:
+                summary, warning = "", f"Error processing {source['label']}: {e}"
+            yield source, summary, warning
+    finally:
+        executor.shutdown(cancel_futures=True) # Parses already sent to the shared pool run to completion
+
+
+def build_context_summaries(client, sources, on_source_done=None, summary_options=None):
+    """
+    Runs iter_context_summaries; on_source_done(source, summary, warning) is called from the
+    calling thread for each source, in source order.
+    Returns (all_summaries in source order, list of warnings).
+    """
+    all_summaries = []
+    warnings = []
+    for source, summary, warning in iter_context_summaries(client, sources, summary_options):
+        if summary:
+            all_summaries.append(summary)
+        if warning:
+            warnings.append(warning)
+        if on_source_done:
+            on_source_done(source, summary, warning)
+    return all_summaries, warnings
@@ -0,0 +1,165 @@
+import logging
+import re
+
+from src.token_utils import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Tokens of context embedded in each generation prompt.
+DEFAULT_CONTEXT_TOKEN_BUDGET = 4000
+# Facts whose content words overlap at least this much with an earlier fact are kept once.
+DUPLICATE_SIMILARITY = 0.8
+MIN_DUPLICATE_WORDS = 4 # Shorter facts are too generic to compare
+SECTION_SEPARATOR = "\n\n---\n\n"
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"“(])')
+_LIST_MARKER = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s+')
+_WORD = re.compile(r"[a-z0-9$%][a-z0-9$%'.-]*")
+_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or our that the their they this to we with "
+    "you your".split()
+)
+
+
+def _is_heading(line):
+    stripped = line.strip().strip("*_").strip()
+    return stripped.startswith("#") or (stripped.endswith(":") and len(stripped) < 80)
+
+
+def _split_facts(body):
+    """Splits a summary body into (heading, fact) pairs; list items and sentences are facts."""
+    facts = []
+    heading = None
+    for line in body.splitlines():
+        if not line.strip():
+            continue
+        if _is_heading(line):
+            heading = line.strip()
+            continue
+        marker = _LIST_MARKER.match(line)
+        prefix = marker.group(0).strip() + " " if marker else ""
+        text = line[marker.end():] if marker else line.strip()
+        for sentence in _SENTENCE_BOUNDARY.split(text):
+            if sentence.strip():
+                facts.append((heading, prefix + sentence.strip()))
+                prefix = "" # Only the first sentence of a list item keeps the marker
+    return facts
+
+
+def _content_words(fact):
+    return frozenset(word for word in _WORD.findall(fact.lower()) if word not in _STOPWORDS)
+
+
+def _find_duplicate(words, kept_word_sets):
+    """Returns the index of a kept fact that words repeat, or None."""
+    if len(words) < MIN_DUPLICATE_WORDS:
+        return None
+    for index, other in enumerate(kept_word_sets):
+        overlap = len(words & other)
+        # Containment in either direction catches a short fact restated inside a longer one
+        if overlap / min(len(words), len(other)) >= DUPLICATE_SIMILARITY:
+            return index
+    return None
+
+
+def _render_sections(sections):
+    """Renders each section's kept facts under its title, repeating headings where they change."""
+    rendered = []
+    for section in sections:
+        lines = [section["title"]]
+        current_heading = None
+        for heading, fact, _ in section["facts"][:section["kept"]]:
+            if heading and heading != current_heading:
+                lines.append(heading)
+                current_heading = heading
+            lines.append(fact)
+        if len(lines) > 1:
+            rendered.append("\n".join(lines))
+    return SECTION_SEPARATOR.join(rendered)
+
+
+def compact_context(summaries, token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET, prompt_count=1):
+    """
+    Compacts the "Title:\\nbody" summaries into a single context string for the generation prompts.
+    Facts repeated across summaries (e.g. the website and the deck both describing the product)
+    are kept only once, in the more detailed wording but at the first one's place, and the
+    result is trimmed to token_budget tokens by taking facts from each summary in turn, so
+    every source keeps its leading points. The budget covers the
+    rendered context, including titles, headings and section separators.
+    Returns (context, stats) where stats reports tokens before/after and the savings across
+    prompt_count prompts.
+    """
+    original_context = SECTION_SEPARATOR.join(summaries)
+    original_tokens = count_tokens(original_context)
+
+    sections = []
+    kept_word_sets = []
+    kept_positions = [] # (facts list, index) of each kept fact, parallel to kept_word_sets
+    duplicates_removed = 0
+    for summary in summaries:
+        title, _, body = summary.partition("\n")
+        facts = []
+        for heading, fact in _split_facts(body):
+            words = _content_words(fact)
+            duplicate = _find_duplicate(words, kept_word_sets)
+            if duplicate is not None:
+                duplicates_removed += 1
+                if len(words) > len(kept_word_sets[duplicate]):
+                    # The restatement is the more detailed one; it takes the earlier fact's place
+                    kept_facts, index = kept_positions[duplicate]
+                    kept_facts[index] = (kept_facts[index][0], fact, count_tokens("\n" + fact))
+                    kept_word_sets[duplicate] = words
+                continue
+            kept_word_sets.append(words)
+            kept_positions.append((facts, len(facts)))
+            facts.append((heading, fact, count_tokens("\n" + fact)))
+        sections.append({"title": title, "facts": facts, "kept": 0})
+
+    # Round-robin across sections until the budget is used up. Each fact is charged what it adds
+    # to the rendered context: its line, a heading line when the heading changes, and the title
+    # and section separator when it is the section's first fact.
+    separator_tokens = count_tokens(SECTION_SEPARATOR)
+    used_tokens = 0
+    progressed = True
+    while progressed:
+        progressed = False
+        for section in sections:
+            if section["kept"] < len(section["facts"]):
+                heading, fact, fact_tokens = section["facts"][section["kept"]]
+                if section["kept"] == 0:
+                    fact_tokens += count_tokens(section["title"]) + (separator_tokens if used_tokens else 0)
+                    previous_heading = None
+                else:
+                    previous_heading = section["facts"][section["kept"] - 1][0]
+                if heading and heading != previous_heading:
+                    fact_tokens += count_tokens("\n" + heading)
+                if used_tokens + fact_tokens > token_budget:
+                    continue
+                used_tokens += fact_tokens
+                section["kept"] += 1
+                progressed = True
+
+    context = _render_sections(sections)
+    # Tokens do not add up exactly across line joins; trim the longest sections until the render fits
+    while count_tokens(context) > token_budget and any(section["kept"] for section in sections):
+        max(sections, key=lambda section: section["kept"])["kept"] -= 1
+        context = _render_sections(sections)
+    facts_trimmed = sum(len(section["facts"]) - section["kept"] for section in sections)
+
+    compacted_tokens = count_tokens(context)
+    stats = {
+        "original_tokens": original_tokens,
+        "compacted_tokens": compacted_tokens,
+        "duplicates_removed": duplicates_removed,
+        "facts_trimmed": facts_trimmed,
+        "tokens_saved_per_prompt": max(0, original_tokens - compacted_tokens),
+        "prompt_count": prompt_count,
+        "tokens_saved_per_run": max(0, original_tokens - compacted_tokens) * prompt_count,
+    }
+    logger.info(
+        "Context compacted from %d to %d tokens (%d duplicate facts, %d trimmed)",
+        original_tokens, compacted_tokens, duplicates_removed, facts_trimmed
+    )
+    if prompt_count: # Callers passing 0 count the prompts themselves as they are made
+        logger.info("%d input tokens saved across %d prompts", stats["tokens_saved_per_run"], prompt_count)
+    return context, stats
@@ -1,196 +1,211 @@
 import pandas as pd
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-from openpyxl.utils.dataframe import dataframe_to_rows
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.comments import Comment
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.utils import get_column_letter
 import io
 
-def apply_header_style(cell):
-    cell.font = Font(color="FFFFFF", bold=True)
-    cell.fill = PatternFill(start_color="000000", end_color="000000", fill_type="solid")
-    cell.alignment = Alignment(horizontal="center", vertical="center")
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    cell.border = thin_border
-
-def apply_content_style(cell, is_version_col=False):
-    cell.alignment = Alignment(vertical="middle", wrap_text=True, horizontal="center" if is_version_col else "left")
-    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-    cell.border = thin_border
+from src.sheet_schemas import SHEET_SCHEMAS, iter_sheets
+
+HEADER_STYLE = "Ad Header"
+CONTENT_STYLE = "Ad Content"
+CENTERED_CONTENT_STYLE = "Ad Content Centered" # Version # column
+OVER_LIMIT_STYLE = "Ad Content Over Limit" # Text outside its character limit (see ad_validator)
+
+MAX_COLUMN_WIDTH = 60
+MIN_COLUMN_WIDTH = 10
+LINE_HEIGHT = 15 # Approx 15 points per wrapped line
+
+THIN_BORDER = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+
+
+def _register_named_styles(wb):
+    """Registers the shared styles once per workbook; cells then reference them by name."""
+    wb.add_named_style(NamedStyle(
+        name=HEADER_STYLE,
+        font=Font(color="FFFFFF", bold=True),
+        fill=PatternFill(start_color="000000", end_color="000000", fill_type="solid"),
+        alignment=Alignment(horizontal="center", vertical="center"),
+        border=THIN_BORDER,
+    ))
+    wb.add_named_style(NamedStyle(
+        name=CONTENT_STYLE,
+        alignment=Alignment(vertical="center", wrap_text=True, horizontal="left"),
+        border=THIN_BORDER,
+    ))
+    wb.add_named_style(NamedStyle(
+        name=CENTERED_CONTENT_STYLE,
+        alignment=Alignment(vertical="center", wrap_text=True, horizontal="center"),
+        border=THIN_BORDER,
+    ))
+    wb.add_named_style(_over_limit_style())
     # Padding is not directly supported, rely on wrap_text and column width/row height
 
-def adjust_column_width_and_row_height(ws):
-    for col_idx, column_cells in enumerate(ws.columns):
-        max_length = 0
-        column_letter = get_column_letter(col_idx + 1)
-        for cell in column_cells:
-            if cell.value:
-                cell_length = 0
-                if isinstance(cell.value, str):
-                    # Consider line breaks for height, max line length for width
-                    lines = cell.value.split('\n')
-                    max_line_len = max(len(line) for line in lines) if lines else 0
-                    cell_length = max_line_len
-
-                elif isinstance(cell.value, (int, float)):
-                    cell_length = len(str(cell.value))
-                
-                if cell_length > max_length:
-                    max_length = cell_length
-        
-        adjusted_width = (max_length + 5) # Add some padding
-        if adjusted_width > 60: # Max width cap
-             adjusted_width = 60
-        if adjusted_width < 10: # Min width for version numbers etc.
-            if column_letter == 'A' and "Version" in str(ws['A1'].value): # Heuristic for Version #
-                 adjusted_width = 10
-            elif max_length > 0 : # if there is content
-                 adjusted_width = max_length + 5 if max_length + 5 > 10 else 10
-
-
-        ws.column_dimensions[column_letter].width = adjusted_width
-
-    for row_idx, row_cells in enumerate(ws.rows):
-        max_lines = 1
-        # Estimate row height based on wrapped text; this is imperfect
-        # openpyxl doesn't have a perfect auto-fit row height for wrapped text
-        # This is a basic estimation
-        for cell in row_cells:
-            if cell.value and isinstance(cell.value, str):
-                lines = cell.value.count('\n') + 1
-                if lines > max_lines:
-                    max_lines = lines
-        if max_lines > 1:
-             ws.row_dimensions[row_idx + 1].height = max_lines * 15 # Approx 15 pixels per line
-
-
-def create_excel_file(ad_data, company_name, links):
+
+def _over_limit_style():
+    return NamedStyle(
+        name=OVER_LIMIT_STYLE,
+        fill=PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid"),
+        alignment=Alignment(vertical="center", wrap_text=True, horizontal="left"),
+        border=THIN_BORDER,
+    )
+
+
+def _layout_text(value):
+    """The text a cell is measured by: strings as-is, numbers as printed, empty/other values as ''."""
+    if not value:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return str(value)
+    return ""
+
+
+def _longest_line_length(column, has_multiline_cells):
+    """Longest line across a column of strings, short-circuiting once the width cap is reached."""
+    if not has_multiline_cells:
+        return column.str.len().max()
+    capped_length = MAX_COLUMN_WIDTH - 5
+    if column.str.contains(f"[^\\n]{{{capped_length}}}").any():
+        return capped_length # The column hits MAX_COLUMN_WIDTH regardless of longer lines
+    return column.str.split("\n").explode().str.len().max()
+
+
+def plan_sheet_layout(headers, rows):
+    """
+    Computes a sheet's layout plan once from the source rows, before they are written
+    (write-only sheets cannot be measured afterwards). Line counts and longest-line lengths
+    are computed with vectorized string operations per column.
+    Returns {"column_widths": {letter: width}, "row_heights": {row_number: height}}.
+    """
+    text = pd.DataFrame([headers] + rows, columns=range(len(headers)), dtype=object).map(_layout_text)
+    text.index = range(1, len(text) + 1) # Worksheet row numbers
+
+    line_counts = text.apply(lambda column: column.str.count("\n") + 1)
+    max_lengths = text.apply(lambda column: _longest_line_length(column, line_counts[column.name].gt(1).any()))
+
+    column_widths = {}
+    for col_idx, header in enumerate(headers):
+        max_length = int(max_lengths[col_idx])
+        width = max_length + 5 # Add some padding
+        if width < MIN_COLUMN_WIDTH and (max_length > 0 or header == "Version #"):
+            width = MIN_COLUMN_WIDTH # Min width for version numbers etc.
+        column_widths[get_column_letter(col_idx + 1)] = min(width, MAX_COLUMN_WIDTH)
+
+    # Estimate row height from wrapped lines; openpyxl has no auto-fit for wrapped text
+    row_lines = line_counts.max(axis=1)
+    row_heights = (row_lines[row_lines > 1] * LINE_HEIGHT).astype(int).to_dict()
+    return {"column_widths": column_widths, "row_heights": row_heights}
+
+
+def _apply_layout(ws, layout):
+    for column_letter, width in layout["column_widths"].items():
+        ws.column_dimensions[column_letter].width = width
+    for row_number, height in layout["row_heights"].items():
+        ws.row_dimensions[row_number].height = height
+
+
+def _content_styles(headers):
+    return [CENTERED_CONTENT_STYLE if header == "Version #" else CONTENT_STYLE for header in headers]
+
+
+def _write_sheet(wb, title, headers, rows, keys=None, flags=None):
+    """
+    Streams one sheet: layout first, then the header and content rows with the shared styles.
+    flags maps (row index, column key) to a note; those cells are highlighted and annotated.
+    """
+    ws = wb.create_sheet(title)
+    _apply_layout(ws, plan_sheet_layout(headers, rows))
+
+    content_styles = _content_styles(headers)
+    flags = flags or {}
+
+    def styled_row(values, styles, notes=None):
+        cells = []
+        for index, (value, style) in enumerate(zip(values, styles)):
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            if notes and notes[index]:
+                cell.style = OVER_LIMIT_STYLE
+                cell.comment = Comment(notes[index], "Limit check")
+            cells.append(cell)
+        return cells
+
+    ws.append(styled_row(headers, [HEADER_STYLE] * len(headers)))
+    for row_index, row in enumerate(rows):
+        notes = [flags.get((row_index, key)) for key in keys] if flags and keys else None
+        ws.append(styled_row(row, content_styles, notes))
+
+
+def write_xlsx(ad_data, links, output, limit_flags=None):
+    """
+    Writes one sheet per channel present in ad_data to the binary stream or path `output`.
+    limit_flags ({channel: {(row, field): note}}, see ad_validator.limit_flags) marks cells to highlight.
+    """
+    wb = Workbook(write_only=True)
+    _register_named_styles(wb)
+    for channel, schema, headers, rows in iter_sheets(ad_data, links):
+        keys = [key for _, key in schema["columns"]]
+        _write_sheet(wb, schema["sheet_name"], headers, list(rows), keys, (limit_flags or {}).get(channel))
+    wb.save(output)
+
+
+def create_excel_file(ad_data, company_name, links, limit_flags=None):
     """
     Creates an Excel file in memory with multiple sheets for ad content.
-    ad_data is a dictionary where keys are sheet names (e.g., 'email')
+    ad_data is a dictionary where keys are channels (e.g., 'email', see SHEET_SCHEMAS)
     and values are lists of dictionaries (rows).
-    links is a dictionary of user-provided links.
+    links is a dictionary of user-provided links; limit_flags marks over-limit cells.
     """
-    wb = Workbook()
-    wb.remove(wb.active) # Remove default sheet
-
-    # Email Page
-    if 'email' in ad_data and ad_data['email']:
-        ws_email = wb.create_sheet("Email")
-        email_df = pd.DataFrame(ad_data['email'])
-        # Ensure correct column order
-        email_cols = ["Version #", "Objective", "Headline", "Subject Line", "Body", "CTA"]
-        email_df = email_df.rename(columns={"version": "Version #", "objective_type": "Objective", 
-                                            "headline": "Headline", "subject_line": "Subject Line", 
-                                            "body": "Body", "cta": "CTA"})
-        email_df["Objective"] = "Demand Capture" # As per spec
-        
-        # Replace placeholder with actual link
-        active_lead_link = links.get('active_lead_objective_link', '')
-        email_df["Body"] = email_df["Body"].str.replace("[LEAD_OBJECTIVE_LINK]", active_lead_link, regex=False)
-
-        email_df = email_df[email_cols] # Reorder/select columns
-
-        for r_idx, row in enumerate(dataframe_to_rows(email_df, index=False, header=True)):
-            ws_email.append(row)
-        
-        for cell in ws_email[1]: apply_header_style(cell) # Header row
-        for row_idx, row in enumerate(ws_email.iter_rows(min_row=2)): # Content rows
-            for cell_idx, cell in enumerate(row):
-                is_version_col = ws_email.cell(row=1, column=cell_idx+1).value == "Version #"
-                apply_content_style(cell, is_version_col)
-        adjust_column_width_and_row_height(ws_email)
-
-
-    # LinkedIn Page
-    if 'linkedin' in ad_data and ad_data['linkedin']:
-        ws_linkedin = wb.create_sheet("LinkedIn")
-        linkedin_df = pd.DataFrame(ad_data['linkedin'])
-        linkedin_cols = ["Version #", "Ad Name", "Objective", "Introductory Text", "Image Copy", "Headline", "Destination", "CTA Button"]
-        linkedin_df = linkedin_df.rename(columns={
-            "version": "Version #", "ad_name": "Ad Name", "objective_type": "Objective",
-            "introductory_text": "Introductory Text", "image_copy": "Image Copy",
-            "headline": "Headline", "destination_link": "Destination", "cta_button": "CTA Button"
-        })
-        linkedin_df = linkedin_df[linkedin_cols]
-
-        for r_idx, row in enumerate(dataframe_to_rows(linkedin_df, index=False, header=True)):
-            ws_linkedin.append(row)
-
-        for cell in ws_linkedin[1]: apply_header_style(cell)
-        for row_idx, row in enumerate(ws_linkedin.iter_rows(min_row=2)):
-            for cell_idx, cell in enumerate(row):
-                is_version_col = ws_linkedin.cell(row=1, column=cell_idx+1).value == "Version #"
-                apply_content_style(cell, is_version_col)
-        adjust_column_width_and_row_height(ws_linkedin)
-
-    # Facebook Page
-    if 'facebook' in ad_data and ad_data['facebook']:
-        ws_facebook = wb.create_sheet("Facebook")
-        facebook_df = pd.DataFrame(ad_data['facebook'])
-        facebook_cols = ["Version #", "Ad Name", "Objective", "Primary Text", "Image Copy", "Headline", "Link Description", "Destination", "CTA Button"]
-        facebook_df = facebook_df.rename(columns={
-            "version": "Version #", "ad_name": "Ad Name", "objective_type": "Objective",
-            "primary_text": "Primary Text", "image_copy": "Image Copy",
-            "headline": "Headline", "link_description": "Link Description",
-            "destination_link": "Destination", "cta_button": "CTA Button"
-        })
-         # Ensure Link Description column exists even if AI doesn't always provide it
-        if "Link Description" not in facebook_df.columns:
-            facebook_df["Link Description"] = ""
-            
-        facebook_df = facebook_df[facebook_cols]
-
-        for r_idx, row in enumerate(dataframe_to_rows(facebook_df, index=False, header=True)):
-            ws_facebook.append(row)
-
-        for cell in ws_facebook[1]: apply_header_style(cell)
-        for row_idx, row in enumerate(ws_facebook.iter_rows(min_row=2)):
-            for cell_idx, cell in enumerate(row):
-                is_version_col = ws_facebook.cell(row=1, column=cell_idx+1).value == "Version #"
-                apply_content_style(cell, is_version_col)
-        adjust_column_width_and_row_height(ws_facebook)
-
-    # Google Search Page
-    if 'google_search' in ad_data and ad_data['google_search']:
-        ws_gsearch = wb.create_sheet("Google Search")
-        # Data is expected as {"headlines": [...], "descriptions": [...]}
-        gsearch_data = ad_data['google_search']
-        max_len = max(len(gsearch_data.get("headlines", [])), len(gsearch_data.get("descriptions", [])))
-        
-        # Pad shorter list to make DataFrame creation easier
-        headlines = gsearch_data.get("headlines", []) + [""] * (max_len - len(gsearch_data.get("headlines", [])))
-        descriptions = gsearch_data.get("descriptions", []) + [""] * (max_len - len(gsearch_data.get("descriptions", [])))
-
-        gsearch_df = pd.DataFrame({"Headline": headlines, "Description": descriptions})
-        
-        for r_idx, row in enumerate(dataframe_to_rows(gsearch_df, index=False, header=True)):
-            ws_gsearch.append(row)
-
-        for cell in ws_gsearch[1]: apply_header_style(cell)
-        for row in ws_gsearch.iter_rows(min_row=2):
-            for cell in row: apply_content_style(cell)
-        adjust_column_width_and_row_height(ws_gsearch)
-
-    # Google Display Page
-    if 'google_display' in ad_data and ad_data['google_display']:
-        ws_gdisplay = wb.create_sheet("Google Display")
-        gdisplay_data = ad_data['google_display']
-        max_len_display = max(len(gdisplay_data.get("headlines", [])), len(gdisplay_data.get("descriptions", [])))
-
-        headlines_display = gdisplay_data.get("headlines", []) + [""] * (max_len_display - len(gdisplay_data.get("headlines", [])))
-        descriptions_display = gdisplay_data.get("descriptions", []) + [""] * (max_len_display - len(gdisplay_data.get("descriptions", [])))
-
-        gdisplay_df = pd.DataFrame({"Headline": headlines_display, "Description": descriptions_display})
-
-        for r_idx, row in enumerate(dataframe_to_rows(gdisplay_df, index=False, header=True)):
-            ws_gdisplay.append(row)
-
-        for cell in ws_gdisplay[1]: apply_header_style(cell)
-        for row in ws_gdisplay.iter_rows(min_row=2):
-            for cell in row: apply_content_style(cell)
-        adjust_column_width_and_row_height(ws_gdisplay)
-
     excel_stream = io.BytesIO()
-    wb.save(excel_stream)
+    write_xlsx(ad_data, links, excel_stream, limit_flags)
     excel_stream.seek(0)
-    return excel_stream
\ No newline at end of file
+    return excel_stream
+
+
+def patch_excel_file(excel_bytes, old_ad_data, ad_data, links, limit_flags=None):
+    """
+    Updates a workbook written by create_excel_file from old_ad_data to ad_data by rewriting
+    only the rows that changed (and the changed sheets' layout); other sheets and rows are left
+    as they are. Rewritten cells are highlighted per limit_flags. Falls back to writing a new
+    workbook when a sheet has to be added or removed. Returns the workbook bytes.
+    """
+    from openpyxl import load_workbook
+
+    old_sheets = {channel: list(rows) for channel, _, _, rows in iter_sheets(old_ad_data, links)}
+    new_sheets = {channel: (headers, list(rows)) for channel, _, headers, rows in iter_sheets(ad_data, links)}
+    if old_sheets.keys() != new_sheets.keys():
+        return create_excel_file(ad_data, None, links, limit_flags).getvalue()
+    changed = [channel for channel, (_, rows) in new_sheets.items() if rows != old_sheets[channel]]
+    if not changed:
+        return excel_bytes
+
+    wb = load_workbook(io.BytesIO(excel_bytes))
+    if OVER_LIMIT_STYLE not in wb.named_styles:
+        wb.add_named_style(_over_limit_style())
+    for channel in changed:
+        headers, rows = new_sheets[channel]
+        old_rows = old_sheets[channel]
+        keys = [key for _, key in SHEET_SCHEMAS[channel]["columns"]]
+        flags = (limit_flags or {}).get(channel, {})
+        ws = wb[SHEET_SCHEMAS[channel]["sheet_name"]]
+        content_styles = _content_styles(headers)
+        for index, row in enumerate(rows):
+            if index < len(old_rows) and old_rows[index] == row:
+                continue
+            for column, (value, style, key) in enumerate(zip(row, content_styles, keys), 1):
+                cell = ws.cell(row=index + 2, column=column, value=value) # Row 1 is the header
+                note = flags.get((index, key))
+                cell.style = OVER_LIMIT_STYLE if note else style
+                cell.comment = Comment(note, "Limit check") if note else None
+        if len(old_rows) > len(rows):
+            ws.delete_rows(len(rows) + 2, len(old_rows) - len(rows))
+        for row_number in range(1, max(len(rows), len(old_rows)) + 2):
+            ws.row_dimensions[row_number].height = None
+        _apply_layout(ws, plan_sheet_layout(headers, rows))
+
+    output = io.BytesIO()
+    wb.save(output)
+    return output.getvalue()
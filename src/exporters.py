@@ -0,0 +1,90 @@
+import csv
+import json
+import os
+
+from src.sheet_schemas import iter_sheets
+
+PARQUET_BATCH_ROWS = 1000
+
+
+def export_xlsx(ad_data, links, output_dir, base_name):
+    """One workbook with a sheet per channel."""
+    from src.excel_generator import write_xlsx # pandas/openpyxl are only loaded for XLSX output
+
+    path = os.path.join(output_dir, f"{base_name}.xlsx")
+    write_xlsx(ad_data, links, path)
+    return [path]
+
+
+def export_csv(ad_data, links, output_dir, base_name):
+    """One CSV file per channel, written row by row."""
+    paths = []
+    for channel, schema, headers, rows in iter_sheets(ad_data, links):
+        path = os.path.join(output_dir, f"{base_name}_{channel}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            writer.writerows(rows)
+        paths.append(path)
+    return paths
+
+
+def export_jsonl(ad_data, links, output_dir, base_name):
+    """One JSON object per ad, keyed by column header and tagged with its channel."""
+    path = os.path.join(output_dir, f"{base_name}.jsonl")
+    with open(path, "w", encoding="utf-8") as f:
+        for channel, schema, headers, rows in iter_sheets(ad_data, links):
+            for row in rows:
+                record = {"channel": channel}
+                record.update(zip(headers, row))
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return [path]
+
+
+def export_parquet(ad_data, links, output_dir, base_name):
+    """One Parquet file per channel with string columns, written in row batches. Requires pyarrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow).")
+
+    paths = []
+    for channel, schema, headers, rows in iter_sheets(ad_data, links):
+        path = os.path.join(output_dir, f"{base_name}_{channel}.parquet")
+        arrow_schema = pa.schema([(header, pa.string()) for header in headers])
+
+        def to_batch(batch_rows):
+            columns = [
+                [None if row[i] is None else str(row[i]) for row in batch_rows] for i in range(len(headers))
+            ]
+            return pa.record_batch(columns, schema=arrow_schema)
+
+        with pq.ParquetWriter(path, arrow_schema) as writer:
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) >= PARQUET_BATCH_ROWS:
+                    writer.write_batch(to_batch(batch))
+                    batch = []
+            if batch:
+                writer.write_batch(to_batch(batch))
+        paths.append(path)
+    return paths
+
+
+# Output format name -> exporter(ad_data, links, output_dir, base_name) returning the written paths.
+EXPORTERS = {
+    "xlsx": export_xlsx,
+    "csv": export_csv,
+    "jsonl": export_jsonl,
+    "parquet": export_parquet,
+}
+
+
+def export_ad_data(ad_data, links, fmt, output_dir, base_name):
+    """Exports ad_data in the given format into output_dir and returns the written file paths."""
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORTERS)}.")
+    os.makedirs(output_dir, exist_ok=True)
+    return EXPORTERS[fmt](ad_data, links, output_dir, base_name)
@@ -0,0 +1,135 @@
+import base64
+import json
+import threading
+
+from src.cache import get_cache
+from src.instrumentation import stage, count, STAGE_FETCH
+
+DEFAULT_TIMEOUT = 10
+# Pages larger than this are cut off; we only need the text for a summary.
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# ETag/Last-Modified plus the last body, keyed by URL.
+VALIDATOR_NAMESPACE = "http_validators"
+VALIDATOR_TTL = 30 * 24 * 3600
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _accept_encoding():
+    try:
+        import brotli # noqa: F401  urllib3 only decodes br when brotli is installed
+        return "gzip, deflate, br"
+    except ImportError:
+        return "gzip, deflate"
+
+
+def get_http_session():
+    """Returns the process-wide pooled session shared by all fetches; requests is loaded on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                "Accept-Encoding": _accept_encoding(),
+                "User-Agent": "Mozilla/5.0 (compatible; AdContentGenerator/1.0)",
+            })
+            _session = session
+        return _session
+
+
+def _load_validators(url):
+    """The stored validators and body for url, or None; not counted in the cache's hit/miss stats."""
+    stored = get_cache().get(VALIDATOR_NAMESPACE, url, track=False)
+    stored = json.loads(stored) if stored else None
+    # Without a body there is nothing to serve a 304 from, so the request must not be conditional
+    return stored if stored and stored.get("content") else None
+
+
+def _save_validators(url, page):
+    stored = {
+        "etag": page["etag"],
+        "last_modified": page["last_modified"],
+        "content_type": page["content_type"],
+        "content": base64.b64encode(page["content"]).decode("ascii"),
+    }
+    get_cache().set(VALIDATOR_NAMESPACE, url, json.dumps(stored), VALIDATOR_TTL)
+
+
+def fetch_url(url, timeout=DEFAULT_TIMEOUT, max_bytes=DEFAULT_MAX_BYTES, conditional=True):
+    """
+    Fetches url on the shared session and returns a dict with the body 'content' (bytes),
+    'status_code', 'etag', 'last_modified', 'content_type', 'not_modified' and 'truncated'.
+    When conditional is set, stored ETag/Last-Modified validators are sent and a 304
+    answer is served from the stored body (validators without a stored body are not sent). The body is streamed and decompressed,
+    and reading stops after max_bytes. Raises requests exceptions on failure.
+    """
+    with stage(STAGE_FETCH, url):
+        page = _fetch_url(url, timeout, max_bytes, conditional)
+    if page["not_modified"]:
+        count("http_not_modified")
+    return page
+
+
+def _fetch_url(url, timeout, max_bytes, conditional):
+    import requests
+
+    stored = _load_validators(url) if conditional else None
+    headers = {}
+    if stored:
+        if stored.get("etag"):
+            headers["If-None-Match"] = stored["etag"]
+        if stored.get("last_modified"):
+            headers["If-Modified-Since"] = stored["last_modified"]
+
+    with get_http_session().get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and not stored:
+            # Validators are only sent with a stored body, so there is no body to serve
+            raise requests.exceptions.HTTPError("304 Not Modified for an unconditional request", response=response)
+        if response.status_code == 304:
+            return {
+                "url": url,
+                "status_code": 304,
+                "content": base64.b64decode(stored["content"]),
+                "etag": stored.get("etag"),
+                "last_modified": stored.get("last_modified"),
+                "content_type": stored.get("content_type", ""),
+                "not_modified": True,
+                "truncated": False,
+            }
+        response.raise_for_status()
+
+        chunks = []
+        bytes_read = 0
+        truncated = False
+        # iter_content undoes gzip/deflate, so the ceiling applies to the decoded size
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            if bytes_read + len(chunk) > max_bytes:
+                chunks.append(chunk[:max_bytes - bytes_read])
+                truncated = True
+                break
+            chunks.append(chunk)
+            bytes_read += len(chunk)
+
+        page = {
+            "url": url,
+            "status_code": response.status_code,
+            "content": b"".join(chunks),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get("Content-Type", ""),
+            "not_modified": False,
+            "truncated": truncated,
+        }
+
+    if conditional and not truncated and (page["etag"] or page["last_modified"]):
+        _save_validators(url, page)
+    return page
@@ -0,0 +1,250 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Write cProfile stats for the extraction and Excel stages here; override per run with RunTrace(profile_dir=...).
+DEFAULT_PROFILE_DIR = os.environ.get("AD_GEN_PROFILE_DIR") or None
+
+# Stage names used across the pipeline.
+STAGE_FETCH = "fetch"
+STAGE_PARSE = "parse"
+STAGE_SUMMARIZE = "summarize"
+STAGE_GENERATE = "generate"
+STAGE_VALIDATE = "validate"
+STAGE_EXCEL = "excel"
+
+TOKEN_KINDS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+# The trace and innermost span of the current run; worker threads inherit them through
+# utils.worker_thread_initializer and asyncio.to_thread.
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+# cProfile can only profile one thread at a time (and only one profiler may be active on 3.12+)
+_profile_lock = threading.Lock()
+
+
+class RunTrace:
+    """
+    Records one pipeline run: a span per timed stage (with wall time, tokens and counters),
+    run-wide counters such as retries and cache hits, and token usage per stage.
+    Safe to update from worker threads.
+    """
+
+    def __init__(self, name="run", profile_dir=DEFAULT_PROFILE_DIR):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.started_at = time.time()
+        self.finished_at = None
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def span(self, stage, name=None, **attributes):
+        span = {
+            "stage": stage, "name": name, "attributes": attributes,
+            "start_seconds": time.perf_counter() - self._started, "seconds": None,
+            "tokens": {}, "counters": {}, "error": None,
+        }
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["seconds"] = time.perf_counter() - start
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def count(self, counter, amount=1, **labels):
+        key = (counter, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+            span = _current_span.get()
+            if span is not None:
+                span["counters"][counter] = span["counters"].get(counter, 0) + amount
+
+    def record_usage(self, stage, usage):
+        """Adds a call's usage_counts to the run totals for the stage and to the current span."""
+        with self._lock:
+            span = _current_span.get()
+            for kind in TOKEN_KINDS:
+                key = (kind, (("stage", stage),))
+                self.counters[key] = self.counters.get(key, 0) + usage.get(kind, 0)
+                if span is not None:
+                    span["tokens"][kind] = span["tokens"].get(kind, 0) + usage.get(kind, 0)
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def stage_summary(self):
+        """{stage: {"calls", "seconds", "max_seconds"}} over all finished spans."""
+        summary = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            stage = summary.setdefault(span["stage"], {"calls": 0, "seconds": 0.0, "max_seconds": 0.0})
+            stage["calls"] += 1
+            stage["seconds"] += span["seconds"]
+            stage["max_seconds"] = max(stage["max_seconds"], span["seconds"])
+        return summary
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_seconds"])
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(self.counters.items())
+            ]
+        return {
+            "name": self.name,
+            "started_at": self.started_at,
+            "wall_seconds": (self.finished_at or time.time()) - self.started_at,
+            "stages": self.stage_summary(),
+            "counters": counters,
+            "spans": spans,
+        }
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def set_current_trace(trace):
+    """Makes trace the active one for this thread (and threads it starts); returns a reset token."""
+    return _current_trace.set(trace)
+
+
+def reset_current_trace(token):
+    _current_trace.reset(token)
+
+
+@contextmanager
+def stage(stage_name, name=None, **attributes):
+    """Times a block as a span of the active trace; a no-op when no run is being traced."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(stage_name, name, **attributes) as span:
+        yield span
+
+
+def count(counter, amount=1, **labels):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.count(counter, amount, **labels)
+
+
+def record_usage(stage_name, usage):
+    trace = _current_trace.get()
+    if trace is not None and usage:
+        trace.record_usage(stage_name, usage)
+
+
+def profiling_enabled():
+    trace = _current_trace.get()
+    return trace is not None and bool(trace.profile_dir)
+
+
+@contextmanager
+def profiled(stage_name, name=None):
+    """
+    Runs the block under cProfile when the active trace has a profile_dir, and writes
+    <profile_dir>/<run>-<stage>[-<name>].prof. Profiled blocks run one at a time.
+    """
+    if not profiling_enabled():
+        yield
+        return
+    import cProfile
+
+    trace = _current_trace.get()
+    file_name = "-".join(part for part in (trace.name, stage_name, name) if part)
+    path = os.path.join(trace.profile_dir, re.sub(r"[^A-Za-z0-9._-]+", "_", file_name) + ".prof")
+    with _profile_lock:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            os.makedirs(trace.profile_dir, exist_ok=True)
+            profile.dump_stats(path)
+            logger.info("Wrote profile %s", path)
+
+
+def _prometheus_labels(labels):
+    if not labels:
+        return ""
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items())) + "}"
+
+
+def prometheus_text(traces, scheduler_metrics=None):
+    """
+    Renders run traces (as returned by RunTrace.to_dict) in the Prometheus text exposition
+    format, summed over the runs, plus the rate-limit scheduler's gauges if given.
+    """
+    stage_calls, stage_seconds, stage_max, counters = {}, {}, {}, {}
+    wall_seconds = 0.0
+    for trace in traces:
+        wall_seconds += trace["wall_seconds"]
+        for stage_name, summary in trace["stages"].items():
+            stage_calls[stage_name] = stage_calls.get(stage_name, 0) + summary["calls"]
+            stage_seconds[stage_name] = stage_seconds.get(stage_name, 0.0) + summary["seconds"]
+            stage_max[stage_name] = max(stage_max.get(stage_name, 0.0), summary["max_seconds"])
+        for counter in trace["counters"]:
+            key = (counter["name"], tuple(sorted(counter["labels"].items())))
+            counters[key] = counters.get(key, 0) + counter["value"]
+
+    lines = [
+        "# HELP ad_gen_runs_total Pipeline runs recorded.",
+        "# TYPE ad_gen_runs_total counter",
+        f"ad_gen_runs_total {len(traces)}",
+        "# HELP ad_gen_run_seconds_total Wall time of the recorded runs.",
+        "# TYPE ad_gen_run_seconds_total counter",
+        f"ad_gen_run_seconds_total {wall_seconds:.6f}",
+        "# HELP ad_gen_stage_calls_total Timed calls per pipeline stage.",
+        "# TYPE ad_gen_stage_calls_total counter",
+    ]
+    lines += [f'ad_gen_stage_calls_total{_prometheus_labels({"stage": s})} {n}' for s, n in sorted(stage_calls.items())]
+    lines += [
+        "# HELP ad_gen_stage_seconds_total Wall time spent per pipeline stage (concurrent calls overlap).",
+        "# TYPE ad_gen_stage_seconds_total counter",
+    ]
+    lines += [f'ad_gen_stage_seconds_total{_prometheus_labels({"stage": s})} {v:.6f}' for s, v in sorted(stage_seconds.items())]
+    lines += [
+        "# HELP ad_gen_stage_max_seconds Slowest single call per pipeline stage.",
+        "# TYPE ad_gen_stage_max_seconds gauge",
+    ]
+    lines += [f'ad_gen_stage_max_seconds{_prometheus_labels({"stage": s})} {v:.6f}' for s, v in sorted(stage_max.items())]
+
+    counter_names = sorted({name for name, _ in counters})
+    for name in counter_names:
+        lines.append(f"# TYPE ad_gen_{name}_total counter")
+        for (counter_name, labels), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"ad_gen_{name}_total{_prometheus_labels(dict(labels))} {value}")
+
+    if scheduler_metrics:
+        for key, value in sorted(scheduler_metrics.items()):
+            lines.append(f"# TYPE ad_gen_openai_scheduler_{key} gauge")
+            lines.append(f"ad_gen_openai_scheduler_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def trace_json(trace_dict):
+    return json.dumps(trace_dict, indent=2, default=str)
@@ -0,0 +1,175 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from src.pipeline import (
+    run_pipeline, regenerate_generation, check_regeneration_versions, pipeline_total_steps, spool_uploads
+)
+
+logger = logging.getLogger(__name__)
+
+# Jobs running at once across all sessions of this process; further jobs queue.
+MAX_CONCURRENT_JOBS = int(os.environ.get("AD_GEN_MAX_CONCURRENT_JOBS", 4))
+# Finished jobs (and their workbooks) are dropped after this long.
+JOB_RETENTION_SECONDS = 2 * 3600
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_DONE, JOB_FAILED)
+
+
+class JobRunner:
+    """
+    Runs pipeline jobs on a process-wide thread pool, outside any Streamlit script run,
+    so a rerun (or a closed tab) does not throw away in-flight work. Job state, progress,
+    streamed ads, warnings and the final result are kept here and read back by job id.
+    """
+
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, retention_seconds=JOB_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="ad-gen-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._inputs = {} # job id -> (client, job), kept for regeneration
+
+    def submit(self, client, job, label=""):
+        """Queues a prepared job (see pipeline.prepare_job) and returns its id."""
+        self._prune()
+        job_id = uuid.uuid4().hex
+        # Uploads belong to the script run that received them; spool them to disk for the job
+        spool_dir = tempfile.mkdtemp(prefix=f"ad-gen-job-{job_id[:8]}-")
+        job = dict(
+            job,
+            additional_context_files=spool_uploads(job["additional_context_files"], spool_dir),
+            downloadable_material_files=spool_uploads(job["downloadable_material_files"], spool_dir),
+        )
+        with self._lock:
+            self._jobs[job_id] = {
+                "id": job_id,
+                "label": label or job["company_name"],
+                "status": JOB_QUEUED,
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "steps_done": 0,
+                "total_steps": pipeline_total_steps(job),
+                "message": "Waiting for a free worker...",
+                "warnings": [],
+                "streamed_items": [],
+                "result": None,
+                "error": None,
+            }
+            self._inputs[job_id] = (client, job)
+        self._executor.submit(self._run, job_id, client, job, spool_dir)
+        return job_id
+
+    def regenerate(self, job_id, task_id, versions=None):
+        """
+        Queues a regeneration of one generation task of a finished job (see
+        pipeline.regenerate_generation); the job's result and workbook are patched in place.
+        Returns an error message if the job is unknown or still running or the versions are
+        not the task's (see pipeline.check_regeneration_versions), else None.
+        """
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None or state["status"] not in FINISHED_STATUSES or state["result"] is None:
+                return "This job has expired or is still running."
+            versions_error = check_regeneration_versions(self._inputs[job_id][1], state["result"], task_id, versions)
+            if versions_error:
+                return versions_error
+            label = state["result"]["generation_labels"].get(task_id, task_id)
+            state.update(
+                status=JOB_QUEUED, finished_at=None, steps_done=0, total_steps=1, warnings=[], streamed_items=[],
+                message=f"Waiting to regenerate {label}...",
+            )
+        self._executor.submit(self._regenerate, job_id, task_id, label, versions)
+        return None
+
+    def _update(self, job_id, **changes):
+        with self._lock:
+            self._jobs[job_id].update(changes)
+
+    def _run(self, job_id, client, job, spool_dir):
+        state = self._jobs[job_id]
+
+        def on_progress(step_increment=1, message=""):
+            with self._lock:
+                state["steps_done"] += step_increment
+                if message:
+                    state["message"] = message
+
+        def on_warning(message):
+            with self._lock:
+                state["warnings"].append(message)
+
+        def on_ad_item(task, item):
+            with self._lock:
+                state["streamed_items"].append((task["label"], item))
+
+        self._update(job_id, status=JOB_RUNNING, message="Starting...")
+        try:
+            result = run_pipeline(client, job, on_progress=on_progress, on_warning=on_warning, on_ad_item=on_ad_item)
+        except Exception as e:
+            logger.exception("Job %s failed", job_id)
+            self._update(job_id, status=JOB_FAILED, error=f"Unexpected error: {e}", finished_at=time.time())
+            return
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True) # Regeneration only needs the run's context
+        status = JOB_DONE if result["excel_bytes"] else JOB_FAILED
+        self._update(job_id, status=status, result=result, error=result["error"], finished_at=time.time())
+
+    def _regenerate(self, job_id, task_id, label, versions):
+        client, job = self._inputs[job_id]
+        state = self._jobs[job_id]
+
+        def on_ad_item(task, item):
+            with self._lock:
+                state["streamed_items"].append((task["label"], item))
+
+        self._update(job_id, status=JOB_RUNNING, message=f"Regenerating {label}...")
+        try:
+            # Only this thread touches the result until the job is marked finished again
+            error = regenerate_generation(client, job, state["result"], task_id, versions, on_ad_item=on_ad_item)
+        except Exception as e:
+            logger.exception("Regenerating %s for job %s failed", task_id, job_id)
+            error = f"Unexpected error: {e}"
+        with self._lock:
+            state.update(steps_done=1, finished_at=time.time(), status=JOB_DONE if state["result"]["excel_bytes"] else JOB_FAILED)
+            if error:
+                state["warnings"].append(error)
+
+    def get(self, job_id):
+        """A snapshot of the job's state, or None if it is unknown or has expired."""
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return None
+            return dict(state, warnings=list(state["warnings"]), streamed_items=list(state["streamed_items"]))
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [job_id for job_id, state in self._jobs.items()
+                       if state["finished_at"] is not None and state["finished_at"] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+                self._inputs.pop(job_id, None)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner():
+    """Returns the process-wide job runner shared by all sessions, creating it on first use."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
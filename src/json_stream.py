@@ -0,0 +1,64 @@
+import json
+
+
+class JsonArrayItemStream:
+    """
+    Incrementally scans a JSON object such as {"emails": [{...}, {...}]} as it is streamed and
+    reports each element of its top-level arrays as soon as the element is complete.
+    Objects and strings are reported; other element types are left to the final json.loads.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._pos = 0
+        self._stack = [] # Open containers, '{' or '['
+        self._in_string = False
+        self._escaped = False
+        self._string_start = None
+        self._item_start = None
+        self._last_key = None
+        self._array_key = None
+
+    def _at_array_level(self):
+        return self._stack == ["{", "["]
+
+    def feed(self, chunk):
+        """Appends a streamed chunk and returns the newly completed (array key, element) pairs."""
+        self.text += chunk
+        items = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            char = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._stack == ["{"]:
+                        self._last_key = json.loads(text[self._string_start:i + 1])
+                    elif self._at_array_level() and self._item_start is None:
+                        items.append((self._array_key, json.loads(text[self._string_start:i + 1])))
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = i
+            elif char in "{[":
+                if self._at_array_level() and char == "{":
+                    self._item_start = i
+                elif self._stack == ["{"] and char == "[":
+                    self._array_key = self._last_key
+                self._stack.append(char)
+            elif char in "}]":
+                if self._stack:
+                    self._stack.pop()
+                if self._at_array_level() and char == "}" and self._item_start is not None:
+                    try:
+                        items.append((self._array_key, json.loads(text[self._item_start:i + 1])))
+                    except json.JSONDecodeError: # Malformed element; the final parse will report it
+                        pass
+                    self._item_start = None
+        self._pos = len(text)
+        return items
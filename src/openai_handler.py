@@ -1,96 +1,303 @@
 import streamlit as st
-from openai import OpenAI
 import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from src.instrumentation import record_usage, STAGE_SUMMARIZE, STAGE_GENERATE
+from src.json_stream import JsonArrayItemStream
+from src.rate_limiter import get_scheduler
+from src.token_utils import count_tokens, split_text_into_token_chunks
+from src.utils import worker_thread_initializer, report_error
+
+logger = logging.getLogger(__name__)
 
 # Use the model name you have access to. "gpt-4o-mini" is a recent model.
 # If "gpt-4.1-mini" is a specific early access model, use that exact string.
 AI_MODEL = "gpt-4o-mini" 
 
-def get_openai_client():
-    """Initializes and returns the OpenAI client."""
-    api_key = st.secrets.get("OPENAI_API_KEY")
+# Bump whenever the summarization prompt changes so cached summaries are not reused.
+SUMMARY_PROMPT_VERSION = "2"
+
+# Summarization modes: "truncate" summarizes only the first SUMMARY_INPUT_CHAR_LIMIT characters,
+# "map_reduce" summarizes the whole text in token-sized chunks and then combines them.
+SUMMARY_MODE_TRUNCATE = "truncate"
+SUMMARY_MODE_MAP_REDUCE = "map_reduce"
+DEFAULT_SUMMARY_MODE = SUMMARY_MODE_MAP_REDUCE
+
+# Characters of source text sent to the summarizer in truncate mode; extractors can stop reading past this.
+SUMMARY_INPUT_CHAR_LIMIT = 50000
+# Safety ceiling for map-reduce mode (roughly a 600-page book).
+MAP_REDUCE_INPUT_CHAR_LIMIT = 2_000_000
+DEFAULT_SUMMARY_CHUNK_TOKENS = 12000
+DEFAULT_SUMMARY_CONCURRENCY = 4
+DEFAULT_SUMMARY_MAX_DEPTH = 2
+
+# Expected completion size per call, added to the prompt tokens when reserving rate-limit budget.
+SUMMARY_COMPLETION_TOKEN_ESTIMATE = 1000
+GENERATION_COMPLETION_TOKEN_ESTIMATE = 3000
+
+# Providers only cache prompt prefixes from this length on (OpenAI: 1024 tokens).
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+def get_openai_client(api_key=None):
+    """
+    Initializes and returns the OpenAI client.
+    The key comes from the argument, Streamlit secrets, or the OPENAI_API_KEY environment variable.
+    """
+    if not api_key:
+        try:
+            api_key = st.secrets.get("OPENAI_API_KEY")
+        except Exception: # No secrets.toml, e.g. when running headless
+            api_key = None
+    api_key = api_key or os.environ.get("OPENAI_API_KEY")
     if not api_key:
-        st.error("OpenAI API key not found. Please set it in secrets.toml or Streamlit Cloud secrets.")
+        report_error("OpenAI API key not found. Please set it in secrets.toml, Streamlit Cloud secrets or the OPENAI_API_KEY environment variable.")
         return None
-    return OpenAI(api_key=api_key)
+    from openai import OpenAI # Loaded on first use; the SDK is slow to import
 
-def summarize_text_with_ai(client, text_content, section_name="content"):
-    """Summarizes text using OpenAI API."""
-    if not client or not text_content or len(text_content.strip()) < 50: # Basic check for meaningful content
-        return ""
-    
-    prompt = f"""
-    Please provide a comprehensive summary of the following {section_name}. 
-    Focus on key information relevant for creating marketing ad copy, such as:
+    # Retries are handled by the shared scheduler (see _chat_completion), not by the SDK
+    return OpenAI(api_key=api_key, max_retries=0)
+
+def _chat_completion(client, messages, completion_token_estimate, **kwargs):
+    """
+    Creates a chat completion through the shared rate-limit scheduler, which queues the call
+    against the RPM/TPM quota and retries 429s, 5xx and timeouts with backoff.
+    For streamed calls only opening the stream is retried.
+    """
+    estimated_tokens = sum(count_tokens(message["content"]) for message in messages) + completion_token_estimate
+    return get_scheduler().call(
+        lambda timeout: client.chat.completions.create(model=AI_MODEL, messages=messages, timeout=timeout, **kwargs),
+        estimated_tokens=estimated_tokens,
+    )
+
+SUMMARY_FOCUS = """Focus on key information relevant for creating marketing ad copy, such as:
     - Core products/services offered
     - Unique selling propositions (USPs)
     - Target audience
     - Brand voice and tone (if discernible)
-    - Key problems solved or benefits offered
+    - Key problems solved or benefits offered"""
+
+SUMMARY_SYSTEM_MESSAGE = "You are a helpful assistant skilled in summarizing text for marketing purposes."
+
+def usage_counts(usage):
+    """Prompt, completion and provider-cached prompt tokens from a response's usage, as a plain dict."""
+    if usage is None:
+        return None
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+    }
+
+def _summary_completion(client, prompt):
+    response = _chat_completion(
+        client,
+        [
+            {"role": "system", "content": SUMMARY_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt}
+        ],
+        SUMMARY_COMPLETION_TOKEN_ESTIMATE,
+        temperature=0.3,
+    )
+    record_usage(STAGE_SUMMARIZE, usage_counts(response.usage))
+    return response.choices[0].message.content.strip()
+
+def _summarize_single(client, text_content, section_name):
+    prompt = f"""
+    Please provide a comprehensive summary of the following {section_name}. 
+    {SUMMARY_FOCUS}
 
     The summary should be detailed enough to inform the generation of diverse ad creatives.
     Avoid generic statements and extract specific, actionable insights.
 
     Full text to summarize:
     ---
-    {text_content[:50000]} 
+    {text_content} 
     ---
     Comprehensive Summary:
     """
-    # Limiting to 15000 characters for the input to summarization to manage token limits,
-    # even though the user said "don't worry". This is a practical limit.
-    # For gpt-4o-mini, context window is 128k tokens, so this is very conservative.
-    # You can increase this if needed, but extremely large single texts might still be an issue.
+    return _summary_completion(client, prompt)
 
-    try:
-        response = client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant skilled in summarizing text for marketing purposes."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.3,
+def _summarize_chunk(client, chunk, section_name, index, total):
+    prompt = f"""
+    The following is part {index} of {total} of a longer {section_name}.
+    Summarize this part in detail. {SUMMARY_FOCUS}
+
+    Keep concrete facts such as product names, figures, customer names and claims;
+    they will be merged with the summaries of the other parts.
+
+    Part {index} of {total}:
+    ---
+    {chunk}
+    ---
+    Detailed Summary of Part {index}:
+    """
+    return _summary_completion(client, prompt)
+
+def _reduce_summaries(client, partial_summaries, section_name):
+    joined = "\n\n".join(f"Part {i} summary:\n{summary}" for i, summary in enumerate(partial_summaries, 1))
+    prompt = f"""
+    Below are summaries of consecutive parts of a {section_name}.
+    Combine them into one comprehensive summary of the whole {section_name}, removing repetition.
+    {SUMMARY_FOCUS}
+
+    The summary should be detailed enough to inform the generation of diverse ad creatives.
+    Avoid generic statements and extract specific, actionable insights.
+
+    Part summaries:
+    ---
+    {joined}
+    ---
+    Comprehensive Summary:
+    """
+    return _summary_completion(client, prompt)
+
+def _map_reduce_summary(client, text_content, section_name, chunk_tokens, concurrency, depth, max_depth):
+    """Summarizes chunks concurrently, then reduces; recurses while the partials are still too long."""
+    chunks = split_text_into_token_chunks(text_content, chunk_tokens, overlap_tokens=chunk_tokens // 20)
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), initializer=worker_thread_initializer()) as executor:
+        partial_summaries = list(executor.map(
+            lambda item: _summarize_chunk(client, item[1], section_name, item[0], len(chunks)),
+            enumerate(chunks, 1)
+        ))
+    partial_summaries = [summary for summary in partial_summaries if summary]
+
+    combined = "\n\n".join(partial_summaries)
+    if count_tokens(combined) > chunk_tokens and depth < max_depth:
+        return _map_reduce_summary(client, combined, section_name, chunk_tokens, concurrency, depth + 1, max_depth)
+    if count_tokens(combined) > chunk_tokens:
+        # Out of depth: reduce what fits in one prompt
+        kept, *dropped = split_text_into_token_chunks(combined, chunk_tokens)
+        logger.warning(
+            "Summaries of %s are still over %d tokens at max_depth=%d; reducing only the first of %d chunks",
+            section_name, chunk_tokens, depth, 1 + len(dropped)
         )
-        summary = response.choices[0].message.content.strip()
-        return summary
+        partial_summaries = [kept]
+    return _reduce_summaries(client, partial_summaries, section_name)
+
+def summary_input_char_limit(mode=DEFAULT_SUMMARY_MODE):
+    """Characters of source text the given summarization mode will actually read."""
+    return SUMMARY_INPUT_CHAR_LIMIT if mode == SUMMARY_MODE_TRUNCATE else MAP_REDUCE_INPUT_CHAR_LIMIT
+
+def summarize_text_with_ai(client, text_content, section_name="content", mode=DEFAULT_SUMMARY_MODE,
+                           chunk_tokens=DEFAULT_SUMMARY_CHUNK_TOKENS, concurrency=DEFAULT_SUMMARY_CONCURRENCY,
+                           max_depth=DEFAULT_SUMMARY_MAX_DEPTH):
+    """
+    Summarizes text using OpenAI API.
+    In "truncate" mode only the first SUMMARY_INPUT_CHAR_LIMIT characters are summarized.
+    In "map_reduce" mode text longer than chunk_tokens is split into chunks that are summarized
+    concurrently (up to `concurrency` calls) and then reduced into one summary. While the
+    partial summaries are still longer than chunk_tokens they are summarized again, for at
+    most max_depth summarizing passes in all; whatever is still too long after that is cut to
+    its first chunk_tokens tokens (with a warning) before the final reduce.
+    """
+    if not client or not text_content or len(text_content.strip()) < 50: # Basic check for meaningful content
+        return ""
+
+    try:
+        if mode == SUMMARY_MODE_TRUNCATE:
+            return _summarize_single(client, text_content[:SUMMARY_INPUT_CHAR_LIMIT], section_name)
+        text_content = text_content[:MAP_REDUCE_INPUT_CHAR_LIMIT]
+        if count_tokens(text_content) <= chunk_tokens:
+            return _summarize_single(client, text_content, section_name)
+        return _map_reduce_summary(client, text_content, section_name, chunk_tokens, concurrency, 1, max_depth)
     except Exception as e:
-        st.error(f"Error during AI summarization for {section_name}: {e}")
+        report_error(f"Error during AI summarization for {section_name}: {e}")
         return ""
 
-def generate_content_with_ai(client, prompt_text):
-    """Generates content using OpenAI API and expects JSON output."""
+GENERATION_SYSTEM_MESSAGE = "You are an expert marketing copywriter. Generate content exactly in the specified JSON format."
+
+def _stream_completion_text(client, messages, on_item):
+    """
+    Streams a JSON completion, calling on_item(array key, element) as each array element completes.
+    Returns (text, usage); usage arrives in the final chunk.
+    """
+    item_stream = JsonArrayItemStream()
+    usage = None
+    stream = _chat_completion(
+        client,
+        messages,
+        GENERATION_COMPLETION_TOKEN_ESTIMATE,
+        response_format={"type": "json_object"},
+        temperature=0.7,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+    for chunk in stream:
+        if getattr(chunk, "usage", None):
+            usage = chunk.usage
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            for key, item in item_stream.feed(delta):
+                on_item(key, item)
+    return item_stream.text, usage
+
+def generate_content_with_ai(client, prompt_text, on_item=None, context_summary=None, on_usage=None):
+    """
+    Generates content using OpenAI API and expects JSON output.
+    With context_summary the messages use the shared generation prefix (see build_generation_messages)
+    and prompt_text holds only the channel instructions.
+    With on_item the completion is streamed and on_item(array key, element) is called from the
+    worker thread for every ad object (or headline/description string) as soon as it is complete,
+    so callers keep those elements even if the call fails later.
+    on_usage(usage_counts) receives the token usage, including provider-cached prompt tokens.
+    """
     if not client:
         return None
+    if context_summary is not None:
+        messages = build_generation_messages(context_summary, prompt_text)
+    else:
+        messages = [
+            {"role": "system", "content": GENERATION_SYSTEM_MESSAGE},
+            {"role": "user", "content": prompt_text}
+        ]
+    content = ""
     try:
-        response = client.chat.completions.create(
-            model=AI_MODEL,
-            messages=[
-                {"role": "system", "content": "You are an expert marketing copywriter. Generate content exactly in the specified JSON format."},
-                {"role": "user", "content": prompt_text}
-            ],
-            response_format={"type": "json_object"}, # Ensure JSON mode is enabled if model supports
-            temperature=0.7,
-        )
-        content = response.choices[0].message.content.strip()
+        if on_item:
+            content, usage = _stream_completion_text(client, messages, on_item)
+            content = content.strip()
+        else:
+            response = _chat_completion(
+                client,
+                messages,
+                GENERATION_COMPLETION_TOKEN_ESTIMATE,
+                response_format={"type": "json_object"}, # Ensure JSON mode is enabled if model supports
+                temperature=0.7,
+            )
+            usage = response.usage
+            content = response.choices[0].message.content.strip()
+        if usage is not None:
+            record_usage(STAGE_GENERATE, usage_counts(usage))
+            if on_usage:
+                on_usage(usage_counts(usage))
         return json.loads(content) # Parse JSON string to Python dict
     except json.JSONDecodeError as e:
-        st.error(f"Error decoding JSON from AI response: {e}")
-        st.text_area("Problematic AI Response:", content, height=200)
+        report_error(f"Error decoding JSON from AI response: {e}", details=content, details_label="Problematic AI Response:")
         return None
     except Exception as e:
-        st.error(f"Error during AI content generation: {e}")
+        report_error(f"Error during AI content generation: {e}")
         return None
 
 # --- Prompt Creation Functions ---
+# Generation prompts share one prefix (system message + company context) and differ only in the
+# channel instructions that follow it, so the provider can reuse the cached prefix across calls.
+
+def build_generation_messages(context_summary, channel_prompt):
+    """Chat messages for a generation call: the shared prefix, then the channel-specific instructions."""
+    return [
+        {"role": "system", "content": GENERATION_SYSTEM_MESSAGE},
+        {"role": "user", "content": f"Company context for all of the ad copy you will write:\n<context>\n{context_summary}\n</context>"},
+        {"role": "user", "content": channel_prompt},
+    ]
 
-def create_email_prompt(context_summary, lead_objective_link, count):
-    return f"""
-    Based on the following company context:
-    <context>
-    {context_summary}
-    </context>
 
-    Generate {count} versions of Email ad content.
+def create_email_prompt(lead_objective_link, count):
+    return f"""
+    Generate {count} versions of Email ad content for the company described in the context above.
     The objective for these emails is "Demand Capture".
     The primary call-to-action link to embed in the email body is: {lead_objective_link}
     Use the placeholder "[LEAD_OBJECTIVE_LINK]" in the email body where this link should be embedded.
@@ -113,7 +320,7 @@ def create_email_prompt(context_summary, lead_objective_link, count):
     }}
     """
 
-def create_linkedin_facebook_prompt(platform, context_summary, objective, count, destination_link, cta_button_options):
+def create_linkedin_facebook_prompt(platform, objective, count, destination_link, cta_button_options):
     ad_name_instruction = "A descriptive ad name (up to 250 characters) for internal identification."
     if platform == "LinkedIn":
         text_field_name = "introductory_text"
@@ -128,12 +335,7 @@ def create_linkedin_facebook_prompt(platform, context_summary, objective, count,
 
 
     return f"""
-    Based on the following company context:
-    <context>
-    {context_summary}
-    </context>
-
-    Generate {count} versions of {platform} ad content for the objective: "{objective}".
+    Generate {count} versions of {platform} ad content for the company described in the context above, for the objective: "{objective}".
     The destination link for these ads is: {destination_link}
     The Call To Action (CTA) button text should be chosen from: {cta_button_options}. If multiple options, choose the most appropriate. If "empty" is an option, it means the CTA button can be omitted or set to a generic one like "Learn More" if that's also an option.
 
@@ -158,16 +360,46 @@ def create_linkedin_facebook_prompt(platform, context_summary, objective, count,
     }}
     """
 
-def create_google_search_prompt(context_summary):
+# Creative angles for sharded generation; each shard of a channel takes the next one so versions stay distinct.
+SHARD_ANGLES = (
+    "the costly problem the audience faces today and what inaction costs them",
+    "concrete, measurable outcomes and return on investment",
+    "proof and credibility: customers, results and trust signals",
+    "speed and ease of getting started",
+    "what sets the company apart from the alternatives",
+)
+
+def create_shard_prompt(prompt, shard_number, shard_count):
+    """Adds batch instructions to a channel prompt so each shard of a large request takes its own angle."""
+    angle = SHARD_ANGLES[(shard_number - 1) % len(SHARD_ANGLES)]
+    return prompt + f"""
+    This is batch {shard_number} of {shard_count} for this channel; number the versions in this batch from 1.
+    Focus every version in this batch on this angle: {angle}.
+    Other batches cover other angles, so avoid generic copy that could belong to any of them.
+    """
+
+def create_length_fix_prompt(fields):
+    """
+    One request to rewrite several ad fields that broke their character limits. fields is a
+    list of {"id", "channel", "field", "text", "min_chars", "max_chars"} dicts.
+    """
     return f"""
-    Based on the following company context:
-    <context>
-    {context_summary}
-    </context>
+    Some ad copy for the company described in the context above is outside its character limits.
+    Rewrite each field below so its length (counting spaces and emojis) is between "min_chars" and "max_chars",
+    keeping its message, tone and any links or placeholders such as "[LEAD_OBJECTIVE_LINK]".
 
-    Generate Google Search Ad copy.
-    Provide exactly 15 headlines, each around 30 characters.
-    Provide exactly 4 descriptions, each around 90 characters.
+    Fields:
+    {json.dumps(fields, ensure_ascii=False, indent=2)}
+
+    Output the result as a JSON object with a single key "fixes", which is a list of objects with the keys
+    "id" (the field's id, unchanged) and "text" (the rewritten text), one per field above.
+    """
+
+def create_google_search_prompt(headline_count=15, description_count=4):
+    return f"""
+    Generate Google Search Ad copy for the company described in the context above.
+    Provide exactly {headline_count} headlines, each around 30 characters.
+    Provide exactly {description_count} descriptions, each around 90 characters.
 
     Output the result as a JSON object with two keys: "headlines" (a list of strings) and "descriptions" (a list of strings).
 
@@ -176,38 +408,33 @@ def create_google_search_prompt(context_summary):
       "headlines": [
         "Headline 1 (approx 30 chars)",
         "Headline 2 (approx 30 chars)",
-        // ...13 more headlines
+        // ...{headline_count} headlines in all
       ],
       "descriptions": [
         "Description 1 (approx 90 chars). Drive results.",
         "Description 2 (approx 90 chars). Learn more now.",
-        // ...2 more descriptions
+        // ...{description_count} descriptions in all
       ]
     }}
     """
 
-def create_google_display_prompt(context_summary):
+def create_google_display_prompt(headline_count=5, description_count=5):
     return f"""
-    Based on the following company context:
-    <context>
-    {context_summary}
-    </context>
+    Generate Google Display Ad copy for the company described in the context above.
+    Provide exactly {headline_count} short headlines, each around 30 characters.
+    Provide exactly {description_count} long headlines, each around 90 characters (these will be used as descriptions in the XLSX).
 
-    Generate Google Display Ad copy.
-    Provide exactly 5 short headlines, each around 30 characters.
-    Provide exactly 5 long headlines, each around 90 characters (these will be used as descriptions in the XLSX).
-
-    Output the result as a JSON object with two keys: "headlines" (a list of 5 short headline strings) and "descriptions" (a list of 5 long headline/description strings).
+    Output the result as a JSON object with two keys: "headlines" (a list of {headline_count} short headline strings) and "descriptions" (a list of {description_count} long headline/description strings).
 
     Example JSON structure:
     {{
       "headlines": [
         "Short Headline 1 (30char)",
-        // ...4 more short headlines
+        // ...{headline_count} short headlines in all
       ],
       "descriptions": [
         "Long Headline/Description 1 (90char). Discover more today.",
-        // ...4 more long headlines/descriptions
+        // ...{description_count} long headlines/descriptions in all
       ]
     }}
-    """
\ No newline at end of file
+    """
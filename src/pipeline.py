@@ -0,0 +1,451 @@
+import logging
+import os
+import re
+import shutil
+import tempfile
+import uuid
+
+from src.ad_generator import (
+    DEFAULT_MAX_CONCURRENT_GENERATIONS, GENERATION_TASK_COUNT,
+    build_generation_tasks, run_generation_tasks, assemble_ad_data, partial_content, shares_cacheable_prefix,
+    merge_regenerated_content, count_generation_calls, regeneration_versions, google_rows_task
+)
+from src.cache import get_cache
+from src.context_compactor import compact_context, DEFAULT_CONTEXT_TOKEN_BUDGET
+from src.instrumentation import (
+    RunTrace, set_current_trace, reset_current_trace, stage, profiled,
+    STAGE_EXCEL, STAGE_VALIDATE, DEFAULT_PROFILE_DIR
+)
+from src.rate_limiter import get_scheduler
+from src.sheet_schemas import SHEET_SCHEMAS
+from src.utils import validate_url, get_company_name_from_url, get_active_lead_objective_link
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONTENT_COUNT = 10
+LEAD_OBJECTIVE_TYPES = ("Demo Booking", "Sales Meeting")
+
+
+class LocalFile:
+    """Wraps a file on disk so it can be used wherever a Streamlit upload is expected."""
+
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+
+    def getvalue(self):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def spool_uploads(files, directory):
+    """
+    Copies uploads (anything with .name and .read()/.getvalue()) into files under directory,
+    in chunks, and returns them as LocalFiles; files already on disk are passed through.
+    """
+    spooled = []
+    for upload in files:
+        if isinstance(upload, LocalFile):
+            spooled.append(upload)
+            continue
+        safe_name = re.sub(r"[^A-Za-z0-9._-]+", "_", upload.name)
+        path = os.path.join(directory, f"{uuid.uuid4().hex[:8]}-{safe_name}")
+        with open(path, "wb") as f:
+            if hasattr(upload, "read"):
+                upload.seek(0)
+                shutil.copyfileobj(upload, f, 1 << 20)
+            else:
+                f.write(upload.getvalue())
+        spooled.append(LocalFile(path, name=upload.name))
+    return spooled
+
+
+def _as_file_list(files):
+    """None, one upload or a list of uploads -> list of uploads."""
+    if not files:
+        return []
+    return list(files) if isinstance(files, (list, tuple)) else [files]
+
+
+def prepare_job(client_url, lead_objective_type, learn_more_link, downloadable_material_link,
+                demo_booking_link="", sales_meeting_link="", content_count=DEFAULT_CONTENT_COUNT,
+                additional_context_files=None, downloadable_material_files=None, crawl_options=None,
+                context_token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET,
+                max_concurrent_generations=DEFAULT_MAX_CONCURRENT_GENERATIONS, summary_options=None,
+                stream_generations=True, profile_dir=None):
+    """
+    Validates and normalizes the inputs for one client. additional_context_files and
+    downloadable_material_files are each one upload or a list of them. profile_dir enables cProfile output
+    for the extraction and Excel stages (default: the AD_GEN_PROFILE_DIR environment variable).
+    Returns (job, None) on success or (None, error message) when a required input is missing.
+    """
+    client_url = validate_url(client_url)
+    learn_more_link = validate_url(learn_more_link)
+    downloadable_material_link = validate_url(downloadable_material_link)
+    demo_booking_link = validate_url(demo_booking_link)
+    sales_meeting_link = validate_url(sales_meeting_link)
+    active_lead_link = get_active_lead_objective_link(lead_objective_type, demo_booking_link, sales_meeting_link)
+
+    if not client_url:
+        return None, "Please provide a valid client website URL."
+    if not active_lead_link:
+        return None, f"Please provide the link for '{lead_objective_type}'."
+    if not learn_more_link:
+        return None, "Please provide the 'Learn More' link."
+    if not downloadable_material_link:
+        return None, "Please provide the link to the downloadable material."
+
+    return {
+        "client_url": client_url,
+        "company_name": get_company_name_from_url(client_url),
+        "lead_objective_type": lead_objective_type,
+        "learn_more_link": learn_more_link,
+        "downloadable_material_link": downloadable_material_link,
+        "demo_booking_link": demo_booking_link,
+        "sales_meeting_link": sales_meeting_link,
+        "active_lead_link": active_lead_link,
+        "content_count": int(content_count),
+        "additional_context_files": _as_file_list(additional_context_files),
+        "downloadable_material_files": _as_file_list(downloadable_material_files),
+        "crawl_options": crawl_options,
+        "context_token_budget": context_token_budget,
+        "max_concurrent_generations": max_concurrent_generations,
+        "summary_options": summary_options,
+        "stream_generations": stream_generations,
+        "profile_dir": profile_dir,
+    }, None
+
+
+def pipeline_total_steps(job):
+    """Progress steps for a job: one per context source (the website and each file) and per generation call."""
+    return 1 + len(job["additional_context_files"]) + len(job["downloadable_material_files"]) + GENERATION_TASK_COUNT
+
+
+def excel_file_name(company_name):
+    return f"{company_name}_ads_creative.xlsx"
+
+
+def _rate_limit_stats(before):
+    """Scheduler counters for this run; queue depth and wait peaks are process-wide."""
+    after = get_scheduler().metrics()
+    stats = {key: after[key] - before[key] for key in
+             ("requests", "retries", "failures", "deadline_exceeded", "throttled", "total_wait_seconds")}
+    stats["max_queue_depth"] = after["max_queue_depth"]
+    stats["max_wait_seconds"] = after["max_wait_seconds"]
+    return stats
+
+
+def _add_usage(usage_by_task, task_id, usage):
+    """Adds a call's usage_counts to the task's total (sharded and regenerated tasks make several calls)."""
+    previous = usage_by_task.get(task_id, {})
+    usage_by_task[task_id] = {kind: previous.get(kind, 0) + value for kind, value in usage.items()}
+    usage_by_task[task_id]["calls"] = previous.get("calls", 0) + 1
+
+
+def run_pipeline(client, job, on_progress=None, on_warning=None, checkpoint=None, save_checkpoint=None,
+                 on_ad_item=None):
+    """
+    Runs the whole pipeline for one prepared job and returns a result dict with the
+    'summaries', compacted 'context', 'compaction_stats', 'cache_stats', 'ad_data',
+    'failed_generations', 'generation_results' (parsed content per task id, for
+    regenerate_generation), 'generation_labels' ({task id: label}), 'generation_usage' (calls
+    and token usage per generation task, including provider-cached prompt tokens), 'limit_violations'
+    (fields still outside their character limits after one fix attempt, see ad_validator;
+    they are highlighted in the workbook), 'rate_limit_stats', the 'links' used for export, 'excel_bytes'
+    (None if nothing was generated), an 'error' message and the run's 'trace' (RunTrace.to_dict():
+    wall time per stage and call, tokens, retries and cache hits).
+
+    on_progress(step_increment, message) and on_warning(message) report progress; they are
+    called from the calling thread. checkpoint is a dict of completed stages ("summaries",
+    "generation_results"); completed stages are skipped, and save_checkpoint(checkpoint) is
+    called after each stage or generation call so an interrupted run can resume.
+
+    When job["stream_generations"] is set, on_ad_item(task, item) is called from the calling
+    thread for each ad as soon as it has streamed in. Ads streamed by a call that then fails
+    are kept in ad_data (but not checkpointed, so a resumed run retries the call).
+    """
+    on_progress = on_progress or (lambda step_increment=1, message="": None)
+    on_warning = on_warning or (lambda message: None)
+    checkpoint = checkpoint if checkpoint is not None else {}
+    save_checkpoint = save_checkpoint or (lambda checkpoint: None)
+    result = {
+        "company_name": job["company_name"],
+        "file_name": excel_file_name(job["company_name"]),
+        "summaries": [],
+        "context": "",
+        "compaction_stats": None,
+        "cache_stats": None,
+        "ad_data": {},
+        "failed_generations": [],
+        "generation_results": {},
+        "generation_labels": {},
+        "generation_usage": {},
+        "limit_violations": [],
+        "rate_limit_stats": None,
+        "links": {
+            "learn_more_link": job["learn_more_link"],
+            "downloadable_material_link": job["downloadable_material_link"],
+            "demo_booking_link": job["demo_booking_link"],
+            "sales_meeting_link": job["sales_meeting_link"],
+            "active_lead_objective_link": job["active_lead_link"]
+        },
+        "excel_bytes": None,
+        "error": None,
+        "trace": None,
+    }
+
+    trace = RunTrace(job["company_name"], profile_dir=job.get("profile_dir") or DEFAULT_PROFILE_DIR)
+    trace_token = set_current_trace(trace)
+    scheduler_metrics_before = get_scheduler().metrics()
+    try:
+        _run_stages(client, job, result, on_progress, on_warning, checkpoint, save_checkpoint, on_ad_item)
+    finally:
+        reset_current_trace(trace_token)
+        trace.finish()
+        result["rate_limit_stats"] = _rate_limit_stats(scheduler_metrics_before)
+        result["trace"] = trace.to_dict()
+    return result
+
+
+def _count_context_prompts(compaction_stats, prompt_count):
+    """Adds prompts that embedded the compacted context (one per generation or fix call) to the run's savings."""
+    compaction_stats["prompt_count"] += prompt_count
+    compaction_stats["tokens_saved_per_run"] = compaction_stats["tokens_saved_per_prompt"] * compaction_stats["prompt_count"]
+
+
+def _enforce_limits(client, context, ad_data, on_progress=None, fixable=None):
+    """
+    Finds fields outside their character limits, asks for rewrites of the fixable ones in one
+    batched call (ad_data is fixed in place, which also updates the generation results it was
+    assembled from). Returns (the violations that remain, the number of fix calls made).
+    """
+    from src.ad_validator import find_limit_violations, fix_limit_violations
+
+    with stage(STAGE_VALIDATE, "check"):
+        violations = find_limit_violations(ad_data)
+    to_fix = [violation for violation in violations if fixable is None or fixable(violation)]
+    if not to_fix:
+        return violations, 0
+    if on_progress:
+        on_progress(0, f"Rewriting {len(to_fix)} fields outside their character limits...")
+    with stage(STAGE_VALIDATE, "fix", fields=len(to_fix)):
+        fixed = fix_limit_violations(client, context, ad_data, to_fix)
+    if not fixed:
+        return violations, 1
+    with stage(STAGE_VALIDATE, "check"):
+        return find_limit_violations(ad_data), 1
+
+
+def _run_stages(client, job, result, on_progress, on_warning, checkpoint, save_checkpoint, on_ad_item):
+    """The pipeline body; fills in result and returns early on errors."""
+    # Extraction and export pull in requests/bs4/PyPDF2/pandas/openpyxl, so load them only when a run starts
+    from src.ad_validator import limit_flags
+    from src.context_builder import build_context_sources, build_context_summaries
+    from src.excel_generator import create_excel_file
+
+    # 1. Extract and Summarize Context (all sources in parallel)
+    if "summaries" in checkpoint:
+        all_summaries = checkpoint["summaries"]
+        on_progress(pipeline_total_steps(job) - GENERATION_TASK_COUNT, "Using summaries from checkpoint...")
+    else:
+        on_progress(0, "Starting content extraction and summarization...")
+
+        def on_source_done(source, summary, warning):
+            on_progress(1, f"Finished extracting and summarizing {source['label']}...")
+
+        cache_stats_before = get_cache().stats()
+        # Uploads not already on disk are spooled there, so workers read them by path
+        with tempfile.TemporaryDirectory(prefix="ad-gen-uploads-") as spool_dir:
+            context_sources = build_context_sources(
+                job["client_url"], spool_uploads(job["additional_context_files"], spool_dir),
+                spool_uploads(job["downloadable_material_files"], spool_dir), job["crawl_options"]
+            )
+            all_summaries, context_warnings = build_context_summaries(
+                client, context_sources, on_source_done, job["summary_options"]
+            )
+        for warning in context_warnings:
+            on_warning(warning)
+        cache_stats_after = get_cache().stats()
+        result["cache_stats"] = {
+            "hits": cache_stats_after["hits"] - cache_stats_before["hits"],
+            "misses": cache_stats_after["misses"] - cache_stats_before["misses"],
+            "entries": cache_stats_after["entries"],
+            "bytes": cache_stats_after["bytes"],
+        }
+        if all_summaries:
+            checkpoint["summaries"] = all_summaries
+            save_checkpoint(checkpoint)
+
+    result["summaries"] = all_summaries
+    if not all_summaries:
+        result["error"] = "No context could be summarized. Please provide a valid URL or upload context files."
+        return
+
+    # Run-wide savings are counted as the calls that embed the context are made (_count_context_prompts)
+    comprehensive_context, compaction_stats = compact_context(all_summaries, job["context_token_budget"], prompt_count=0)
+    result["context"] = comprehensive_context
+    result["compaction_stats"] = compaction_stats
+
+    # 2. Generate Ad Content (all calls depend only on the context, so they run concurrently)
+    generation_tasks = build_generation_tasks(
+        comprehensive_context, job["content_count"], job["learn_more_link"],
+        job["downloadable_material_link"], job["active_lead_link"]
+    )
+    generation_results = checkpoint.setdefault("generation_results", {})
+    pending_tasks = [task for task in generation_tasks if generation_results.get(task["id"]) is None]
+    on_progress(len(generation_tasks) - len(pending_tasks))
+    on_progress(0, f"Generating ad content ({len(pending_tasks)} requests, up to {job['max_concurrent_generations']} at a time)...")
+
+    def on_generation_done(task, content):
+        generation_results[task["id"]] = content
+        save_checkpoint(checkpoint)
+        on_progress(1, f"Finished {task['label']} content...")
+
+    streamed_items = {}
+
+    def on_item(task, key, item):
+        streamed_items.setdefault(task["id"], []).append((key, item))
+        if on_ad_item:
+            on_ad_item(task, item)
+
+    def on_usage(task, usage):
+        _add_usage(result["generation_usage"], task["id"], usage)
+
+    run_generation_tasks(
+        client, pending_tasks, max_workers=job["max_concurrent_generations"], on_task_done=on_generation_done,
+        on_item=on_item if job.get("stream_generations") else None, on_usage=on_usage,
+        warm_up_prefix=shares_cacheable_prefix(pending_tasks)
+    )
+    assembled_results = dict(generation_results)
+    for task in pending_tasks:
+        if assembled_results.get(task["id"]) is None and streamed_items.get(task["id"]):
+            assembled_results[task["id"]] = partial_content(streamed_items[task["id"]])
+            on_warning(f"{task['label']} generation failed part-way; keeping the {len(streamed_items[task['id']])} items received.")
+    _count_context_prompts(compaction_stats, count_generation_calls(pending_tasks))
+    ad_data_for_excel, failed_generations = assemble_ad_data(generation_tasks, assembled_results)
+    result["generation_results"] = assembled_results
+    result["generation_labels"] = {task["id"]: task["label"] for task in generation_tasks}
+    result["ad_data"] = ad_data_for_excel
+    result["failed_generations"] = failed_generations
+    for label in failed_generations:
+        on_warning(f"Failed to generate {label} content or received unexpected format.")
+
+    # 3. Create Excel File
+    if not ad_data_for_excel:
+        result["error"] = "Could not generate any ad content. Please check the context and try again."
+        return
+
+    result["limit_violations"], fix_calls = _enforce_limits(client, comprehensive_context, ad_data_for_excel, on_progress)
+    _count_context_prompts(compaction_stats, fix_calls)
+    logger.info(
+        "Compacted context saved %d input tokens across %d prompts this run",
+        compaction_stats["tokens_saved_per_run"], compaction_stats["prompt_count"]
+    )
+    if result["limit_violations"]:
+        on_warning(f"{len(result['limit_violations'])} fields are still outside their character limits; "
+                   "they are highlighted in the Excel file.")
+
+    on_progress(0, "All content generated. Creating Excel file...")
+    with stage(STAGE_EXCEL, result["file_name"]), profiled(STAGE_EXCEL):
+        result["excel_bytes"] = create_excel_file(
+            ad_data_for_excel, job["company_name"], result["links"], limit_flags(result["limit_violations"])
+        ).getvalue()
+
+
+def check_regeneration_versions(job, result, task_id, versions):
+    """
+    An error message when some of versions (row numbers for Google ads) are not among the
+    task's current ones, else None. Without versions, or without earlier content to keep,
+    the whole task is regenerated and any versions are fine.
+    """
+    content = result["generation_results"].get(task_id)
+    if not versions or not content:
+        return None
+    generation_tasks = build_generation_tasks(
+        result["context"], len(versions), job["learn_more_link"], job["downloadable_material_link"], job["active_lead_link"]
+    )
+    task = next((task for task in generation_tasks if task["id"] == task_id), None)
+    if task is None:
+        return f"Unknown generation task: {task_id}"
+    valid = regeneration_versions(task, content)
+    invalid = sorted(set(versions) - set(valid))
+    if not invalid:
+        return None
+    noun = "row" if SHEET_SCHEMAS[task["channel"]]["kind"] == "paired_lists" else "version"
+    if valid and valid == list(range(valid[0], valid[-1] + 1)):
+        valid_text = f"{valid[0]}-{valid[-1]}" if len(valid) > 1 else str(valid[0])
+    else:
+        valid_text = ", ".join(map(str, valid)) or "none"
+    return f"{task['label']} has no {noun} {', '.join(map(str, invalid))} (its {noun}s are {valid_text})."
+
+
+def regenerate_generation(client, job, result, task_id, versions=None, on_ad_item=None):
+    """
+    Re-runs one generation call of a finished run (see run_pipeline) with the run's compacted
+    context, and patches result in place: 'generation_results', 'ad_data', 'failed_generations',
+    'limit_violations' and just the changed rows of 'excel_bytes'. Only the new ads are sent
+    for character-limit fixes. With versions, only those version numbers (row
+    numbers for Google ads) are requested and replaced; the rest of the task's ads are kept.
+    Versions the task does not have are an error (see check_regeneration_versions).
+    on_ad_item(task, item) is called for each streamed ad when job["stream_generations"] is set.
+    Returns an error message, or None on success.
+    """
+    from src.ad_validator import limit_flags
+    from src.excel_generator import create_excel_file, patch_excel_file
+
+    if not result["context"]:
+        return "This run has no context to regenerate from."
+    versions = sorted(set(versions or []))
+    generation_results = result["generation_results"]
+    if versions and not generation_results.get(task_id):
+        versions = [] # Nothing to keep; regenerate the whole task
+    generation_tasks = build_generation_tasks(
+        result["context"], len(versions) or job["content_count"], job["learn_more_link"],
+        job["downloadable_material_link"], job["active_lead_link"]
+    )
+    task = next((task for task in generation_tasks if task["id"] == task_id), None)
+    if task is None:
+        return f"Unknown generation task: {task_id}"
+    versions_error = check_regeneration_versions(job, result, task_id, versions)
+    if versions_error:
+        return versions_error
+    if versions and SHEET_SCHEMAS[task["channel"]]["kind"] == "paired_lists":
+        task = google_rows_task(task, generation_results[task_id], versions)
+
+    def on_item(task, key, item):
+        on_ad_item(task, item)
+
+    def on_usage(task, usage):
+        _add_usage(result["generation_usage"], task["id"], usage)
+
+    content = run_generation_tasks(
+        client, [task], max_workers=1, on_item=on_item if on_ad_item and job.get("stream_generations") else None,
+        on_usage=on_usage
+    )[task_id]
+    _, failed = assemble_ad_data([task], {task_id: content})
+    if failed:
+        return f"Failed to regenerate {task['label']} content or received unexpected format."
+    if versions:
+        content = merge_regenerated_content(task, generation_results[task_id], content, versions)
+
+    old_ad_data = result["ad_data"]
+    generation_results[task_id] = content
+    result["ad_data"], result["failed_generations"] = assemble_ad_data(generation_tasks, generation_results)
+
+    def is_new(violation):
+        # Rows shared with the previous ad_data are also in the workbook as it is; leave them be
+        if violation["channel"] != task["channel"]:
+            return False
+        if SHEET_SCHEMAS[task["channel"]]["kind"] == "paired_lists":
+            return True # merge_regenerated_content copies the lists
+        ad = result["ad_data"][task["channel"]][violation["row"]]
+        return not any(ad is old_ad for old_ad in old_ad_data.get(task["channel"], []))
+
+    result["limit_violations"], _ = _enforce_limits(client, result["context"], result["ad_data"], fixable=is_new)
+    flags = limit_flags(result["limit_violations"])
+    if result["excel_bytes"]:
+        result["excel_bytes"] = patch_excel_file(result["excel_bytes"], old_ad_data, result["ad_data"], result["links"], flags)
+    else:
+        result["excel_bytes"] = create_excel_file(result["ad_data"], job["company_name"], result["links"], flags).getvalue()
+    result["error"] = None
+    return None
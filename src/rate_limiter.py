@@ -0,0 +1,199 @@
+import logging
+import os
+import random
+import threading
+import time
+
+from src.instrumentation import count
+
+logger = logging.getLogger(__name__)
+
+# Account quota for the model; override with the environment variables.
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get("OPENAI_RPM_LIMIT", 500))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("OPENAI_TPM_LIMIT", 200_000))
+
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0 # Seconds before the first retry; doubles per attempt
+DEFAULT_BACKOFF_MAX = 30.0
+DEFAULT_CALL_DEADLINE = 180.0 # Seconds per call, including queueing and retries
+
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class TokenBucket:
+    """Refills `capacity` units per minute; callers wait until enough units are available."""
+
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.rate = self.capacity / 60.0
+        self.available = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def reserve(self, amount, now):
+        """Takes `amount` units if available and returns 0, otherwise the seconds until they will be."""
+        self._refill(now)
+        amount = min(amount, self.capacity) # A single oversized call must still be able to run
+        if self.available >= amount:
+            self.available -= amount
+            return 0.0
+        return (amount - self.available) / self.rate
+
+
+def _is_retryable(error):
+    """429s, 408/409, 5xx, timeouts and connection errors are worth retrying; other API errors are not."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES or status_code >= 500
+    try:
+        import openai
+    except ImportError:
+        return False
+    return isinstance(error, (openai.APIConnectionError, openai.APITimeoutError))
+
+
+def _retry_after_seconds(error):
+    """The server's Retry-After hint in seconds, if the error carries one."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = headers.get(header)
+        if value:
+            try:
+                return float(value) * scale
+            except ValueError:
+                pass
+    return None
+
+
+class RequestScheduler:
+    """
+    Shared gate for OpenAI calls. Every call first reserves one request and its estimated tokens
+    from per-minute token buckets, then runs; retryable failures are retried with jittered
+    exponential backoff (honouring Retry-After) until max_retries or the call's deadline.
+    Queue depth, waits and retries are tracked for the lifetime of the process.
+    """
+
+    def __init__(self, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX,
+                 default_deadline=DEFAULT_CALL_DEADLINE):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.default_deadline = default_deadline
+        self._lock = threading.Lock()
+        self._metrics = {
+            "requests": 0, "retries": 0, "failures": 0, "deadline_exceeded": 0,
+            "queue_depth": 0, "max_queue_depth": 0, "in_flight": 0,
+            "throttled": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0,
+        }
+
+    def _acquire(self, estimated_tokens, deadline):
+        """Blocks until the buckets admit the call; returns the seconds spent waiting."""
+        started = time.monotonic()
+        with self._lock:
+            self._metrics["queue_depth"] += 1
+            self._metrics["max_queue_depth"] = max(self._metrics["max_queue_depth"], self._metrics["queue_depth"])
+        try:
+            throttled = False
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    wait = self.request_bucket.reserve(1, now)
+                    if wait == 0:
+                        wait = self.token_bucket.reserve(estimated_tokens, now)
+                        if wait > 0:
+                            self.request_bucket.available += 1 # Give the request slot back
+                if wait == 0:
+                    break
+                throttled = True
+                if now + wait > deadline:
+                    raise DeadlineExceeded("Deadline reached while waiting for the rate limit.")
+                time.sleep(wait)
+        finally:
+            waited = time.monotonic() - started
+            if throttled:
+                count("openai_throttled")
+                count("openai_throttled_seconds", waited)
+            with self._lock:
+                self._metrics["queue_depth"] -= 1
+                self._metrics["throttled"] += int(throttled)
+                self._metrics["total_wait_seconds"] += waited
+                self._metrics["max_wait_seconds"] = max(self._metrics["max_wait_seconds"], waited)
+        return waited
+
+    def _backoff(self, attempt, error):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        delay = random.uniform(delay / 2, delay) # Jitter so parallel callers do not retry in lockstep
+        retry_after = _retry_after_seconds(error)
+        return max(delay, retry_after) if retry_after is not None else delay
+
+    def call(self, request, estimated_tokens=0, deadline=None):
+        """
+        Runs request(timeout) under the rate limits and returns its result. `timeout` is the
+        time left before the deadline (seconds from now, default default_deadline) and should be
+        passed on to the HTTP call. Raises the last error once retries or the deadline run out.
+        """
+        deadline_at = time.monotonic() + (deadline if deadline is not None else self.default_deadline)
+        attempt = 0
+        while True:
+            try:
+                self._acquire(estimated_tokens, deadline_at)
+            except DeadlineExceeded:
+                with self._lock:
+                    self._metrics["deadline_exceeded"] += 1
+                raise
+            with self._lock:
+                self._metrics["requests"] += 1
+                self._metrics["in_flight"] += 1
+            try:
+                return request(max(0.1, deadline_at - time.monotonic()))
+            except Exception as e:
+                error = e
+            finally:
+                with self._lock:
+                    self._metrics["in_flight"] -= 1
+
+            delay = self._backoff(attempt, error)
+            retryable = _is_retryable(error) and attempt < self.max_retries
+            out_of_time = time.monotonic() + delay > deadline_at
+            if not retryable or out_of_time:
+                with self._lock:
+                    self._metrics["failures"] += 1
+                    self._metrics["deadline_exceeded"] += int(retryable and out_of_time)
+                raise error
+            with self._lock:
+                self._metrics["retries"] += 1
+            count("openai_retries", status=getattr(error, "status_code", None) or type(error).__name__)
+            logger.warning("OpenAI call failed (%s), retrying in %.1fs (attempt %d)", error, delay, attempt + 1)
+            time.sleep(delay)
+            attempt += 1
+
+    def metrics(self):
+        """Returns a snapshot of the counters, plus the average wait per admitted request."""
+        with self._lock:
+            snapshot = dict(self._metrics)
+        snapshot["avg_wait_seconds"] = snapshot["total_wait_seconds"] / snapshot["requests"] if snapshot["requests"] else 0.0
+        return snapshot
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Returns the process-wide scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
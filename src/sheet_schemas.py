@@ -0,0 +1,91 @@
+def _prepare_email(ad, links):
+    return dict(
+        ad,
+        objective_type="Demand Capture", # As per spec
+        # Replace placeholder with actual link
+        body=str(ad.get("body", "")).replace("[LEAD_OBJECTIVE_LINK]", links.get('active_lead_objective_link', '')),
+    )
+
+
+# One entry per channel key in ad_data, in sheet order.
+# "objects" channels hold a list of ad dicts and list their columns as (header, ad key);
+# "paired_lists" channels hold {"headlines": [...], "descriptions": [...]} laid out side by side.
+# prepare(ad, links) optionally rewrites each ad before its row is built.
+SHEET_SCHEMAS = {
+    "email": {
+        "sheet_name": "Email",
+        "kind": "objects",
+        "columns": [
+            ("Version #", "version"), ("Objective", "objective_type"), ("Headline", "headline"),
+            ("Subject Line", "subject_line"), ("Body", "body"), ("CTA", "cta"),
+        ],
+        "prepare": _prepare_email,
+    },
+    "linkedin": {
+        "sheet_name": "LinkedIn",
+        "kind": "objects",
+        "columns": [
+            ("Version #", "version"), ("Ad Name", "ad_name"), ("Objective", "objective_type"),
+            ("Introductory Text", "introductory_text"), ("Image Copy", "image_copy"),
+            ("Headline", "headline"), ("Destination", "destination_link"), ("CTA Button", "cta_button"),
+        ],
+    },
+    "facebook": {
+        "sheet_name": "Facebook",
+        "kind": "objects",
+        "columns": [
+            ("Version #", "version"), ("Ad Name", "ad_name"), ("Objective", "objective_type"),
+            ("Primary Text", "primary_text"), ("Image Copy", "image_copy"), ("Headline", "headline"),
+            ("Link Description", "link_description"), ("Destination", "destination_link"), ("CTA Button", "cta_button"),
+        ],
+        "defaults": {"link_description": ""}, # AI doesn't always provide it
+    },
+    "google_search": {
+        "sheet_name": "Google Search",
+        "kind": "paired_lists",
+        "columns": [("Headline", "headlines"), ("Description", "descriptions")],
+    },
+    "google_display": {
+        "sheet_name": "Google Display",
+        "kind": "paired_lists",
+        "columns": [("Headline", "headlines"), ("Description", "descriptions")],
+    },
+}
+
+
+def cell_value(value):
+    """Coerces AI output into a scalar every exporter can hold."""
+    if isinstance(value, (list, tuple)):
+        return "\n".join(str(item) for item in value)
+    if isinstance(value, dict):
+        return str(value)
+    return value
+
+
+def sheet_headers(channel):
+    return [header for header, _ in SHEET_SCHEMAS[channel]["columns"]]
+
+
+def iter_sheet_rows(channel, data, links):
+    """Yields one list of cell values per row for a channel, following its schema."""
+    schema = SHEET_SCHEMAS[channel]
+    if schema["kind"] == "paired_lists":
+        # Pad the shorter list so every row has both columns
+        lists = [data.get(key, []) for _, key in schema["columns"]]
+        for index in range(max((len(values) for values in lists), default=0)):
+            yield [cell_value(values[index]) if index < len(values) else "" for values in lists]
+        return
+
+    defaults = schema.get("defaults", {})
+    prepare = schema.get("prepare")
+    for ad in data:
+        if prepare:
+            ad = prepare(ad, links)
+        yield [cell_value(ad.get(key, defaults.get(key))) for _, key in schema["columns"]]
+
+
+def iter_sheets(ad_data, links):
+    """Yields (channel, schema, headers, row iterator) for every channel present in ad_data, in sheet order."""
+    for channel, schema in SHEET_SCHEMAS.items():
+        if ad_data.get(channel):
+            yield channel, schema, sheet_headers(channel), iter_sheet_rows(channel, ad_data[channel], links)
@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import math
+import time
+import xml.etree.ElementTree as ET
+from urllib.parse import urljoin, urldefrag, urlparse
+
+from src.http_fetch import fetch_url
+from src.instrumentation import stage, STAGE_PARSE
+from src.text_extractor import extract_text_from_html
+
+# Crawl budgets and politeness defaults.
+DEFAULT_MAX_PAGES = 15
+DEFAULT_MAX_TOTAL_BYTES = 10 * 1024 * 1024
+DEFAULT_MAX_PAGE_BYTES = 2 * 1024 * 1024
+DEFAULT_CONCURRENCY = 6
+DEFAULT_PER_HOST_CONCURRENCY = 2
+DEFAULT_PER_HOST_DELAY = 0.25 # Seconds between request starts to the same host
+MAX_SITEMAPS = 3
+
+# Pages whose URL mentions these are crawled first; they carry most of the ad-relevant material.
+PRIORITY_KEYWORDS = (
+    "product", "solution", "pricing", "price", "plan", "feature", "platform",
+    "case-stud", "customer", "success", "about", "service", "industr", "why",
+)
+SKIPPED_EXTENSIONS = (
+    ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".ico", ".css", ".js",
+    ".zip", ".mp4", ".mp3", ".xml", ".json", ".doc", ".docx", ".ppt", ".pptx", ".xls", ".xlsx",
+)
+
+# Lines on at least this share of pages are treated as site-wide boilerplate.
+BOILERPLATE_PAGE_SHARE = 0.5
+# Pages whose word shingles overlap this much with an earlier page are dropped.
+NEAR_DUPLICATE_THRESHOLD = 0.9
+
+
+def _site_host(url):
+    host = (urlparse(url).hostname or "").lower()
+    return host[4:] if host.startswith("www.") else host
+
+
+def _normalize_link(base_url, href):
+    """Resolves href against base_url; returns None for non-HTTP or non-page links."""
+    if not href:
+        return None
+    url, _ = urldefrag(urljoin(base_url, href.strip()))
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https"):
+        return None
+    if parsed.path.lower().endswith(SKIPPED_EXTENSIONS):
+        return None
+    return url
+
+
+def _link_priority(url):
+    """Lower sorts first: keyword pages, then shallow paths."""
+    path = urlparse(url).path.lower()
+    keyword_rank = 0 if any(keyword in path for keyword in PRIORITY_KEYWORDS) else 1
+    return (keyword_rank, path.count("/"), len(path))
+
+
+def _parse_sitemap(content):
+    """Returns (page urls, nested sitemap urls) from a sitemap or sitemap index."""
+    try:
+        root = ET.fromstring(content)
+    except ET.ParseError:
+        return [], []
+    locs = [el.text.strip() for el in root.iter() if el.tag.endswith("loc") and el.text]
+    if root.tag.endswith("sitemapindex"):
+        return [], locs
+    return locs, []
+
+
+def _extract_links(base_url, html):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    return [_normalize_link(base_url, a.get("href")) for a in soup.find_all("a", href=True)]
+
+
+class _HostLimiter:
+    """Caps concurrent requests per host and spaces out request starts."""
+
+    def __init__(self, per_host_concurrency, per_host_delay):
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_delay = per_host_delay
+        self._semaphores = {}
+        self._next_start = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, host):
+        semaphore = self._semaphores.setdefault(host, asyncio.Semaphore(self.per_host_concurrency))
+        await semaphore.acquire()
+        async with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_start.get(host, now))
+            self._next_start[host] = start + self.per_host_delay
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def release(self, host):
+        self._semaphores[host].release()
+
+
+async def crawl_site_async(start_url, max_pages=DEFAULT_MAX_PAGES, max_total_bytes=DEFAULT_MAX_TOTAL_BYTES,
+                           max_page_bytes=DEFAULT_MAX_PAGE_BYTES, concurrency=DEFAULT_CONCURRENCY,
+                           per_host_concurrency=DEFAULT_PER_HOST_CONCURRENCY, per_host_delay=DEFAULT_PER_HOST_DELAY):
+    """
+    Crawls same-site pages starting at start_url, seeded from sitemap.xml and followed via in-page links.
+    Fetches run on threads through the shared fetch layer, at most `concurrency` at a time overall
+    and `per_host_concurrency` per host. Stops at max_pages pages or max_total_bytes downloaded.
+    Returns a list of {"url", "html"} dicts with the start page first.
+    """
+    import requests
+
+    site = _site_host(start_url)
+    limiter = _HostLimiter(per_host_concurrency, per_host_delay)
+
+    async def _fetch(url):
+        host = urlparse(url).hostname or ""
+        await limiter.acquire(host)
+        try:
+            return await asyncio.to_thread(fetch_url, url, max_bytes=max_page_bytes)
+        except requests.exceptions.RequestException:
+            return None
+        finally:
+            limiter.release(host)
+
+    seen = {start_url}
+    frontier = []
+
+    def _enqueue(urls):
+        for url in urls:
+            if url and url not in seen and _site_host(url) == site:
+                seen.add(url)
+                frontier.append(url)
+        frontier.sort(key=_link_priority)
+
+    # Seed from the sitemap(s) while the start page is fetched
+    parsed = urlparse(start_url)
+    sitemap_queue = [f"{parsed.scheme}://{parsed.netloc}/sitemap.xml"]
+    start_task = asyncio.ensure_future(_fetch(start_url))
+    for _ in range(MAX_SITEMAPS):
+        if not sitemap_queue:
+            break
+        sitemap = await _fetch(sitemap_queue.pop(0))
+        if sitemap:
+            page_urls, nested = _parse_sitemap(sitemap["content"])
+            _enqueue(_normalize_link(start_url, url) for url in page_urls)
+            sitemap_queue.extend(nested)
+
+    pages = []
+    total_bytes = 0
+    in_flight = {start_task: start_url}
+    while in_flight:
+        done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            url = in_flight.pop(task)
+            page = task.result()
+            if not page or "html" not in (page["content_type"] or "text/html"):
+                continue
+            total_bytes += len(page["content"])
+            pages.append({"url": url, "html": page["content"]})
+            _enqueue(_extract_links(url, page["content"]))
+
+        while (frontier and len(in_flight) < concurrency
+               and len(pages) + len(in_flight) < max_pages and total_bytes < max_total_bytes):
+            url = frontier.pop(0)
+            in_flight[asyncio.ensure_future(_fetch(url))] = url
+
+    pages.sort(key=lambda page: (page["url"] != start_url, _link_priority(page["url"])))
+    return pages
+
+
+def _shingles(text, size=5):
+    words = text.lower().split()
+    return {
+        hashlib.blake2b(" ".join(words[i:i + size]).encode("utf-8"), digest_size=8).digest()
+        for i in range(max(1, len(words) - size + 1))
+    }
+
+
+def merge_pages(pages):
+    """
+    Merges crawled pages into one corpus for summarization.
+    Lines repeated across many pages (navigation, footers, cookie banners) are kept only
+    on the first page they appear on, and pages that are near-duplicates of an earlier
+    page are dropped.
+    """
+    page_lines = []
+    for page in pages:
+        text = extract_text_from_html(page["html"], separator="\n")
+        page_lines.append((page["url"], text.splitlines()))
+
+    line_page_counts = {}
+    for _, lines in page_lines:
+        for line in set(lines):
+            line_page_counts[line] = line_page_counts.get(line, 0) + 1
+    boilerplate_min_pages = max(2, math.ceil(len(page_lines) * BOILERPLATE_PAGE_SHARE))
+
+    emitted_boilerplate = set()
+    kept_shingles = []
+    sections = []
+    for url, lines in page_lines:
+        kept = []
+        for line in lines:
+            if line_page_counts[line] >= boilerplate_min_pages:
+                if line in emitted_boilerplate:
+                    continue
+                emitted_boilerplate.add(line)
+            kept.append(line)
+        if not kept:
+            continue
+        text = "\n".join(kept)
+        shingles = _shingles(text)
+        if any(len(shingles & other) / len(shingles | other) >= NEAR_DUPLICATE_THRESHOLD for other in kept_shingles):
+            continue
+        kept_shingles.append(shingles)
+        sections.append(f"Page: {url}\n{text}")
+    return "\n\n".join(sections)
+
+
+def crawl_site_text(start_url, **crawl_options):
+    """Crawls the site and returns the merged, de-duplicated text, or an error string."""
+    try:
+        pages = asyncio.run(crawl_site_async(start_url, **crawl_options))
+    except Exception as e:
+        return f"Error crawling site: {e}"
+    if not pages:
+        return f"Error fetching URL: no pages could be crawled from {start_url}"
+    with stage(STAGE_PARSE, start_url, pages=len(pages)):
+        return merge_pages(pages)
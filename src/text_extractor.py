@@ -1,56 +1,414 @@
-import requests
-from bs4 import BeautifulSoup
-import PyPDF2
-from pptx import Presentation
+# requests, bs4, lxml and PyPDF2 are imported inside the extractors that need them,
+# so importing this module (e.g. on every Streamlit rerun) stays cheap.
+import contextlib
+import functools
 import io
+import multiprocessing
+import os
+import posixpath
+import re
+import xml.etree.ElementTree as ET
+import zipfile
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+from src.http_fetch import fetch_url
+
+# Bump when PDF/PPTX extraction output changes, so cached file texts are not reused.
+FILE_EXTRACTOR_VERSION = 2
+# PDFs with at least this many pages are extracted in page batches across a pool's worker processes.
+PDF_PARALLEL_MIN_PAGES = 40
+PDF_PAGES_PER_BATCH = 16
+# PPTX decks with at least this many slides are parsed in slide batches across a pool's worker processes.
+PPTX_PARALLEL_MIN_SLIDES = 200
+PPTX_SLIDES_PER_BATCH = 25
+# Batches of one document queued on a pool at once; bounds memory and wasted work after an early stop.
+BATCHES_IN_FLIGHT = 8
+
+_DRAWING_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+_PRESENTATION_NS = "http://schemas.openxmlformats.org/presentationml/2006/main"
+_OFFICE_RELS_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+_PACKAGE_RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_PARAGRAPH_TAG = f"{{{_DRAWING_NS}}}p"
+_RUN_TAG = f"{{{_DRAWING_NS}}}r"
+_TEXT_TAG = f"{{{_DRAWING_NS}}}t"
+_BREAK_TAG = f"{{{_DRAWING_NS}}}br"
+
+# Bump when extraction output changes, so cached page texts are not reused.
+HTML_EXTRACTOR_VERSION = 6
+# Elements that never hold page copy; dropped from the parsed tree with their whole subtree
+# (a regex over the raw markup cannot pair nested tags of the same name).
+HTML_BOILERPLATE_TAGS = ("script", "style", "noscript", "svg", "nav", "footer", "iframe", "template")
+# Whole class/id tokens marking cookie banners, popups, share bars and similar chrome
+# ("cookie-banner" and "share_buttons" match; "has-sidebar" and "shared-layout" do not).
+_BOILERPLATE_TOKEN = re.compile(
+    r"(?:cookies?|consent|gdpr|newsletter|popup|modal|breadcrumbs?|social|share|sharing|subscribe|skip-link|sidebar)"
+    r"(?:[-_](?:banner|bar|notice|popup|modal|overlay|box|container|wrapper|links|buttons|icons|form))?",
+    re.IGNORECASE
+)
+_KEEP_ELEMENTS = ("html", "body", "main", "article")
+# Usually a search box or signup form, but ASP.NET pages wrap the whole body in one <form>,
+# so forms are dropped like class/id chrome (kept when they hold the content, and by the fallback).
+_BOILERPLATE_ELEMENTS = ("form",)
+# <main>/<article> content shorter than this is not trusted as the page's main content.
+MAIN_CONTENT_MIN_CHARS = 200
+# Text nodes are split into chunks at line breaks and runs of two or more spaces.
+_CHUNK_BREAK = re.compile(r"\n| {2,}")
+
+
+@functools.lru_cache(maxsize=1)
+def _lxml_available():
+    try:
+        import lxml.html # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _decode_html(html):
+    if isinstance(html, str):
+        return html
+    try:
+        return html.decode("utf-8")
+    except UnicodeDecodeError:
+        from bs4 import UnicodeDammit
+
+        return UnicodeDammit(html).unicode_markup or ""
+
+
+def _is_boilerplate_element(tag_name, attributes):
+    """Whether an element is a form, or is not a content container and a class/id token marks it as chrome."""
+    if tag_name in _KEEP_ELEMENTS:
+        return False
+    if tag_name in _BOILERPLATE_ELEMENTS:
+        return True
+    classes = attributes.get("class") or ""
+    if not isinstance(classes, str): # bs4 gives class as a list
+        classes = " ".join(classes)
+    tokens = f"{classes} {attributes.get('id') or ''}".split()
+    return any(_BOILERPLATE_TOKEN.fullmatch(token) for token in tokens)
+
+
+def _outermost(elements, ancestors):
+    """Drops elements nested in another of the elements, so nested <main>/<article> text is not repeated."""
+    element_ids = {id(element) for element in elements}
+    return [element for element in elements if not any(id(parent) in element_ids for parent in ancestors(element))]
+
+
+def _main_text_lxml(markup, separator, drop_boilerplate=True):
+    import lxml.html
+    from lxml import etree
+
+    root = lxml.html.document_fromstring(markup)
+    etree.strip_elements(root, etree.Comment, *HTML_BOILERPLATE_TAGS, with_tail=False)
+    if drop_boilerplate:
+        for element in [element for element in root.iter(etree.Element) if _is_boilerplate_element(element.tag, element.attrib)]:
+            if not element.xpath(".//main | .//article | .//*[@role='main']"): # Never drop the page's content
+                element.drop_tree()
+    texts = []
+    for candidates in (root.xpath("//main | //*[@role='main']"), root.xpath("//article"), [root]):
+        candidates = _outermost(candidates, lambda element: element.iterancestors())
+        texts = [separator.join(candidate.itertext()) for candidate in candidates]
+        if sum(len(text) for text in texts) >= MAIN_CONTENT_MIN_CHARS:
+            break
+    return "\n".join(texts)
+
+
+def _main_text_bs4(markup, separator, drop_boilerplate=True):
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(markup, "html.parser")
+    for element in soup(list(HTML_BOILERPLATE_TAGS)):
+        element.decompose()
+    if drop_boilerplate:
+        for element in soup.find_all(lambda element: _is_boilerplate_element(element.name, element.attrs)):
+            if not element.decomposed and not element.find(["main", "article"]) and not element.find(attrs={"role": "main"}):
+                element.decompose()
+    texts = []
+    main_elements = soup.find_all(lambda element: element.name == "main" or element.get("role") == "main")
+    for candidates in (main_elements, soup.find_all("article"), [soup]):
+        candidates = _outermost(candidates, lambda element: element.parents)
+        texts = [candidate.get_text(separator) for candidate in candidates]
+        if sum(len(text) for text in texts) >= MAIN_CONTENT_MIN_CHARS:
+            break
+    return "\n".join(texts)
+
+
+def extract_text_from_html(html, separator="", engine=None):
+    """
+    Extracts the readable main content of an HTML document (bytes or str).
+    Script, navigation, footer and similar elements and comments are dropped from the
+    parsed tree, forms, cookie banners and other chrome are dropped by tag or class/id, and <main> (or the
+    <article> elements) is used instead of the whole body when it holds enough text. If
+    dropping chrome leaves less than MAIN_CONTENT_MIN_CHARS, the unfiltered text is used.
+    Pass separator="\n" to keep every text node on its own line. engine is "lxml" (the
+    default when installed) or "bs4" (BeautifulSoup's html.parser).
+    """
+    markup = _decode_html(html)
+    if not markup.strip():
+        return ""
+    engine = engine or ("lxml" if _lxml_available() else "bs4")
+    main_text = _main_text_lxml if engine == "lxml" else _main_text_bs4
+    text = main_text(markup, separator)
+    if len(text.strip()) < MAIN_CONTENT_MIN_CHARS:
+        text = max(text, main_text(markup, separator, drop_boilerplate=False), key=lambda text: len(text.strip()))
+    # One pass: break multi-headlines and lines into chunks, strip them and drop blanks
+    return "\n".join(chunk for chunk in (chunk.strip() for chunk in _CHUNK_BREAK.split(text)) if chunk)
 
 def extract_text_from_url(url):
     """Extracts text content from a URL."""
+    import requests
+
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
-        
-        # Remove script and style elements
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-        
-        # Get text
-        text = soup.get_text()
-        
-        # Break into lines and remove leading/trailing space on each
-        lines = (line.strip() for line in text.splitlines())
-        # Break multi-headlines into a line each
-        chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
-        # Drop blank lines
-        text = '\n'.join(chunk for chunk in chunks if chunk)
-        return text
+        page = fetch_url(url)
+        return extract_text_from_html(page["content"])
     except requests.exceptions.RequestException as e:
         return f"Error fetching URL: {e}"
     except Exception as e:
         return f"Error parsing URL content: {e}"
 
-def extract_text_from_pdf(file_obj):
-    """Extracts text from an uploaded PDF file object."""
+_worker_pdf = None # (path, mtime, size) and the open reader of the PDF a pool worker last read pages from
+
+
+def _extract_pdf_page_range(path, start, stop):
+    """Worker-process entry point: extracts pages [start, stop) of a PDF on disk, opening it once per worker."""
+    global _worker_pdf
+    import PyPDF2
+
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if _worker_pdf is None or _worker_pdf[0] != key:
+        _worker_pdf = (key, PyPDF2.PdfReader(path))
+    pages = _worker_pdf[1].pages
+    return [pages[page_num].extract_text() or "" for page_num in range(start, stop)]
+
+def _pdf_page_batches(path):
+    """(worker, args) page-range batches for a PDF of at least PDF_PARALLEL_MIN_PAGES pages, else None."""
+    import PyPDF2
+
+    page_count = len(PyPDF2.PdfReader(path).pages)
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        return None
+    return [(_extract_pdf_page_range, (path, start, min(start + PDF_PAGES_PER_BATCH, page_count)))
+            for start in range(0, page_count, PDF_PAGES_PER_BATCH)]
+
+def _join_pdf_pages(page_texts, max_chars=None):
+    """Joins page texts, reading no further pages once max_chars characters have been collected."""
+    parts = []
+    char_count = 0
+    for page_text in page_texts:
+        parts.append(page_text)
+        char_count += len(page_text)
+        if max_chars is not None and char_count >= max_chars:
+            break
+    text = "".join(parts)
+    return text[:max_chars] if max_chars is not None else text
+
+def process_pool_context():
+    """
+    The multiprocessing context for extraction pools. Pools are started from threads of the
+    multi-threaded Streamlit server, and forking such a process can deadlock the child, so
+    workers come from a fork server (or are spawned where that is unavailable).
+    """
+    start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(start_method)
+
+def _iter_batch_results(executor, batches):
+    """
+    Runs each (worker, args) batch on executor and yields the items of each batch's result in
+    order, keeping a bounded window of batches in flight. Closing the generator cancels the
+    batches that have not started.
+    """
+    pending = deque()
+    batches = iter(batches)
+    try:
+        while True:
+            for batch_worker, args in batches:
+                pending.append(executor.submit(batch_worker, *args))
+                if len(pending) >= BATCHES_IN_FLIGHT:
+                    break
+            if not pending:
+                break
+            yield from pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def extract_text_from_pdf(file_obj, max_chars=None):
+    """
+    Extracts text from an uploaded PDF file object.
+    Stops reading pages once max_chars characters have been collected. See
+    extract_text_from_path for splitting a large PDF across worker processes.
+    """
+    import PyPDF2
+
     try:
         pdf_reader = PyPDF2.PdfReader(file_obj)
-        text = ""
-        for page_num in range(len(pdf_reader.pages)):
-            page = pdf_reader.pages[page_num]
-            text += page.extract_text()
-        return text
+        return _join_pdf_pages((page.extract_text() or "" for page in pdf_reader.pages), max_chars)
     except Exception as e:
         return f"Error reading PDF: {e}"
 
-def extract_text_from_pptx(file_obj):
-    """Extracts text from an uploaded PPTX file object."""
+def _pptx_part_path(base_part, target):
+    """Resolves a relationship target (relative to base_part's folder) to a zip member name."""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+
+def _pptx_relationships(archive, part):
+    """{relationship id: (type, zip member name)} for a part, from its _rels file."""
+    rels_path = posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+    if rels_path not in archive.NameToInfo:
+        return {}
+    root = ET.fromstring(archive.read(rels_path))
+    return {
+        rel.get("Id"): (rel.get("Type", "").rsplit("/", 1)[-1], _pptx_part_path(part, rel.get("Target", "")))
+        for rel in root.iter(f"{{{_PACKAGE_RELS_NS}}}Relationship")
+        if rel.get("TargetMode") != "External"
+    }
+
+
+def _pptx_slide_parts(archive):
+    """Yields (slide XML, notes XML or None) member names in presentation order."""
+    presentation_part = "ppt/presentation.xml"
+    relationships = _pptx_relationships(archive, presentation_part)
+    root = ET.fromstring(archive.read(presentation_part))
+    for slide_id in root.iter(f"{{{_PRESENTATION_NS}}}sldId"):
+        rel_type, slide_part = relationships.get(slide_id.get(f"{{{_OFFICE_RELS_NS}}}id"), (None, None))
+        if rel_type != "slide" or slide_part not in archive.NameToInfo:
+            continue
+        notes_part = next((target for kind, target in _pptx_relationships(archive, slide_part).values()
+                           if kind == "notesSlide" and target in archive.NameToInfo), None)
+        yield slide_part, notes_part
+
+
+def _pptx_paragraphs(xml_source):
+    """
+    Streams the text paragraphs of a slide or notes part (bytes or a file object) in document
+    order, which covers text boxes, grouped shapes and table cells alike. Fields such as slide
+    numbers and dates are skipped. Parsed elements are cleared as it goes.
+    """
+    if isinstance(xml_source, bytes):
+        xml_source = io.BytesIO(xml_source)
+    for _, element in ET.iterparse(xml_source, events=("end",)):
+        if element.tag != _PARAGRAPH_TAG:
+            continue
+        parts = []
+        for child in element:
+            if child.tag == _RUN_TAG:
+                parts.append("".join(text.text or "" for text in child.iter(_TEXT_TAG)))
+            elif child.tag == _BREAK_TAG:
+                parts.append("\n")
+        text = "".join(parts).strip()
+        element.clear()
+        if text:
+            yield text
+
+
+def _pptx_slide_text(slide_xml, notes_xml):
+    """One slide's text, with its speaker notes (if any) after the slide's own text."""
+    text = "\n".join(_pptx_paragraphs(slide_xml))
+    notes = "\n".join(_pptx_paragraphs(notes_xml)) if notes_xml else ""
+    return f"{text}\nNotes: {notes}" if notes else text
+
+
+def _extract_pptx_slide_batch(path, slide_parts):
+    """
+    Worker-process entry point: extracts a batch of (slide, notes or None) parts of a PPTX on
+    disk. Only those parts are read from the zip, never the deck's (possibly heavy) media.
+    """
+    with zipfile.ZipFile(path) as archive:
+        return [_pptx_slide_text(archive.open(slide_part), archive.read(notes_part) if notes_part else None)
+                for slide_part, notes_part in slide_parts]
+
+
+def _pptx_slide_batches(path):
+    """(worker, args) slide batches for a deck of at least PPTX_PARALLEL_MIN_SLIDES slides, else None."""
+    with zipfile.ZipFile(path) as archive:
+        slide_parts = list(_pptx_slide_parts(archive))
+    if len(slide_parts) < PPTX_PARALLEL_MIN_SLIDES:
+        return None
+    return [(_extract_pptx_slide_batch, (path, slide_parts[start:start + PPTX_SLIDES_PER_BATCH]))
+            for start in range(0, len(slide_parts), PPTX_SLIDES_PER_BATCH)]
+
+
+def _join_pptx_slides(slide_texts, max_chars=None):
+    """Joins non-empty slide texts by line, reading no further slides once max_chars characters have been collected."""
+    parts = []
+    char_count = 0
+    for slide_text in slide_texts:
+        if not slide_text:
+            continue
+        parts.append(slide_text)
+        char_count += len(slide_text) + 1
+        if max_chars is not None and char_count >= max_chars:
+            break
+    text = "\n".join(parts)
+    return text[:max_chars] if max_chars is not None else text
+
+
+def extract_text_from_pptx(file_obj, max_chars=None):
+    """
+    Extracts the text of every slide (text boxes, grouped shapes and tables) and its speaker
+    notes from an uploaded PPTX file object. Slide and notes XML are streamed straight out of
+    the zip container, so embedded images and video are never read and memory stays flat.
+    Stops once max_chars characters have been collected. See extract_text_from_path for
+    splitting a large deck across worker processes.
+    """
     try:
-        prs = Presentation(file_obj)
-        text = []
-        for slide in prs.slides:
-            for shape in slide.shapes:
-                if hasattr(shape, "text"):
-                    text.append(shape.text)
-        return "\n".join(text)
+        with zipfile.ZipFile(file_obj) as archive:
+            return _join_pptx_slides(
+                (_pptx_slide_text(archive.open(slide_part), archive.read(notes_part) if notes_part else None)
+                 for slide_part, notes_part in _pptx_slide_parts(archive)),
+                max_chars
+            )
     except Exception as e:
-        return f"Error reading PPTX: {e}"
\ No newline at end of file
+        return f"Error reading PPTX: {e}"
+
+# File extension -> extractor(file_obj, max_chars=None). Each extractor imports its parsing
+# library on first call, so unused file types never load theirs.
+FILE_EXTRACTORS = {
+    'pdf': extract_text_from_pdf,
+    'pptx': extract_text_from_pptx,
+}
+
+def get_file_extractor(ext):
+    """Returns the extractor registered for a file extension, or None."""
+    return FILE_EXTRACTORS.get(ext.lower().lstrip('.'))
+
+# File extension -> (batch planner(path), joiner(texts, max_chars)) for extractors that can split
+# one large document across a pool's worker processes. The planner returns None for documents
+# too small to be worth splitting.
+FILE_BATCH_SPLITTERS = {
+    'pdf': (_pdf_page_batches, _join_pdf_pages),
+    'pptx': (_pptx_slide_batches, _join_pptx_slides),
+}
+
+def extract_text_from_path(path, ext, max_chars=None, executor=None):
+    """
+    Extracts text from a PDF/PPTX file on disk based on the file extension.
+    Takes a path so it can run in a worker process without copying the file's bytes there.
+    With executor (a process pool), a large document is split into page/slide batches that run
+    across its workers, and any other document is extracted whole in one worker.
+    """
+    extractor = get_file_extractor(ext)
+    if extractor is None:
+        return ""
+    ext = ext.lower().lstrip('.')
+    if executor is not None:
+        plan_batches, join_texts = FILE_BATCH_SPLITTERS.get(ext, (None, None))
+        try:
+            batches = plan_batches(path) if plan_batches else None
+        except Exception:
+            batches = None # Unreadable here; the whole-document extractor reports the error
+        if batches is None:
+            return executor.submit(extract_text_from_path, path, ext, max_chars).result()
+        with contextlib.closing(_iter_batch_results(executor, batches)) as texts:
+            try:
+                return join_texts(texts, max_chars)
+            except BrokenProcessPool:
+                raise # The caller falls back to extracting on its own thread
+            except Exception as e:
+                return f"Error reading {ext.upper()}: {e}"
+    with open(path, "rb") as f:
+        return extractor(f, max_chars=max_chars)
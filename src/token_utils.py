@@ -0,0 +1,75 @@
+# Rough characters-per-token ratio for English text when tiktoken is unavailable.
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Loads tiktoken on first use; it is optional and falls back to a character-based estimate."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception: # Not installed, or encoding files not downloadable offline
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text):
+    """Counts tokens locally with tiktoken, or estimates them from the character count."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_text_into_token_chunks(text, chunk_tokens, overlap_tokens=0):
+    """
+    Splits text into chunks of at most chunk_tokens tokens, breaking on paragraph and line
+    boundaries where possible. Consecutive chunks share about overlap_tokens of context.
+    """
+    if count_tokens(text) <= chunk_tokens:
+        return [text] if text else []
+
+    # Split into pieces no larger than a chunk: paragraphs, then lines, then hard character cuts
+    pieces = []
+    for paragraph in text.split("\n\n"):
+        if count_tokens(paragraph) <= chunk_tokens:
+            pieces.append(paragraph)
+            continue
+        for line in paragraph.split("\n"):
+            if count_tokens(line) <= chunk_tokens:
+                pieces.append(line)
+                continue
+            step = chunk_tokens * CHARS_PER_TOKEN
+            pieces.extend(line[i:i + step] for i in range(0, len(line), step))
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > chunk_tokens:
+            chunks.append("\n\n".join(current))
+            # Carry the tail of the previous chunk forward as overlap
+            carried = []
+            carried_tokens = 0
+            for previous in reversed(current):
+                previous_tokens = count_tokens(previous)
+                if carried_tokens + previous_tokens > overlap_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous_tokens
+            if carried_tokens + piece_tokens > chunk_tokens:
+                carried, carried_tokens = [], 0
+            current, current_tokens = carried, carried_tokens
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
@@ -1,6 +1,14 @@
+import contextvars
+import logging
 import re
+import threading
 from urllib.parse import urlparse
 
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+logger = logging.getLogger(__name__)
+
 def validate_url(url):
     """Validate and prepend http:// if scheme is missing."""
     if not url:
@@ -31,4 +39,31 @@ def get_active_lead_objective_link(lead_objective_type, demo_link, sales_link):
         return demo_link
     elif lead_objective_type == "Sales Meeting":
         return sales_link
-    return "" # Should not happen if inputs are validated
\ No newline at end of file
+    return "" # Should not happen if inputs are validated
+
+def worker_thread_initializer():
+    """
+    Returns a thread pool initializer that attaches the calling Streamlit script context
+    to each worker thread, so st.* calls made from workers still render, and copies the
+    caller's context variables (e.g. the active run trace) into the worker.
+    """
+    ctx = get_script_run_ctx(suppress_warning=True) # None in background jobs and the batch CLI
+    context = contextvars.copy_context()
+    def _attach():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        for var, value in context.items():
+            var.set(value)
+    return _attach
+
+def report_error(message, details=None, details_label="Details:"):
+    """
+    Shows an error in the Streamlit page when running inside the app, and logs it otherwise
+    (e.g. from the batch CLI), so shared code can report problems either way.
+    """
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        st.error(message)
+        if details:
+            st.text_area(details_label, details, height=200)
+    else:
+        logger.error("%s%s", message, f"\n{details}" if details else "")
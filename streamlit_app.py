@@ -1,13 +1,15 @@
 import streamlit as st
-from src.text_extractor import extract_text_from_url, extract_text_from_pdf, extract_text_from_pptx
-from src.openai_handler import (
-    get_openai_client, summarize_text_with_ai, generate_content_with_ai,
-    create_email_prompt, create_linkedin_facebook_prompt,
-    create_google_search_prompt, create_google_display_prompt
-)
-from src.excel_generator import create_excel_file
-from src.utils import validate_url, get_company_name_from_url, get_active_lead_objective_link
-import time
+from src.openai_handler import get_openai_client
+from src.ad_generator import DEFAULT_MAX_CONCURRENT_GENERATIONS
+from src.site_crawler import DEFAULT_MAX_PAGES
+from src.context_compactor import DEFAULT_CONTEXT_TOKEN_BUDGET
+from src.pipeline import prepare_job, LEAD_OBJECTIVE_TYPES
+from src.text_extractor import FILE_EXTRACTORS
+from src.job_runner import get_job_runner, FINISHED_STATUSES, JOB_DONE, JOB_FAILED
+from src.instrumentation import prometheus_text, trace_json
+from src.rate_limiter import get_scheduler
+
+JOB_POLL_INTERVAL_SECONDS = 1
 
 st.set_page_config(layout="wide")
 st.title("🚀 Branding & Marketing Ad Content Generator")
@@ -15,230 +17,192 @@ st.title("🚀 Branding & Marketing Ad Content Generator")
 # --- Inputs ---
 st.sidebar.header("Client Context & Materials")
 client_url = st.sidebar.text_input("Client's Website URL (e.g., https://www.example.com)")
-additional_context_file = st.sidebar.file_uploader("Upload Additional Context (PDF or PPTX)", type=['pdf', 'pptx'])
-downloadable_material_file = st.sidebar.file_uploader("Upload Downloadable Lead Material (PDF, Ebook as PDF/PPTX)", type=['pdf', 'pptx'])
+crawl_site = st.sidebar.checkbox("Also read product, pricing and case-study pages from the same site")
+crawl_max_pages = st.sidebar.slider("Max Pages to Crawl", 2, 50, DEFAULT_MAX_PAGES, disabled=not crawl_site)
+additional_context_files = st.sidebar.file_uploader(
+    "Upload Additional Context (PDF or PPTX decks, case studies...)", type=list(FILE_EXTRACTORS), accept_multiple_files=True
+)
+downloadable_material_files = st.sidebar.file_uploader(
+    "Upload Downloadable Lead Material (PDF, Ebook as PDF/PPTX)", type=list(FILE_EXTRACTORS), accept_multiple_files=True
+)
 
 st.sidebar.header("Campaign Options & Links")
-lead_objective_type = st.sidebar.selectbox("Primary Lead Objective", ["Demo Booking", "Sales Meeting"])
+lead_objective_type = st.sidebar.selectbox("Primary Lead Objective", LEAD_OBJECTIVE_TYPES)
 learn_more_link = st.sidebar.text_input("Link for 'Learn More' (Brand Awareness CTAs)")
 downloadable_material_link_input = st.sidebar.text_input("Link to Downloadable Material (Demand Gen CTAs)")
 demo_booking_link = st.sidebar.text_input("Link for Demo Booking (Demand Capture CTAs)")
 sales_meeting_link = st.sidebar.text_input("Link for Sales Meeting (Demand Capture CTAs)")
 
 content_count = st.sidebar.slider("Number of Ad Variations per Objective", 1, 20, 10)
+context_token_budget = st.sidebar.slider("Context Token Budget per Prompt", 1000, 16000, DEFAULT_CONTEXT_TOKEN_BUDGET, step=500)
+max_concurrent_generations = st.sidebar.slider("Parallel AI Requests", 1, 9, DEFAULT_MAX_CONCURRENT_GENERATIONS)
+stream_generations = st.sidebar.checkbox("Show ads as they are generated", value=True)
+
+job_runner = get_job_runner()
+job_id = st.session_state.get("job_id")
+job_state = job_runner.get(job_id) if job_id else None
+job_in_progress = job_state is not None and job_state["status"] not in FINISHED_STATUSES
+
+generate_button = st.sidebar.button("✨ Generate Ad Content", type="primary", disabled=job_in_progress)
+
+
+def show_job_progress(job_state):
+    progress_percentage = min(100, int((job_state["steps_done"] / job_state["total_steps"]) * 100))
+    if job_state["status"] == JOB_DONE:
+        progress_percentage = 100
+    elif job_state["status"] == JOB_FAILED:
+        progress_percentage = 0
+    if job_state["status"] not in FINISHED_STATUSES:
+        st.info(f"⏳ {job_state['message']}")
+    st.progress(progress_percentage)
+
+    if job_state["streamed_items"]:
+        preview_rows = []
+        for label, item in job_state["streamed_items"]:
+            # Streamed items are ad objects, or plain headline/description strings for Google ads
+            if isinstance(item, dict):
+                version = item.get("version", "")
+                text = item.get("headline") or item.get("subject_line") or ""
+            else:
+                version, text = None, item
+            preview_rows.append({"Channel": label, "Version #": version, "Headline": text})
+        st.dataframe(preview_rows, width="stretch", hide_index=True)
+    for warning in job_state["warnings"]:
+        st.warning(warning)
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL_SECONDS)
+def poll_job(job_id):
+    # Reruns on its own every few seconds; widget interactions elsewhere no longer interrupt the job
+    job_state = job_runner.get(job_id)
+    if job_state is None:
+        return
+    show_job_progress(job_state)
+    if job_state["status"] in FINISHED_STATUSES:
+        st.rerun(scope="app") # Render the results (and the sidebar download) in a full run
+
+
+def show_job_result(result):
+    if result["limit_violations"]:
+        st.warning(
+            f"{len(result['limit_violations'])} fields are outside their character limits even after a rewrite; "
+            "they are highlighted in red in the Excel file."
+        )
+    if result["cache_stats"]:
+        cache_stats = result["cache_stats"]
+        st.caption(
+            f"Context cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+            f"({cache_stats['entries']} entries, {cache_stats['bytes'] / 1e6:.1f} MB on disk)"
+        )
+    if result["compaction_stats"]:
+        compaction_stats = result["compaction_stats"]
+        st.caption(
+            f"Context compacted from {compaction_stats['original_tokens']:,} to {compaction_stats['compacted_tokens']:,} tokens "
+            f"per prompt ({compaction_stats['duplicates_removed']} repeated facts removed), "
+            f"saving ~{compaction_stats['tokens_saved_per_run']:,} input tokens this run."
+        )
+    if result["rate_limit_stats"] and result["rate_limit_stats"]["retries"] + result["rate_limit_stats"]["throttled"]:
+        rate_limit_stats = result["rate_limit_stats"]
+        st.caption(
+            f"OpenAI rate limits: {rate_limit_stats['retries']} retries, {rate_limit_stats['throttled']} calls queued "
+            f"for {rate_limit_stats['total_wait_seconds']:.1f}s in total (peak queue depth {rate_limit_stats['max_queue_depth']})."
+        )
+    if result["generation_usage"]:
+        prompt_tokens = sum(usage["prompt_tokens"] for usage in result["generation_usage"].values())
+        cached_tokens = sum(usage["cached_tokens"] for usage in result["generation_usage"].values())
+        call_count = sum(usage["calls"] for usage in result["generation_usage"].values())
+        st.caption(
+            f"Generation prompts: {prompt_tokens:,} input tokens over {call_count} calls, "
+            f"{cached_tokens:,} served from the provider's prompt cache."
+        )
+    if result["trace"]:
+        trace = result["trace"]
+        with st.expander(f"Run Timings ({trace['wall_seconds']:.1f}s total)"):
+            st.dataframe(
+                [{"Stage": stage_name, "Calls": summary["calls"], "Total (s)": round(summary["seconds"], 2),
+                  "Slowest (s)": round(summary["max_seconds"], 2)} for stage_name, summary in trace["stages"].items()],
+                hide_index=True
+            )
+            st.dataframe(
+                [{"Counter": counter["name"], "Labels": ", ".join(f"{k}={v}" for k, v in counter["labels"].items()),
+                  "Value": counter["value"]} for counter in trace["counters"]],
+                hide_index=True
+            )
+            trace_column, metrics_column = st.columns(2)
+            trace_column.download_button(
+                "Download JSON Trace", trace_json(trace), file_name=f"{result['company_name']}_trace.json",
+                mime="application/json"
+            )
+            metrics_column.download_button(
+                "Download Prometheus Metrics", prometheus_text([trace], get_scheduler().metrics()),
+                file_name=f"{result['company_name']}_metrics.prom", mime="text/plain"
+            )
+    if result["context"]:
+        st.expander("View Comprehensive Context Summary Used for Ad Generation").markdown(result["context"])
 
-generate_button = st.sidebar.button("✨ Generate Ad Content", type="primary")
+    if result["excel_bytes"]:
+        st.sidebar.download_button(
+            label="📥 Download Ad Content XLSX",
+            data=result["excel_bytes"],
+            file_name=result["file_name"],
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 
-# --- Main Area for Progress and Download ---
-status_placeholder = st.empty()
-progress_bar = st.progress(0)
 
 if generate_button:
-    # Validate inputs
-    client_url = validate_url(client_url)
-    learn_more_link = validate_url(learn_more_link)
-    downloadable_material_link_input = validate_url(downloadable_material_link_input)
-    demo_booking_link = validate_url(demo_booking_link)
-    sales_meeting_link = validate_url(sales_meeting_link)
-
-    active_lead_link = get_active_lead_objective_link(lead_objective_type, demo_booking_link, sales_meeting_link)
-
-    if not client_url:
-        st.sidebar.error("Please provide a valid client website URL.")
-    elif not active_lead_link:
-        st.sidebar.error(f"Please provide the link for '{lead_objective_type}'.")
-    elif not learn_more_link:
-        st.sidebar.error("Please provide the 'Learn More' link.")
-    elif not downloadable_material_link_input:
-        st.sidebar.error("Please provide the link to the downloadable material.")
+    crawl_options = {"max_pages": crawl_max_pages} if crawl_site else None
+    job, job_error = prepare_job(
+        client_url, lead_objective_type, learn_more_link, downloadable_material_link_input,
+        demo_booking_link, sales_meeting_link, content_count,
+        additional_context_files, downloadable_material_files, crawl_options,
+        context_token_budget, max_concurrent_generations, stream_generations=stream_generations
+    )
+
+    if job_error:
+        st.sidebar.error(job_error)
     else:
         openai_client = get_openai_client()
         if not openai_client:
             st.stop()
+        st.session_state["job_id"] = job_runner.submit(openai_client, job)
+        st.rerun()
 
-        company_name_for_file = get_company_name_from_url(client_url)
-        all_summaries = []
-        total_steps = 3 + 1 + 3 + 3 + 1 + 1 # Summaries + Email + LinkedIn(3) + Facebook(3) + GSearch + GDisplay
-        
-        # Use a list to hold the current step, making it mutable from the inner function
-        current_step_tracker = [0] 
-
-        def update_progress(step_increment=1, message=""):
-            # Modify the content of the list; no 'nonlocal' needed
-            current_step_tracker[0] += step_increment
-            progress_percentage = int((current_step_tracker[0] / total_steps) * 100)
-            if progress_percentage > 100: # Cap progress at 100%
-                progress_percentage = 100
-            progress_bar.progress(progress_percentage)
-            if message:
-                status_placeholder.info(f"⏳ {message}")
-            time.sleep(0.1) # Small delay for UI update
-
-        # 1. Extract and Summarize Context
-        update_progress(0, "Starting content extraction and summarization...") # Initial call, step_increment is 0
-        if client_url:
-            update_progress(0, f"Extracting content from URL: {client_url}...")
-            url_text = extract_text_from_url(client_url)
-            if url_text and not url_text.startswith("Error"):
-                update_progress(0, "Summarizing URL content with AI...")
-                url_summary = summarize_text_with_ai(openai_client, url_text, "website content")
-                if url_summary: all_summaries.append(f"Website Summary:\n{url_summary}")
-            else:
-                status_placeholder.warning(f"Could not extract significant content from URL or error occurred: {url_text}")
-        update_progress(1) # Step for URL processing
-
-        if additional_context_file:
-            update_progress(0, f"Extracting content from additional context file: {additional_context_file.name}...")
-            ext = additional_context_file.name.split('.')[-1].lower()
-            additional_text = ""
-            if ext == 'pdf':
-                additional_text = extract_text_from_pdf(additional_context_file)
-            elif ext == 'pptx':
-                additional_text = extract_text_from_pptx(additional_context_file)
-            
-            if additional_text and not additional_text.startswith("Error"):
-                update_progress(0, "Summarizing additional context with AI...")
-                additional_summary = summarize_text_with_ai(openai_client, additional_text, "additional context document")
-                if additional_summary: all_summaries.append(f"Additional Context Summary:\n{additional_summary}")
-            else:
-                 status_placeholder.warning(f"Could not extract text from additional context file or error occurred: {additional_text}")
-        update_progress(1) # Step for additional context
-
-        if downloadable_material_file:
-            update_progress(0, f"Extracting content from downloadable material: {downloadable_material_file.name}...")
-            ext = downloadable_material_file.name.split('.')[-1].lower()
-            downloadable_text = ""
-            if ext == 'pdf':
-                downloadable_text = extract_text_from_pdf(downloadable_material_file)
-            elif ext == 'pptx':
-                downloadable_text = extract_text_from_pptx(downloadable_material_file)
-
-            if downloadable_text and not downloadable_text.startswith("Error"):
-                update_progress(0, "Summarizing downloadable material with AI...")
-                downloadable_summary = summarize_text_with_ai(openai_client, downloadable_text, "downloadable lead material")
-                if downloadable_summary: all_summaries.append(f"Downloadable Material Summary:\n{downloadable_summary}")
-            else:
-                status_placeholder.warning(f"Could not extract text from downloadable material or error occurred: {downloadable_text}")
-        update_progress(1) # Step for downloadable material
-
-        if not all_summaries:
-            status_placeholder.error("No context could be summarized. Please provide a valid URL or upload context files.")
-            progress_bar.progress(0) # Reset progress bar
-            st.stop()
-        
-        comprehensive_context = "\n\n---\n\n".join(all_summaries)
-        st.expander("View Comprehensive Context Summary Used for Ad Generation").markdown(comprehensive_context)
-
-        # 2. Generate Ad Content
-        ad_data_for_excel = {}
-        
-        # Email
-        update_progress(0, "Generating Email content...")
-        email_prompt = create_email_prompt(comprehensive_context, active_lead_link, content_count)
-        email_content = generate_content_with_ai(openai_client, email_prompt)
-        if email_content and 'emails' in email_content:
-            ad_data_for_excel['email'] = email_content['emails']
-        else:
-            status_placeholder.warning("Failed to generate Email content or received unexpected format.")
-        update_progress(1)
-
-        # LinkedIn
-        linkedin_ads_all_objectives = []
-        linkedin_objectives = {
-            "Brand Awareness": {"link": learn_more_link, "cta": ["Learn More", ""]},
-            "Demand Gen": {"link": downloadable_material_link_input, "cta": ["Download"]},
-            "Demand Capture": {"link": active_lead_link, "cta": ["Register", "Request Demo"]}
-        }
-        for obj, details in linkedin_objectives.items():
-            update_progress(0, f"Generating LinkedIn content for {obj}...")
-            prompt = create_linkedin_facebook_prompt("LinkedIn", comprehensive_context, obj, content_count, details["link"], details["cta"])
-            content = generate_content_with_ai(openai_client, prompt)
-            if content and f'linkedin_{obj.lower().replace(" ", "_")}' in content:
-                ads = content[f'linkedin_{obj.lower().replace(" ", "_")}']
-                for ad in ads: 
-                    ad['objective_type'] = obj
-                    ad['destination_link'] = details["link"]
-                linkedin_ads_all_objectives.extend(ads)
-            else:
-                status_placeholder.warning(f"Failed to generate LinkedIn {obj} content or received unexpected format.")
-            update_progress(1)
-        if linkedin_ads_all_objectives:
-            ad_data_for_excel['linkedin'] = linkedin_ads_all_objectives
-        
-        # Facebook
-        facebook_ads_all_objectives = []
-        facebook_objectives = {
-            "Brand Awareness": {"link": learn_more_link, "cta": ["Learn More", ""]},
-            "Demand Gen": {"link": downloadable_material_link_input, "cta": ["Download"]},
-            "Demand Capture": {"link": active_lead_link, "cta": ["Book Now"]}
-        }
-        for obj, details in facebook_objectives.items():
-            update_progress(0, f"Generating Facebook content for {obj}...")
-            prompt = create_linkedin_facebook_prompt("Facebook", comprehensive_context, obj, content_count, details["link"], details["cta"])
-            content = generate_content_with_ai(openai_client, prompt)
-            if content and f'facebook_{obj.lower().replace(" ", "_")}' in content:
-                ads = content[f'facebook_{obj.lower().replace(" ", "_")}']
-                for ad in ads: 
-                    ad['objective_type'] = obj
-                    ad['destination_link'] = details["link"]
-                facebook_ads_all_objectives.extend(ads)
-            else:
-                status_placeholder.warning(f"Failed to generate Facebook {obj} content or received unexpected format.")
-            update_progress(1)
-        if facebook_ads_all_objectives:
-            ad_data_for_excel['facebook'] = facebook_ads_all_objectives
-
-        # Google Search
-        update_progress(0, "Generating Google Search content...")
-        gsearch_prompt = create_google_search_prompt(comprehensive_context)
-        gsearch_content = generate_content_with_ai(openai_client, gsearch_prompt)
-        if gsearch_content and 'headlines' in gsearch_content and 'descriptions' in gsearch_content:
-            ad_data_for_excel['google_search'] = gsearch_content
-        else:
-            status_placeholder.warning("Failed to generate Google Search content or received unexpected format.")
-        update_progress(1)
-
-        # Google Display
-        update_progress(0, "Generating Google Display content...")
-        gdisplay_prompt = create_google_display_prompt(comprehensive_context)
-        gdisplay_content = generate_content_with_ai(openai_client, gdisplay_prompt)
-        if gdisplay_content and 'headlines' in gdisplay_content and 'descriptions' in gdisplay_content:
-            ad_data_for_excel['google_display'] = gdisplay_content
-        else:
-            status_placeholder.warning("Failed to generate Google Display content or received unexpected format.")
-        update_progress(1)
-        
-        # 3. Create Excel File
-        if ad_data_for_excel:
-            status_placeholder.info("✅ All content generated. Creating Excel file...")
-            progress_bar.progress(100) # Ensure it hits 100% at the end
-            
-            user_links_for_excel = {
-                "learn_more_link": learn_more_link,
-                "downloadable_material_link": downloadable_material_link_input,
-                "demo_booking_link": demo_booking_link,
-                "sales_meeting_link": sales_meeting_link,
-                "active_lead_objective_link": active_lead_link
-            }
-
-            excel_bytes = create_excel_file(ad_data_for_excel, company_name_for_file, user_links_for_excel)
-            
-            st.sidebar.download_button(
-                label="📥 Download Ad Content XLSX",
-                data=excel_bytes,
-                file_name=f"{company_name_for_file}_ads_creative.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-            status_placeholder.success(f"🎉 Excel file '{company_name_for_file}_ads_creative.xlsx' is ready for download from the sidebar!")
-        else:
-            status_placeholder.error("Could not generate any ad content. Please check the context and try again.")
-            progress_bar.progress(0) # Reset progress bar
+# --- Main Area for Progress and Download ---
+if job_id and job_state is None:
+    st.info("The previous generation job has expired. Generate again to get a new file.")
+    del st.session_state["job_id"]
+elif job_in_progress:
+    poll_job(job_id)
+elif job_state is not None:
+    result = job_state["result"]
+    if result and result["excel_bytes"]:
+        st.success(f"🎉 Excel file '{result['file_name']}' is ready for download from the sidebar!")
+    else:
+        st.error(job_state["error"])
+    show_job_progress(job_state)
+    if result:
+        show_job_result(result)
+    if result and result["generation_labels"]:
+        with st.expander("Regenerate a Channel"):
+            # One generation call with this run's context; only the changed workbook rows are rewritten
+            labels = result["generation_labels"]
+            task_id = st.selectbox("Channel / Objective", list(labels), format_func=labels.get)
+            versions_input = st.text_input("Only these versions (Google ads: row numbers), e.g. 2, 5 - leave empty for all")
+            if st.button("🔁 Regenerate"):
+                parts = versions_input.replace(",", " ").split()
+                not_numbers = [part for part in parts if not part.isdigit()]
+                regenerate_error = (f"Not a version number: {', '.join(not_numbers)}" if not_numbers
+                                    else job_runner.regenerate(job_id, task_id, [int(part) for part in parts]))
+                if regenerate_error:
+                    st.error(regenerate_error)
+                else:
+                    st.rerun()
 
 # Add some instructions or information
 st.markdown("""
 ---
 ### How to Use:
-1.  **Provide Context:** Enter your client's website URL. Optionally, upload PDF/PPTX files for additional company context or the content of a downloadable lead magnet (like a white paper or ebook).
+1.  **Provide Context:** Enter your client's website URL. Optionally, upload PDF/PPTX files (as many as you like) for additional company context or the content of a downloadable lead magnet (like a white paper or ebook).
 2.  **Set Campaign Options:**
     *   Choose the primary `Lead Objective` (Demo Booking or Sales Meeting). This influences the main call-to-action link in some ads.
     *   Provide specific URLs for: